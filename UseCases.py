@@ -1,7 +1,15 @@
 import streamlit as st
-import pdfplumber
 import time
 from utils import *
+from ingestion import ingest_uploaded_files
+from incremental_index import update_use_case_documents, update_library_use_case
+from ingestion_jobs import get_ingestion_job_queue, ACTIVE_STATUSES
+from document_library import get_document_library
+from telemetry import start_trace
+from request_scheduler import set_request_user
+
+# Seconds between two refreshes of the page while use cases are being created
+INGESTION_JOB_REFRESH_SECONDS = 2
 
 # App title
 st.set_page_config(page_title="📑 Use Cases")
@@ -19,15 +27,75 @@ def username_popup():
     else:
         st.error("Username cannot be empty.")
 
+# Function to queue the parsing, embedding and registration of a new use case; documents already
+# in the library are neither parsed nor embedded again
+def create_use_case(use_case_name, uploaded_files, library_documents=()):
+    try:
+        files = [(uploaded_file.name, uploaded_file.type, uploaded_file.getvalue()) for uploaded_file in uploaded_files or []]
+        get_ingestion_job_queue().submit(st.session_state.user, use_case_name, files, library_documents)
+    except Exception as e:
+        st.sidebar.error(f"Something went wrong: {e}")
+
+# Function to select documents of the user's library, returning their IDs
+def select_library_documents(label, key, exclude=()):
+    documents = get_document_library().documents(st.session_state.user)
+    options = [doc_id for doc_id in documents if doc_id not in exclude]
+    if not options:
+        return []
+    return st.multiselect(label, options, key=key,
+                          format_func=lambda doc_id: f"{documents[doc_id]['name']} "
+                                                     f"(added {time.strftime('%Y-%m-%d', time.localtime(documents[doc_id]['added_at']))})")
+
+# Function to show the documents of the user's library and the use cases referencing them
+def show_document_library():
+    documents = get_document_library().documents(st.session_state.user)
+    if documents:
+        with st.expander(f"📚 Your document library ({len(documents)} documents)"):
+            st.table(pd.DataFrame([{"Document": info["name"],
+                                    "Chunks": info["chunks"],
+                                    "Size (KB)": round(info["size"] / 1024),
+                                    "Use Cases": ", ".join(info["use_cases"])}
+                                   for info in documents.values()]))
+
+# Function to show the progress of the use cases being created, returning True while any is in progress
+def show_ingestion_jobs(jobs):
+    in_progress = False
+    for job in jobs:
+        if job["status"] == "succeeded":
+            continue
+        progress = job["progress"]
+        st.subheader(f"⏳ {job['use_case_name']}")
+        if job["status"] == "failed":
+            st.error(f"Creation failed: {job['error']}")
+            if st.button("Retry", key=f"retry_{job['id']}"):
+                get_ingestion_job_queue().retry(st.session_state.user, job["id"])
+                st.rerun()
+            continue
+        in_progress = True
+        st.progress(progress["parsed"] / max(1, len(job["files"])),
+                    text=f"Parsed {progress['parsed']} of {len(job['files'])} documents ({progress['chunked']} chunks)")
+        st.progress(progress["upserted"] / max(1, progress["chunked"]),
+                    text=f"Embedded {progress['embedded']} and stored {progress['upserted']} of {progress['chunked']} chunks")
+    return in_progress
+
+# Function to check whether a use case name is taken or being created
+def use_case_name_taken(use_case_name, use_case_df, jobs):
+    pending_names = [job["use_case_name"] for job in jobs if job["status"] in ACTIVE_STATUSES]
+    return use_case_name in use_case_df["Use Case Name"].tolist() + pending_names
+
 # Check if the username is set, otherwise show the popup
 if "user" not in st.session_state:
     username_popup()
 else:
     # App title
     st.header('📑 Your Use Cases')
+    # Model requests of this run are queued fairly with those of other users
+    set_request_user(st.session_state.user)
 
-    # Load the use case DataFrame
+    # Load the use case DataFrame and the use cases being created
     use_case_df = get_use_case_dataframe(st.session_state.user)
+    ingestion_jobs = get_ingestion_job_queue().jobs(st.session_state.user)
+    ingestion_in_progress = show_ingestion_jobs(ingestion_jobs)
 
     if "use_cases" not in st.session_state.keys():
         st.session_state['use_cases'] = use_case_df['Use Case Name'].tolist()
@@ -38,12 +106,19 @@ else:
     if "use_case_deletion" not in st.session_state.keys():
         st.session_state['use_case_deletion'] = False
 
+    if "use_case_update" not in st.session_state.keys():
+        st.session_state['use_case_update'] = False
+
     if len(use_case_df) > 0:
         st.table(use_case_df)
+        show_document_library()
 
         if st.button("Create New Use Case"):
             st.session_state['new_use_case_creation'] = True
 
+        if st.button("Update Use Case"):
+            st.session_state['use_case_update'] = True
+
         if st.button("Delete Use Case"):
             st.session_state['use_case_deletion'] = True
 
@@ -56,6 +131,8 @@ else:
                 new_file_upload = st.file_uploader("Upload your documents for analysis 👇",
                                                 accept_multiple_files=True,
                                                 type=['pdf', 'docx'])
+                # Documents already in the library, which need no parsing or embedding
+                new_library_documents = select_library_documents("Or select documents from your library", "new_library_documents")
                 # Buttons
                 col1, col2 = st.columns([1, 1])
                 with col1:
@@ -66,45 +143,70 @@ else:
                 if new_submit_button:
                     if not new_use_case_name:
                         st.error("Please enter a use case name.")
-                    elif new_use_case_name in use_case_df["Use Case Name"].tolist():
+                    elif use_case_name_taken(new_use_case_name, use_case_df, ingestion_jobs):
                         st.error("Use case already exists. Please select a new use case name.")
-                    elif not new_file_upload:
-                        st.error("Please upload at least one document.")
+                    elif not new_file_upload and not new_library_documents:
+                        st.error("Please upload or select at least one document.")
                     else:
-                        with st.spinner("Creating Use Case"):
-                            docs = []
-                            for uploaded_file in new_file_upload:
-                                if uploaded_file.type == "application/pdf":
-                                    with pdfplumber.open(uploaded_file) as pdf:
-                                        document_text = extract_text_from_pdf(pdf)
-                                        documents = text_splitter.create_documents([document_text])
-                                        for page in documents:
-                                            page.metadata = {'source': f"{uploaded_file.name}"}
-                                        docs += documents
-                                elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                                    document_text = extract_text_from_docx(uploaded_file)
-                                    documents = text_splitter.create_documents([document_text])
-                                    for page in documents:
-                                        page.metadata = {'source': f"{uploaded_file.name}"}
-                                    docs += documents
-                                else:
-                                    pass
+                        create_use_case(new_use_case_name, new_file_upload, new_library_documents)
+                        st.session_state['new_use_case_creation'] = False
+                        st.success("Use Case creation started! Its progress is shown above.")
+                        time.sleep(1)
+                        st.rerun()
+
+                if cancel_button:
+                    st.session_state['new_use_case_creation'] = False
+                    st.rerun()
+
+        if st.session_state['use_case_update']:
+            update_use_case_name = st.selectbox("Select the use case to update 👇", use_case_df['Use Case Name'].tolist())
+            update_library_documents = get_document_library().use_case_documents(st.session_state.user, update_use_case_name)
+            with st.form("update_use_case_form"):
+                st.header("Update Existing Use Case")
+                # Documents to remove from the use case
+                removed_documents = st.multiselect("Select documents to remove",
+                                                   get_use_case_documents(st.session_state.user, update_use_case_name))
+                # File uploader for documents to add, or to replace documents of the same name
+                update_file_upload = st.file_uploader("Upload documents to add or replace 👇",
+                                                      accept_multiple_files=True,
+                                                      type=['pdf', 'docx'])
+                # Use cases built from the library can also add documents of the library
+                added_library_documents = []
+                if update_library_documents is not None:
+                    added_library_documents = select_library_documents("Add documents from your library",
+                                                                       "added_library_documents", exclude=update_library_documents)
+                # Buttons
+                col1, col2 = st.columns([1, 1])
+                with col1:
+                    update_button = st.form_submit_button(label="Submit")
+                with col2:
+                    cancel_update_button = st.form_submit_button(label="Cancel")
+
+                if update_button:
+                    if not removed_documents and not update_file_upload and not added_library_documents:
+                        st.error("Please select documents to remove or upload documents to add.")
+                    else:
+                        with st.spinner("Updating Use Case"), start_trace("use_case_update"):
                             try:
-                                docs = remove_duplicate_documents(docs)
-                                docs_to_vectordb(docs, f"{st.session_state.user}_{new_use_case_name}")
+                                if update_library_documents is not None:
+                                    files = [(uploaded_file.name, uploaded_file.type, uploaded_file.getvalue())
+                                             for uploaded_file in update_file_upload or []]
+                                    update_library_use_case(st.session_state.user, update_use_case_name, files=files,
+                                                            removed_names=removed_documents,
+                                                            library_documents=added_library_documents)
+                                else:
+                                    docs = ingest_uploaded_files(update_file_upload) if update_file_upload else []
+                                    update_use_case_documents(st.session_state.user, update_use_case_name,
+                                                              docs=docs, removed_sources=removed_documents)
                             except Exception as e:
                                 st.sidebar.error(f"Something went wrong: {e}")
-
-                            add_use_case(st.session_state.user, new_use_case_name, list(set([uploaded_file.name for uploaded_file in new_file_upload])))
-                            st.session_state['use_cases'] = use_case_df['Use Case Name'].tolist()
-                            use_case_df = get_use_case_dataframe(st.session_state.user)
-                            st.session_state['new_use_case_creation'] = False
-                        st.success("Use Case Created!")
+                            st.session_state['use_case_update'] = False
+                        st.success("Use Case Updated!")
                         time.sleep(1)
                         st.rerun()
 
-                if cancel_button:
-                    st.session_state['new_use_case_creation'] = False
+                if cancel_update_button:
+                    st.session_state['use_case_update'] = False
                     st.rerun()
 
         if st.session_state['use_case_deletion']:
@@ -151,6 +253,8 @@ else:
             file_upload = st.file_uploader("Upload your documents for analysis 👇",
                                            accept_multiple_files=True,
                                            type=['pdf', 'docx'])
+            # Documents already in the library, e.g. those of use cases still being created
+            library_documents = select_library_documents("Or select documents from your library", "library_documents")
             # Buttons
             col1, col2 = st.columns([1, 1])
             with col1:
@@ -159,39 +263,17 @@ else:
         if submit_button:
             if not use_case_name:
                 st.error("Please enter a use case name.")
-            elif use_case_name in use_case_df["Use Case Name"].tolist():
+            elif use_case_name_taken(use_case_name, use_case_df, ingestion_jobs):
                 st.error("Use case already exists. Please select a new use case name.")
-            elif not file_upload:
-                st.error("Please upload at least one document.")
+            elif not file_upload and not library_documents:
+                st.error("Please upload or select at least one document.")
             else:
-                with st.spinner("Creating Use Case"):
-                    docs = []
-                    for uploaded_file in file_upload:
-                        if uploaded_file.type == "application/pdf":
-                            with pdfplumber.open(uploaded_file) as pdf:
-                                document_text = extract_text_from_pdf(pdf)
-                                documents = text_splitter.create_documents([document_text])
-                                for page in documents:
-                                    page.metadata = {'source': f"{uploaded_file.name}"}
-                                docs += documents
-                        elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                            document_text = extract_text_from_docx(uploaded_file)
-                            documents = text_splitter.create_documents([document_text])
-                            for page in documents:
-                                page.metadata = {'source': f"{uploaded_file.name}"}
-                            docs += documents
-                        else:
-                            pass
-                    try:
-                        docs = remove_duplicate_documents(docs)
-                        docs_to_vectordb(docs, f"{st.session_state.user}_{use_case_name}")
-                    except Exception as e:
-                        st.sidebar.error(f"Something went wrong: {e}")
-
-                    add_use_case(st.session_state.user, use_case_name, list(set([uploaded_file.name for uploaded_file in file_upload])))
-                    use_case_df = get_use_case_dataframe(st.session_state.user)
-                    st.session_state['use_cases'] = use_case_df['Use Case Name'].tolist()
-                st.success("Use Case Created!")
+                create_use_case(use_case_name, file_upload, library_documents)
+                st.success("Use Case creation started! Its progress is shown above.")
                 time.sleep(1)
                 st.rerun()
 
+    # Refresh the progress of the use cases being created until they are done
+    if ingestion_in_progress:
+        time.sleep(INGESTION_JOB_REFRESH_SECONDS)
+        st.rerun()
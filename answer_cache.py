@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from azure.core.exceptions import ResourceNotFoundError, ResourceModifiedError, ResourceExistsError
+from blob_storage import get_blob_store
+
+
+# Minimum cosine similarity between two questions for a cached answer to be reused
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0.97))
+# Seconds a cached answer is served, and the maximum number of answers kept (0 disables the cache)
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000))
+# Seconds the index version of a collection is trusted before checking whether another process changed it
+ANSWER_CACHE_REVALIDATE_SECONDS = float(os.environ.get("ANSWER_CACHE_REVALIDATE_SECONDS", 5))
+
+
+class AnswerCache:
+    """
+    In-memory semantic cache of the answers given for each use case collection.
+
+    A question hits the cache when its embedding is close enough to the embedding of a
+    question already answered for the same collection. Answers expire after ttl_seconds,
+    and the least recently used ones are evicted beyond max_entries. Invalidating a
+    collection drops its answers, and answers computed while it was being invalidated are
+    not stored.
+
+    Every answer is stored with the index version of its collection, which is kept in the
+    blob store and incremented by each invalidation, so the answers of a collection changed
+    by another server process are no longer served once this process revalidates the
+    version, at most revalidate_seconds later.
+
+    Args:
+        similarity (float): Minimum cosine similarity of a hit.
+        ttl_seconds (float): How long an answer is served.
+        max_entries (int): Maximum number of answers kept over all collections.
+        store (AzureBlobStore or LocalBlobStore, optional): The blob store holding the index
+                                                             versions. Defaults to the process-wide one.
+        revalidate_seconds (float): How long an index version is trusted without revalidation.
+    """
+
+    def __init__(self, similarity=ANSWER_CACHE_SIMILARITY, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, store=None, revalidate_seconds=ANSWER_CACHE_REVALIDATE_SECONDS) -> None:
+        self.similarity = similarity
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.store = store
+        self.revalidate_seconds = revalidate_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    @staticmethod
+    def _version_blob(collection_name):
+        return f"{collection_name}_index_version.json"
+
+    def _read_version(self, collection_name):
+        store = self.store if self.store is not None else get_blob_store()
+        try:
+            data, etag = store.read_with_etag(self._version_blob(collection_name))
+        except ResourceNotFoundError:
+            return 0, None
+        return json.loads(data)["version"], etag
+
+    def _set_version(self, collection_name, version, etag):
+        with self._lock:
+            cached = self._versions.get(collection_name)
+            # Versions only grow, so a read finishing after an invalidation does not undo it
+            if cached is None or version >= cached[0]:
+                self._versions[collection_name] = (version, etag, time.monotonic())
+            return self._versions[collection_name][0]
+
+    def generation(self, collection_name):
+        """
+        Returns the index version of a collection, to be passed to put after computing an answer.
+
+        The version is read from the blob store at most every revalidate_seconds.
+        """
+        with self._lock:
+            cached = self._versions.get(collection_name)
+        if cached is not None and time.monotonic() - cached[2] < self.revalidate_seconds:
+            return cached[0]
+        if cached is None or cached[1] is None:
+            return self._set_version(collection_name, *self._read_version(collection_name))
+        store = self.store if self.store is not None else get_blob_store()
+        try:
+            data, etag = store.read_if_changed(self._version_blob(collection_name), cached[1])
+        except ResourceNotFoundError:
+            return self._set_version(collection_name, 0, None)
+        return self._set_version(collection_name, cached[0] if data is None else json.loads(data)["version"], etag)
+
+    def get(self, collection_name, query_vector):
+        """
+        Looks up the answer of the most similar question asked for a collection.
+
+        Args:
+            collection_name (str): The use case collection.
+            query_vector (list of float): The embedding of the question.
+
+        Returns:
+            dict or None: The cached answer, or None on a miss.
+        """
+        if self.max_entries <= 0:
+            return None
+        query_vector = self._normalize(query_vector)
+        generation = self.generation(collection_name)
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_similarity = None, self.similarity
+            for key, entry in list(self._entries.items()):
+                if now - entry["created_at"] > self.ttl_seconds or \
+                        (entry["collection_name"] == collection_name and entry["generation"] != generation):
+                    del self._entries[key]
+                elif entry["collection_name"] == collection_name:
+                    similarity = float(entry["vector"] @ query_vector)
+                    if similarity >= best_similarity:
+                        best_key, best_similarity = key, similarity
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key]["answer"]
+
+    def put(self, collection_name, query_vector, answer, generation):
+        """
+        Stores the answer to a question, unless the collection changed since generation.
+
+        Args:
+            collection_name (str): The use case collection.
+            query_vector (list of float): The embedding of the question.
+            answer (dict): The answer to serve on later hits.
+            generation (int): The collection's index version read before answering.
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            cached = self._versions.get(collection_name)
+            if (cached[0] if cached is not None else 0) != generation:
+                return
+            self._entries[self._next_key] = {"collection_name": collection_name, "vector": self._normalize(query_vector),
+                                             "answer": answer, "generation": generation, "created_at": time.monotonic()}
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, collection_name):
+        """Drops every answer of a collection in all processes, e.g. when its documents change."""
+        store = self.store if self.store is not None else get_blob_store()
+        while True:
+            version, etag = self._read_version(collection_name)
+            try:
+                etag = store.write(self._version_blob(collection_name), json.dumps({"version": version + 1}).encode("utf-8"),
+                                   if_match=etag, create_only=etag is None)
+                break
+            except (ResourceModifiedError, ResourceExistsError):
+                continue
+        self._set_version(collection_name, version + 1, etag)
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry["collection_name"] == collection_name]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "entries": len(self._entries)}
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Returns the process-wide answer cache."""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+        return _answer_cache
@@ -1,28 +1,85 @@
 import os
-from langchain_openai import AzureOpenAIEmbeddings
-from langchain_openai import AzureChatOpenAI
+from embedding_cache import CachedEmbeddings
+from embedding_scheduler import AZURE_EMBEDDINGS_TPM
+from request_scheduler import ScheduledChatModel, ScheduledEmbeddings, get_deployment_scheduler
+from request_scheduler import AZURE_CHAT_MAX_CONCURRENCY, AZURE_CHAT_TPM, AZURE_EMBEDDINGS_MAX_CONCURRENCY
+from resources import register_resource, get_resource, set_resource
 
 
 class BaseAgent:
     """
     Base agent to chat with GPT-4 without any particular add-on.
+
+    The Azure OpenAI clients are process-wide resources, created on first use and shared by
+    every agent, session and rerun, so creating an agent costs nothing and needs no credentials.
+    Their requests go through the admission control of their deployment, which also sends
+    identical requests in flight only once (see request_scheduler).
     """
 
-    def __init__(self) -> None:
+    @property
+    def model(self):
+        return get_resource("chat_model")
+
+    @model.setter
+    def model(self, model):
+        set_resource("chat_model", model)
+
+    @property
+    def streaming_model(self):
+        """Same model, emitting the tokens of its answers to callbacks as they are generated."""
+        return get_resource("streaming_chat_model")
+
+    @streaming_model.setter
+    def streaming_model(self, model):
+        set_resource("streaming_chat_model", model)
+
+    @property
+    def embeddings(self):
+        """Embeddings are served from the on-disk cache so each chunk is only embedded once."""
+        return get_resource("embeddings")
 
-        self.model = AzureChatOpenAI(
-            deployment_name=os.environ["AZURE_CHAT_DEPLOYMENT_NAME"],
-            model=os.environ["AZURE_CHAT_MODEL"],
-            temperature=0,
-            openai_api_version=os.environ["OPENAI_API_VERSION"],
-            openai_api_key=os.environ["AZURE_CHAT_API_KEY"],
-            azure_endpoint=os.environ["AZURE_CHAT_ENDPOINT"]
+    @embeddings.setter
+    def embeddings(self, embeddings):
+        set_resource("embeddings", embeddings)
+
+    @staticmethod
+    def _chat_model(streaming=False):
+        # Imported on first use, as the OpenAI client library takes over a second to import
+        from langchain_openai import AzureChatOpenAI
+        return ScheduledChatModel(
+            AzureChatOpenAI(
+                deployment_name=os.environ["AZURE_CHAT_DEPLOYMENT_NAME"],
+                model=os.environ["AZURE_CHAT_MODEL"],
+                temperature=0,
+                openai_api_version=os.environ["OPENAI_API_VERSION"],
+                openai_api_key=os.environ["AZURE_CHAT_API_KEY"],
+                azure_endpoint=os.environ["AZURE_CHAT_ENDPOINT"],
+                streaming=streaming
+            ),
+            # The streaming and non-streaming models share the admission control of their deployment
+            get_deployment_scheduler(os.environ["AZURE_CHAT_DEPLOYMENT_NAME"], AZURE_CHAT_MAX_CONCURRENCY, AZURE_CHAT_TPM)
+        )
+
+    @staticmethod
+    def _embeddings():
+        from langchain_openai import AzureOpenAIEmbeddings
+        # Only the texts missing from the cache are queued for the deployment
+        return CachedEmbeddings(
+            ScheduledEmbeddings(
+                AzureOpenAIEmbeddings(
+                    openai_api_type=os.environ["OPEN_AI_TYPE"],
+                    api_key=os.environ["AZURE_EMBEDDINGS_API_KEY"],
+                    azure_endpoint=os.environ["AZURE_EMBEDDINGS_ENDPOINT"],
+                    azure_deployment=os.environ["AZURE_EMBEDDINGS_DEPLOYMENT_NAME"],
+                    openai_api_version=os.environ["OPENAI_API_VERSION"]
+                ),
+                get_deployment_scheduler(os.environ["AZURE_EMBEDDINGS_DEPLOYMENT_NAME"],
+                                         AZURE_EMBEDDINGS_MAX_CONCURRENCY, AZURE_EMBEDDINGS_TPM)
+            ),
+            namespace=os.environ["AZURE_EMBEDDINGS_DEPLOYMENT_NAME"]
         )
 
-        self.embeddings = AzureOpenAIEmbeddings(
-            openai_api_type=os.environ["OPEN_AI_TYPE"],
-            api_key=os.environ["AZURE_EMBEDDINGS_API_KEY"],
-            azure_endpoint=os.environ["AZURE_EMBEDDINGS_ENDPOINT"],
-            azure_deployment=os.environ["AZURE_EMBEDDINGS_DEPLOYMENT_NAME"],
-            openai_api_version=os.environ["OPENAI_API_VERSION"]
-)
+
+register_resource("chat_model", BaseAgent._chat_model)
+register_resource("streaming_chat_model", lambda: BaseAgent._chat_model(streaming=True))
+register_resource("embeddings", BaseAgent._embeddings)
@@ -0,0 +1,96 @@
+"""
+Benchmarks the PDF extractors over the bundled example documents.
+
+For every document and extractor, reports the pages extracted per second, and compares the
+cleaned text of every page and the resulting chunks with those of pdfplumber. Run with:
+
+    python benchmark_extraction.py [--repeat N] [--json]
+"""
+import argparse
+import difflib
+import json
+import time
+from extraction_backends import PDF_EXTRACTORS
+from utils import iter_pdf_pages, stream_text_to_documents
+
+
+BENCHMARK_FILES = ["Clinical Trial Protocol.pdf", "Investigator Brochure.pdf", "Training Material.pdf"]
+REFERENCE_EXTRACTOR = "pdfplumber"
+
+
+def extract_pages(extractor, file_bytes):
+    """Returns the cleaned text of every page of a PDF, by 1-based page number."""
+    with extractor.open(file_bytes) as pdf:
+        return dict(iter_pdf_pages(pdf, extractor=extractor))
+
+
+def time_extraction(extractor, file_bytes, repeat):
+    """Returns the best time, over repeat runs, to extract the text of every page of a PDF."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract_pages(extractor, file_bytes)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def compare_pages(reference_pages, pages):
+    """Returns the share of identical pages and the text similarity between two extractions."""
+    page_numbers = reference_pages.keys() | pages.keys()
+    identical = sum(reference_pages.get(number) == pages.get(number) for number in page_numbers)
+    similarity = difflib.SequenceMatcher(None, "".join(reference_pages[number] for number in sorted(reference_pages)).split(),
+                                         "".join(pages[number] for number in sorted(pages)).split(), autojunk=False).ratio()
+    return identical / max(1, len(page_numbers)), similarity
+
+
+def run_benchmark(files=BENCHMARK_FILES, repeat=3):
+    """
+    Runs every extractor over every file.
+
+    Args:
+        files (list of str): Paths of the PDFs to benchmark.
+        repeat (int): Number of runs per file and extractor; the fastest is reported.
+
+    Returns:
+        list of dict: One result per file and extractor, with its 'pages_per_second' and its
+                      'identical_pages' share, word-level 'text_similarity' and 'chunks'
+                      compared with pdfplumber.
+    """
+    results = []
+    for path in files:
+        with open(path, "rb") as pdf_file:
+            file_bytes = pdf_file.read()
+        reference_pages = extract_pages(PDF_EXTRACTORS[REFERENCE_EXTRACTOR], file_bytes)
+        for name, extractor in PDF_EXTRACTORS.items():
+            pages = extract_pages(extractor, file_bytes)
+            with extractor.open(file_bytes) as pdf:
+                page_count = extractor.page_count(pdf)
+            seconds = time_extraction(extractor, file_bytes, repeat)
+            identical_pages, text_similarity = compare_pages(reference_pages, pages)
+            results.append({
+                "file": path,
+                "extractor": name,
+                "pages": page_count,
+                "seconds": round(seconds, 4),
+                "pages_per_second": round(page_count / seconds, 1),
+                "identical_pages": round(identical_pages, 3),
+                "text_similarity": round(text_similarity, 4),
+                "chunks": len(list(stream_text_to_documents(pages.items(), path))),
+            })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per file and extractor")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(repeat=args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'file':32} {'extractor':11} {'pages':>5} {'pages/s':>9} {'identical':>9} {'similarity':>10} {'chunks':>6}")
+        for result in results:
+            print(f"{result['file']:32} {result['extractor']:11} {result['pages']:>5} {result['pages_per_second']:>9} "
+                  f"{result['identical_pages']:>9} {result['text_similarity']:>10} {result['chunks']:>6}")
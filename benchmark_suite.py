@@ -0,0 +1,273 @@
+"""
+Offline end-to-end performance benchmarks of ingestion, retrieval, answering and chat history.
+
+The bundled example documents go through the same functions as in the app, with a
+deterministic hashing embedding model, a fake chat model, an in-memory Qdrant and a
+filesystem blob store, so no network access or credentials are needed. Results are
+printed as a table or as JSON, and compared with a stored baseline. Run with:
+
+    python benchmark_suite.py [--repeat N] [--json] [--output FILE]
+                              [--baseline FILE] [--tolerance T] [--update-baseline]
+
+The command exits with status 1 when a benchmark is slower than its baseline by more than
+the tolerance. Baselines depend on the machine, so update them on the machine that runs
+the comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import FakeListChatModel
+
+
+BENCHMARK_FILES = ["Clinical Trial Protocol.pdf", "Investigator Brochure.pdf", "Training Material.pdf"]
+BENCHMARK_QUESTIONS = [
+    "What is the primary endpoint of the clinical trial?",
+    "Which adverse events were reported in the studies?",
+    "What dose is administered to the patients?",
+    "How should investigators report serious adverse events?",
+]
+DEFAULT_BASELINE = "benchmark_baseline.json"
+# Relative slowdown from which a benchmark is reported as a regression
+DEFAULT_TOLERANCE = 0.5
+# Benchmarks faster than this many seconds are not compared, as their timings are mostly noise
+MIN_COMPARED_SECONDS = 0.005
+# Dimension of the fake embeddings, the one of text-embedding-ada-002
+EMBEDDING_SIZE = 1536
+CHAT_HISTORY_TURNS = 50
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic offline embeddings: normalised counts of the hashed words of a text.
+
+    Unlike random fake embeddings, texts sharing words get similar vectors, so retrieval
+    returns relevant chunks and exercises the same code paths as with a real model.
+    """
+
+    def __init__(self, size=EMBEDDING_SIZE) -> None:
+        self.size = size
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[zlib.crc32(word.encode("utf-8")) % self.size] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def load_offline_modules(root):
+    """
+    Imports the app modules wired to offline stand-ins.
+
+    The environment is set before the modules are imported, as they read it at import time:
+    the blob store and caches live under root. The vector backend is replaced by an in-memory
+    Qdrant and the agent's models by HashingEmbeddings and FakeListChatModels, so no Azure
+    client is ever created.
+
+    Args:
+        root (str): A temporary directory holding every file written by the benchmarks.
+
+    Returns:
+        module: The utils module.
+    """
+    os.environ.update({
+        "BLOB_BACKEND": "local",
+        "LOCAL_BLOB_ROOT": os.path.join(root, "blob_store"),
+        "EMBEDDING_CACHE_PATH": os.path.join(root, "embeddings.sqlite3"),
+        "PARSED_CACHE_PATH": os.path.join(root, "parsed_documents"),
+        "ANSWER_CACHE_MAX_ENTRIES": "0",
+    })
+
+    from qdrant_client import QdrantClient
+    from resources import set_resource
+    import vector_backends
+    set_resource("vector_backend", vector_backends.QdrantBackend(QdrantClient(":memory:")))
+    set_resource("embeddings", HashingEmbeddings())
+    set_resource("chat_model", FakeListChatModel(responses=["What are the main findings of the documents?"]))
+    set_resource("streaming_chat_model", FakeListChatModel(responses=["The documents describe the study design and its results."]))
+
+    import utils
+    return utils
+
+
+def measure(function, repeat):
+    """
+    Runs a function once to warm up, e.g. lazily created clients, then repeat timed times.
+
+    Returns:
+        tuple: The result of the last run, and the best and median run times in seconds.
+    """
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, min(times), statistics.median(times)
+
+
+def run_benchmarks(utils, files=BENCHMARK_FILES, repeat=5):
+    """
+    Benchmarks every stage over the given files.
+
+    Args:
+        utils (module): The utils module returned by load_offline_modules.
+        files (list of str): Paths of the PDFs to ingest.
+        repeat (int): Number of runs of each benchmark.
+
+    Returns:
+        dict: The results by benchmark name, each with its 'best_seconds', 'median_seconds',
+              number of 'items' processed and 'items_per_second'. Items are pages for text
+              extraction, characters for text splitting, chunks for deduplication and
+              indexing, questions for retrieval and answering, and turns for chat history.
+    """
+    import pdfplumber
+    from chat_history import append_chat_messages, load_chat_history, clear_chat_history
+    from qa_engine import RetrievalQAEngine
+
+    results = {}
+
+    def record(name, function, items):
+        result, best, median = measure(function, repeat)
+        results[name] = {"best_seconds": round(best, 6), "median_seconds": round(median, 6), "items": items,
+                         "items_per_second": round(items / median, 1) if median else None}
+        return result
+
+    pdf_bytes = {path: open(path, "rb").read() for path in files}
+
+    def extract_all():
+        texts = {}
+        for path in files:
+            with pdfplumber.open(path) as pdf:
+                texts[path] = utils.extract_text_from_pdf(pdf)
+        return texts
+
+    page_count = 0
+    for path in files:
+        with pdfplumber.open(path) as pdf:
+            page_count += len(pdf.pages)
+    texts = record("extract_text_from_pdf", extract_all, page_count)
+
+    text_length = sum(len(text) for text in texts.values())
+    record("text_to_docs", lambda: [utils.text_to_docs(text) for text in texts.values()], text_length)
+
+    docs = []
+    for path in files:
+        extractor = utils.get_pdf_extractor()
+        with extractor.open(pdf_bytes[path]) as pdf:
+            docs += list(utils.stream_text_to_documents(utils.iter_pdf_pages(pdf, extractor=extractor), path))
+    # Every chunk appears twice, as when the same file is uploaded twice
+    record("remove_duplicate_documents", lambda: utils.remove_duplicate_documents(docs + docs), 2 * len(docs))
+
+    collection_name = "benchmark_use_case"
+    vectordb = record("docs_to_vectordb", lambda: utils.docs_to_vectordb(docs, collection_name), len(docs))
+    if vectordb is False:
+        raise RuntimeError("docs_to_vectordb failed")
+
+    record("retrieval", lambda: [vectordb.similarity_search(question, k=20) for question in BENCHMARK_QUESTIONS],
+           len(BENCHMARK_QUESTIONS))
+
+    engine = RetrievalQAEngine(vectordb, utils.agent.model, utils.agent.streaming_model, search_kwargs={"k": 20})
+    chat_history = [(BENCHMARK_QUESTIONS[0], "The primary endpoint is overall survival.")]
+    record("answer", lambda: [engine.answer(question, chat_history, len(files)) for question in BENCHMARK_QUESTIONS]
+           + [engine.answer("And the secondary ones?", chat_history, len(files))], len(BENCHMARK_QUESTIONS) + 1)
+
+    def chat_history_round_trip():
+        clear_chat_history("benchmark_user", collection_name)
+        for turn in range(CHAT_HISTORY_TURNS):
+            append_chat_messages("benchmark_user", collection_name, [
+                {"role": "user", "content": BENCHMARK_QUESTIONS[turn % len(BENCHMARK_QUESTIONS)]},
+                {"role": "assistant", "content": "The documents describe the study design and its results."},
+            ])
+        return load_chat_history("benchmark_user", collection_name)
+
+    record("chat_history_round_trip", chat_history_round_trip, CHAT_HISTORY_TURNS)
+    return results
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE, min_seconds=MIN_COMPARED_SECONDS):
+    """
+    Compares the best run times with a baseline.
+
+    Best times are compared rather than medians, as they are the least affected by other
+    activity on the machine.
+
+    Args:
+        results (dict): The results of run_benchmarks.
+        baseline (dict): Earlier results, in the same format.
+        tolerance (float): The relative slowdown allowed, e.g. 0.5 for 50%.
+        min_seconds (float): Benchmarks faster than this in the baseline are not compared.
+
+    Returns:
+        dict: The regressed benchmarks, with their 'baseline_seconds', 'best_seconds' and
+              'slowdown' ratio.
+    """
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline or baseline[name]["best_seconds"] < min_seconds:
+            continue
+        slowdown = result["best_seconds"] / baseline[name]["best_seconds"]
+        if slowdown > 1 + tolerance:
+            regressions[name] = {"baseline_seconds": baseline[name]["best_seconds"],
+                                 "best_seconds": result["best_seconds"], "slowdown": round(slowdown, 2)}
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of each benchmark")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline results to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="relative slowdown allowed")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="biorag-benchmark-") as root:
+        results = run_benchmarks(load_offline_modules(root), repeat=args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+    regressions = find_regressions(results, baseline, args.tolerance)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "results": results,
+        "regressions": regressions,
+    }
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump({key: value for key, value in report.items() if key != "regressions"}, baseline_file, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'benchmark':28} {'best s':>10} {'median s':>10} {'items':>7} {'items/s':>10} {'baseline s':>10}")
+        for name, result in results.items():
+            baseline_seconds = baseline.get(name, {}).get("best_seconds", "")
+            flag = "  REGRESSION" if name in regressions else ""
+            print(f"{name:28} {result['best_seconds']:>10} {result['median_seconds']:>10} {result['items']:>7} "
+                  f"{result['items_per_second']:>10} {baseline_seconds:>10}{flag}")
+    sys.exit(1 if regressions and not args.update_baseline else 0)
@@ -0,0 +1,175 @@
+"""
+Compares the Qdrant storage profiles of use case collections on the bundled documents.
+
+The bundled example documents are chunked as in the app and indexed once per profile of
+VECTOR_STORAGE_PROFILES. For every profile, the report gives the recall@k of its searches
+against exact full-precision search, the median and 95th percentile query latency, the
+indexing time and an estimate of the RAM used by its vectors and HNSW graph. Run with:
+
+    python benchmark_vector_storage.py [--url URL] [--k K] [--queries N] [--copies N]
+                                       [--profile NAME ...] [--azure-embeddings] [--json]
+
+Quantization and HNSW parameters only have an effect on a Qdrant server: the default
+in-memory client searches exhaustively on the original vectors. Qdrant also searches
+collections smaller than its full_scan_threshold (about 1,600 ada-002 vectors) without
+the HNSW graph, so --copies adds jittered copies of every chunk to reach realistic sizes.
+Embeddings are the offline hashing embeddings of benchmark_suite.py, unless
+--azure-embeddings is given.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import uuid
+import numpy as np
+from benchmark_suite import BENCHMARK_FILES, BENCHMARK_QUESTIONS, load_offline_modules
+from vector_backends import QdrantBackend, VECTOR_STORAGE_PROFILES
+
+
+def load_chunks(utils, files=BENCHMARK_FILES):
+    """Returns the chunks of the given PDFs, as split at ingestion."""
+    docs = []
+    for path in files:
+        extractor = utils.get_pdf_extractor()
+        with open(path, "rb") as pdf_file, extractor.open(pdf_file.read()) as pdf:
+            docs += list(utils.stream_text_to_documents(utils.iter_pdf_pages(pdf, extractor=extractor), path))
+    return utils.remove_duplicate_documents(docs)
+
+
+def benchmark_queries(docs, count):
+    """Returns the benchmark questions followed by the opening words of evenly spaced chunks, count in total."""
+    queries = list(BENCHMARK_QUESTIONS)
+    step = max(1, len(docs) // max(1, count - len(queries)))
+    for doc in docs[::step]:
+        queries.append(" ".join(doc.page_content.split()[:12]))
+    return queries[:count]
+
+
+def jittered_copies(vectors, copies, scale=0.05, seed=0):
+    """Returns the vectors followed by copies-1 normalised copies with Gaussian noise."""
+    rng = np.random.default_rng(seed)
+    matrices = [vectors]
+    for _ in range(copies - 1):
+        noisy = vectors + rng.normal(0, scale / np.sqrt(vectors.shape[1]), vectors.shape).astype(np.float32)
+        matrices.append(noisy / np.linalg.norm(noisy, axis=1, keepdims=True))
+    return np.vstack(matrices)
+
+
+def exact_neighbours(vectors, query_vectors, k):
+    """Returns the indexes of the k nearest vectors of every query by exact cosine similarity."""
+    normalised = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    scores = np.asarray(query_vectors, dtype=np.float32) @ normalised.T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+def recall_at_k(results, truth):
+    """Returns the mean fraction of the exact neighbours found, over queries."""
+    return float(np.mean([len(found & expected) / len(expected) for found, expected in zip(results, truth)]))
+
+
+def estimate_ram_bytes(profile, count, vector_size):
+    """
+    Estimates the RAM of a collection's vectors and HNSW graph, leaving out payloads.
+
+    Original vectors take 4 bytes per dimension unless stored on disk, int8 vectors 1 byte and
+    binary vectors 1 bit; the graph takes about 2 * m links of 4 bytes per point.
+    """
+    original = 0 if profile.get("on_disk") else count * vector_size * 4
+    quantized = {"scalar": count * vector_size, "binary": count * vector_size // 8}.get(profile.get("quantization"), 0)
+    graph = 0 if profile.get("hnsw_on_disk") else count * profile.get("hnsw_m", 16) * 2 * 4
+    return original + quantized + graph
+
+
+def wait_until_indexed(client, collection_name, timeout=300):
+    """Waits for the optimizers of the server to finish building the collection's index."""
+    deadline = time.monotonic() + timeout
+    while client.get_collection(collection_name).status != "green" and time.monotonic() < deadline:
+        time.sleep(0.5)
+
+
+def benchmark_profile(client, profile, docs, vectors, query_vectors, truth, k, embeddings):
+    """
+    Indexes the vectors with a storage profile and searches them.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        profile (str): The name of the storage profile.
+        docs (list of Document): The chunks; vector i is the one of chunk i modulo the number of chunks.
+        vectors (numpy.ndarray): The vectors to index.
+        query_vectors (list of list of float): The query vectors.
+        truth (list of set of int): The indexes of the exact neighbours of every query.
+        k (int): The number of results per search.
+        embeddings (Embeddings): The embeddings of the vector store.
+
+    Returns:
+        dict: The profile's 'recall_at_k', 'median_ms' and 'p95_ms' query latencies,
+              'index_seconds' and 'estimated_ram_mb'.
+    """
+    backend = QdrantBackend(client, profile)
+    collection_name = f"benchmark_{profile.replace('-', '_')}_documents"
+    start = time.perf_counter()
+    backend.create_collection(collection_name, vectors.shape[1])
+    for batch_start in range(0, len(vectors), 256):
+        indexes = range(batch_start, min(batch_start + 256, len(vectors)))
+        backend.upsert(collection_name, [str(uuid.UUID(int=index)) for index in indexes], vectors[batch_start:indexes.stop].tolist(),
+                       [{"page_content": docs[index % len(docs)].page_content, "metadata": {"index": index}} for index in indexes])
+    wait_until_indexed(client, collection_name)
+    index_seconds = time.perf_counter() - start
+
+    store = backend.as_vectorstore(collection_name, embeddings)
+    results, latencies = [], []
+    for query_vector in query_vectors:
+        start = time.perf_counter()
+        documents = store.similarity_search_by_vector(query_vector, k=k)
+        latencies.append(time.perf_counter() - start)
+        results.append({doc.metadata["index"] for doc in documents})
+    backend.delete_collection(collection_name)
+
+    return {
+        "recall_at_k": round(recall_at_k(results, truth), 4),
+        "median_ms": round(1000 * statistics.median(latencies), 3),
+        "p95_ms": round(1000 * float(np.percentile(latencies, 95)), 3),
+        "index_seconds": round(index_seconds, 3),
+        "estimated_ram_mb": round(estimate_ram_bytes(VECTOR_STORAGE_PROFILES[profile], len(vectors), vectors.shape[1]) / 2**20, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=":memory:", help="Qdrant server URL (default: in-memory client)")
+    parser.add_argument("--api-key", default=os.environ.get("QDRANT_KEY"), help="Qdrant API key (default: QDRANT_KEY)")
+    parser.add_argument("--k", type=int, default=20, help="results per search, as retrieved by the Chatbot")
+    parser.add_argument("--queries", type=int, default=100, help="number of queries")
+    parser.add_argument("--copies", type=int, default=1, help="copies of every chunk to index")
+    parser.add_argument("--profile", action="append", choices=list(VECTOR_STORAGE_PROFILES), help="profile to compare (default: all)")
+    parser.add_argument("--azure-embeddings", action="store_true", help="embed with the Azure deployment instead of offline")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    from qdrant_client import QdrantClient
+    client = QdrantClient(":memory:") if args.url == ":memory:" else QdrantClient(url=args.url, api_key=args.api_key)
+
+    with tempfile.TemporaryDirectory(prefix="biorag-benchmark-") as root:
+        utils = load_offline_modules(root)
+        if args.azure_embeddings:
+            from resources import registry
+            registry.reset("embeddings")
+        embeddings = utils.agent.embeddings
+        docs = load_chunks(utils)
+        vectors = jittered_copies(np.asarray(embeddings.embed_documents([doc.page_content for doc in docs]), dtype=np.float32),
+                                  args.copies)
+        query_vectors = [embeddings.embed_query(query) for query in benchmark_queries(docs, args.queries)]
+        truth = exact_neighbours(vectors, query_vectors, args.k)
+        report = {profile: benchmark_profile(client, profile, docs, vectors, query_vectors, truth, args.k, embeddings)
+                  for profile in args.profile or VECTOR_STORAGE_PROFILES}
+
+    if args.json:
+        print(json.dumps({"points": len(vectors), "queries": len(query_vectors), "k": args.k, "profiles": report}, indent=2))
+    else:
+        print(f"{len(vectors)} points, {len(query_vectors)} queries, k={args.k}")
+        print(f"{'profile':14} {'recall@k':>9} {'median ms':>10} {'p95 ms':>9} {'index s':>9} {'est. RAM MB':>12}")
+        for profile, result in report.items():
+            print(f"{profile:14} {result['recall_at_k']:>9} {result['median_ms']:>10} {result['p95_ms']:>9} "
+                  f"{result['index_seconds']:>9} {result['estimated_ram_mb']:>12}")
@@ -0,0 +1,273 @@
+import hashlib
+import os
+import threading
+import uuid
+import requests
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError, ResourceModifiedError, ResourceExistsError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import ContainerClient
+from telemetry import increment
+from resources import register_resource, get_resource
+
+
+# Storage used for use cases and chat histories: "azure" (Azure Blob Storage) or "local" (filesystem)
+BLOB_BACKEND = os.environ.get("BLOB_BACKEND", "azure")
+# Directory used by the local filesystem stand-in
+LOCAL_BLOB_ROOT = os.environ.get("LOCAL_BLOB_ROOT", os.path.join(".cache", "blob_store"))
+# Maximum number of pooled HTTP connections to Azure Blob Storage
+AZURE_BLOB_POOL_SIZE = int(os.environ.get("AZURE_BLOB_POOL_SIZE", 16))
+
+
+class AzureBlobStore:
+    """
+    Blob store backed by one long-lived, connection-pooled Azure container client.
+
+    All transfers go straight between memory and Azure, without temporary files. The
+    underlying client is safe to share between concurrent Streamlit sessions.
+
+    Args:
+        connection_string (str): The Azure Blob Storage connection string.
+        container_name (str): The container holding the application's blobs.
+        pool_size (int): Maximum number of pooled HTTP connections.
+    """
+
+    def __init__(self, connection_string, container_name, pool_size=AZURE_BLOB_POOL_SIZE) -> None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self.container_client = ContainerClient.from_connection_string(
+            connection_string, container_name, transport=RequestsTransport(session=session, session_owner=False)
+        )
+
+    def read(self, name):
+        """Returns the content of a blob. Raises ResourceNotFoundError if it does not exist."""
+        return self.read_with_etag(name)[0]
+
+    def read_with_etag(self, name):
+        """Returns the content and ETag of a blob. Raises ResourceNotFoundError if it does not exist."""
+        downloader = self.container_client.download_blob(name)
+        data = downloader.readall()
+        increment("blob_bytes_total", len(data), direction="read")
+        return data, downloader.properties.etag
+
+    def read_if_changed(self, name, etag):
+        """
+        Downloads a blob only if its ETag differs from the given one (conditional GET).
+
+        Args:
+            name (str): The blob name.
+            etag (str): The ETag of the copy already held by the caller.
+
+        Returns:
+            tuple: (None, etag) if the blob is unchanged, otherwise its new content and ETag.
+                   Raises ResourceNotFoundError if the blob does not exist.
+        """
+        try:
+            downloader = self.container_client.download_blob(name, etag=etag, match_condition=MatchConditions.IfModified)
+        except HttpResponseError as e:
+            if e.status_code == 304:
+                return None, etag
+            raise
+        data = downloader.readall()
+        increment("blob_bytes_total", len(data), direction="read")
+        return data, downloader.properties.etag
+
+    def write(self, name, data, if_match=None, create_only=False):
+        """
+        Uploads bytes to a blob.
+
+        Args:
+            name (str): The blob name.
+            data (bytes): The new content of the blob.
+            if_match (str, optional): Only overwrite the blob if its ETag is still this one,
+                                      otherwise raise ResourceModifiedError.
+            create_only (bool): Only write if the blob does not exist yet, otherwise raise
+                                ResourceExistsError.
+
+        Returns:
+            str: The ETag of the new content.
+        """
+        kwargs = {}
+        if if_match:
+            kwargs = {"etag": if_match, "match_condition": MatchConditions.IfNotModified}
+        result = self.container_client.get_blob_client(name).upload_blob(data, overwrite=not create_only, **kwargs)
+        increment("blob_bytes_total", len(data), direction="write")
+        return result["etag"]
+
+    def append(self, name, data):
+        """
+        Appends bytes to an append blob, creating the blob if it does not exist.
+
+        Args:
+            name (str): The blob name.
+            data (bytes): The bytes to add at the end of the blob.
+
+        Raises:
+            ResourceModifiedError: If the blob was sealed.
+        """
+        blob_client = self.container_client.get_blob_client(name)
+        try:
+            try:
+                blob_client.append_block(data)
+            except ResourceNotFoundError:
+                try:
+                    blob_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+                except ResourceExistsError:
+                    pass  # Created by another session in the meantime
+                blob_client.append_block(data)
+        except HttpResponseError as e:
+            if getattr(e, "error_code", None) == "BlobIsSealed":
+                raise ResourceModifiedError(f"The specified blob is sealed: {name}") from e
+            raise
+        increment("blob_bytes_total", len(data), direction="write")
+
+    def seal(self, name):
+        """Makes an append blob read-only, so that later appends raise ResourceModifiedError."""
+        self.container_client.get_blob_client(name).seal_append_blob()
+
+    def create_append(self, name, data):
+        """
+        Creates an append blob holding the given bytes, replacing any blob of the same name.
+
+        Blobs written with write are block blobs, to which append cannot add bytes.
+
+        Args:
+            name (str): The blob name.
+            data (bytes): The initial content of the blob.
+        """
+        self.container_client.get_blob_client(name).upload_blob(data, blob_type="AppendBlob", overwrite=True)
+        increment("blob_bytes_total", len(data), direction="write")
+
+    def delete(self, name):
+        """Deletes a blob, doing nothing if it does not exist."""
+        try:
+            self.container_client.delete_blob(name)
+        except ResourceNotFoundError:
+            pass
+
+    def exists(self, name):
+        return self.container_client.get_blob_client(name).exists()
+
+
+class LocalBlobStore:
+    """
+    Filesystem stand-in for AzureBlobStore, used for tests and offline runs.
+
+    Blobs are files under root; blob names may contain '/' to create subdirectories. ETags
+    are content hashes, and writes are atomic renames, so concurrent sessions never see a
+    partially written blob.
+
+    Args:
+        root (str): The directory holding the blobs.
+    """
+
+    def __init__(self, root=LOCAL_BLOB_ROOT) -> None:
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        path = os.path.normpath(os.path.join(self.root, name))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid blob name: {name}")
+        return path
+
+    @staticmethod
+    def _etag(data):
+        return hashlib.md5(data).hexdigest()
+
+    def read(self, name):
+        """Returns the content of a blob. Raises ResourceNotFoundError if it does not exist."""
+        return self.read_with_etag(name)[0]
+
+    def read_with_etag(self, name):
+        """Returns the content and ETag of a blob. Raises ResourceNotFoundError if it does not exist."""
+        try:
+            with open(self._path(name), "rb") as blob_file:
+                data = blob_file.read()
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f"The specified blob does not exist: {name}")
+        increment("blob_bytes_total", len(data), direction="read")
+        return data, self._etag(data)
+
+    def read_if_changed(self, name, etag):
+        """Returns (None, etag) if the blob's ETag is still etag, otherwise its content and ETag."""
+        data, current_etag = self.read_with_etag(name)
+        if current_etag == etag:
+            return None, etag
+        return data, current_etag
+
+    def write(self, name, data, if_match=None, create_only=False):
+        """Writes bytes to a blob, with the same conditions as AzureBlobStore.write."""
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            if create_only and os.path.exists(path):
+                raise ResourceExistsError(f"The specified blob already exists: {name}")
+            if if_match:
+                try:
+                    _, etag = self.read_with_etag(name)
+                except ResourceNotFoundError:
+                    etag = None
+                if etag != if_match:
+                    raise ResourceModifiedError(f"The condition specified using HTTP conditional header(s) is not met: {name}")
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, "wb") as blob_file:
+                blob_file.write(data)
+            os.replace(temp_path, path)
+            # A new blob replacing a sealed one can be appended to again
+            if os.path.exists(f"{path}.sealed"):
+                os.remove(f"{path}.sealed")
+        increment("blob_bytes_total", len(data), direction="write")
+        return self._etag(data)
+
+    def append(self, name, data):
+        """Appends bytes to a blob, creating the blob if it does not exist. See AzureBlobStore.append."""
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            if os.path.exists(f"{path}.sealed"):
+                raise ResourceModifiedError(f"The specified blob is sealed: {name}")
+            with open(path, "ab") as blob_file:
+                blob_file.write(data)
+        increment("blob_bytes_total", len(data), direction="write")
+
+    def seal(self, name):
+        """Makes a blob read-only for append, recorded by a marker file next to it."""
+        with self._lock:
+            open(f"{self._path(name)}.sealed", "wb").close()
+
+    def create_append(self, name, data):
+        """Creates an append blob holding the given bytes. See AzureBlobStore.create_append."""
+        self.write(name, data)
+
+    def delete(self, name):
+        """Deletes a blob, doing nothing if it does not exist."""
+        for path in (self._path(name), f"{self._path(name)}.sealed"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+
+def _create_blob_store():
+    if BLOB_BACKEND == "local":
+        return LocalBlobStore()
+    return AzureBlobStore(os.environ["AZURE_BLOB_CONNECTION_STRING"], os.environ["AZURE_BLOB_CONTAINER_NAME"])
+
+
+register_resource("blob_store", _create_blob_store)
+
+
+def get_blob_store():
+    """
+    Returns the process-wide blob store selected by the BLOB_BACKEND environment variable.
+
+    Returns:
+        AzureBlobStore or LocalBlobStore: The store holding use cases and chat histories.
+    """
+    return get_resource("blob_store")
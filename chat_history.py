@@ -0,0 +1,404 @@
+import atexit
+import json
+import os
+import pickle
+import queue
+import threading
+import time
+import uuid
+from azure.core.exceptions import ResourceNotFoundError, ResourceModifiedError, ResourceExistsError
+from blob_storage import get_blob_store
+from telemetry import traced, start_trace, increment
+
+
+# Number of messages in each compacted page of a chat history
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", 100))
+# Number of most recent messages loaded for display
+CHAT_HISTORY_DISPLAY_LIMIT = int(os.environ.get("CHAT_HISTORY_DISPLAY_LIMIT", 50))
+# Directory of the local journal of chat history writes not yet stored in the blob store
+CHAT_HISTORY_JOURNAL_PATH = os.environ.get("CHAT_HISTORY_JOURNAL_PATH", os.path.join(".cache", "chat_history_journal"))
+# Number of threads storing chat history writes in the background
+CHAT_HISTORY_WRITERS = int(os.environ.get("CHAT_HISTORY_WRITERS", 4))
+
+# Longest wait between two attempts of a chat history write while the blob store fails
+_MAX_RETRY_SECONDS = 30
+# Seconds given to the pending chat history writes to be stored when the process exits
+_EXIT_FLUSH_SECONDS = 10
+
+
+def _prefix(user_id, use_case_id):
+    return f"{user_id}_{use_case_id}_chat_history"
+
+
+def _legacy_blob_name(user_id, use_case_id):
+    """Name of the single pickle that held the whole chat history before the append log."""
+    return f"{user_id}_{use_case_id}_chat_history.pkl"
+
+
+def _encode(messages):
+    return "".join(json.dumps(message) + "\n" for message in messages).encode("utf-8")
+
+
+def _decode(data):
+    return [json.loads(line) for line in data.decode("utf-8").splitlines() if line]
+
+
+def _read_index(prefix):
+    """
+    Reads the index of a chat history.
+
+    The index records how many pages have been compacted and which generation of the
+    append log currently receives new messages.
+
+    Returns:
+        tuple: The index dict and its ETag, or a new index and None if there is none yet.
+    """
+    try:
+        data, etag = get_blob_store().read_with_etag(f"{prefix}/index.json")
+    except ResourceNotFoundError:
+        return {"pages": 0, "log": 0}, None
+    return json.loads(data), etag
+
+
+def _read_log(prefix, index):
+    try:
+        return _decode(get_blob_store().read(f"{prefix}/log-{index['log']:06d}.jsonl"))
+    except ResourceNotFoundError:
+        return []
+
+
+def _read_page(prefix, page):
+    return _decode(get_blob_store().read(f"{prefix}/page-{page:06d}.jsonl"))
+
+
+def _migrate_legacy_history(user_id, use_case_id):
+    """Moves a pickled chat history into the append log the first time it is read."""
+    store = get_blob_store()
+    try:
+        messages = pickle.loads(store.read(_legacy_blob_name(user_id, use_case_id)))
+    except ResourceNotFoundError:
+        return False
+    prefix = _prefix(user_id, use_case_id)
+    store.create_append(f"{prefix}/log-000000.jsonl", _encode(messages))
+    try:
+        store.write(f"{prefix}/index.json", json.dumps({"pages": 0, "log": 0}).encode("utf-8"), create_only=True)
+    except ResourceExistsError:
+        pass
+    store.delete(_legacy_blob_name(user_id, use_case_id))
+    return True
+
+
+def _compact(prefix, index, etag, log):
+    """
+    Moves the full pages at the start of the append log into immutable page blobs.
+
+    The remaining messages are written to the next generation of the log, and the index
+    is switched to it only if no other session changed the index in the meantime. The old
+    log is then sealed: messages appended to it before are carried over to the new one, and
+    sessions appending to it later fail and append to the new log instead (see
+    append_chat_messages). The sealed log is kept until the next compaction, as a late
+    append to a deleted log would create it again.
+    """
+    store = get_blob_store()
+    full_pages = len(log) // CHAT_HISTORY_PAGE_SIZE
+    for page in range(full_pages):
+        messages = log[page * CHAT_HISTORY_PAGE_SIZE:(page + 1) * CHAT_HISTORY_PAGE_SIZE]
+        store.write(f"{prefix}/page-{index['pages'] + page:06d}.jsonl", _encode(messages))
+
+    new_index = {"pages": index["pages"] + full_pages, "log": index["log"] + 1}
+    store.create_append(f"{prefix}/log-{new_index['log']:06d}.jsonl", _encode(log[full_pages * CHAT_HISTORY_PAGE_SIZE:]))
+    try:
+        if etag is None:
+            store.write(f"{prefix}/index.json", json.dumps(new_index).encode("utf-8"), create_only=True)
+        else:
+            store.write(f"{prefix}/index.json", json.dumps(new_index).encode("utf-8"), if_match=etag)
+    except (ResourceModifiedError, ResourceExistsError):
+        store.delete(f"{prefix}/log-{new_index['log']:06d}.jsonl")
+        return
+
+    store.seal(f"{prefix}/log-{index['log']:06d}.jsonl")
+    late_messages = _read_log(prefix, index)[len(log):]
+    if late_messages:
+        store.append(f"{prefix}/log-{new_index['log']:06d}.jsonl", _encode(late_messages))
+    if index["log"] > 0:
+        store.delete(f"{prefix}/log-{index['log'] - 1:06d}.jsonl")
+
+
+def _read_range(prefix, index, start, end):
+    """Returns the messages of the compacted pages between two positions of the history."""
+    messages = []
+    first_page = start // CHAT_HISTORY_PAGE_SIZE
+    for page in range(first_page, min(index["pages"], -(-end // CHAT_HISTORY_PAGE_SIZE))):
+        messages += _read_page(prefix, page)
+    offset = first_page * CHAT_HISTORY_PAGE_SIZE
+    return messages[start - offset:max(0, end - offset)]
+
+
+@traced("chat_history_load")
+def load_chat_history(user_id, use_case_id, limit=CHAT_HISTORY_DISPLAY_LIMIT):
+    """
+    Loads the most recent messages of a chat history.
+
+    Only the index, the append log and, if the log holds fewer than limit messages, the
+    last compacted pages are downloaded. The returned messages always start with a user
+    message, so they can be paired by convert_chat_history. When the log has grown to two
+    pages or more, it is compacted.
+
+    Args:
+        user_id (str): The ID of the user whose chat history is to be loaded.
+        use_case_id (str): The ID of the use case of the chat history.
+        limit (int): The maximum number of messages to load.
+
+    Returns:
+        tuple: The list of messages and the position of the first one in the whole history,
+               to be passed to load_older_chat_history.
+    """
+    prefix = _prefix(user_id, use_case_id)
+    index, etag = _read_index(prefix)
+    log = _read_log(prefix, index)
+    if etag is None and not log and _migrate_legacy_history(user_id, use_case_id):
+        index, etag = _read_index(prefix)
+        log = _read_log(prefix, index)
+
+    compacted = index["pages"] * CHAT_HISTORY_PAGE_SIZE
+    start = max(0, compacted + len(log) - limit)
+    start += start % 2  # Messages alternate user/assistant, starting with the user
+    messages = _read_range(prefix, index, start, compacted) + log[max(0, start - compacted):]
+
+    if len(log) >= 2 * CHAT_HISTORY_PAGE_SIZE:
+        _compact(prefix, index, etag, log)
+    return messages, start
+
+
+@traced("chat_history_load_older")
+def load_older_chat_history(user_id, use_case_id, before, limit=CHAT_HISTORY_DISPLAY_LIMIT):
+    """
+    Loads a page of older messages, for paginating a chat history on demand.
+
+    Args:
+        user_id (str): The ID of the user whose chat history is to be loaded.
+        use_case_id (str): The ID of the use case of the chat history.
+        before (int): The position of the first message already loaded.
+        limit (int): The maximum number of messages to load.
+
+    Returns:
+        tuple: The list of messages before that position and the position of the first one.
+    """
+    prefix = _prefix(user_id, use_case_id)
+    index, _ = _read_index(prefix)
+    start = max(0, before - limit)
+    start += start % 2
+    compacted = index["pages"] * CHAT_HISTORY_PAGE_SIZE
+    messages = _read_range(prefix, index, start, min(before, compacted))
+    if before > compacted:
+        messages += _read_log(prefix, index)[max(0, start - compacted):before - compacted]
+    return messages, start
+
+
+@traced("chat_history_append")
+def append_chat_messages(user_id, use_case_id, messages):
+    """
+    Appends messages to the end of a chat history.
+
+    Only the new messages are uploaded, as one block appended to the current log. If a
+    compaction sealed that log in the meantime, they are appended to the next one.
+
+    Args:
+        user_id (str): The ID of the user whose chat history is to be updated.
+        use_case_id (str): The ID of the use case of the chat history.
+        messages (list of dict): The messages to append, usually a user message and the answer.
+    """
+    prefix = _prefix(user_id, use_case_id)
+    while True:
+        index, _ = _read_index(prefix)
+        try:
+            get_blob_store().append(f"{prefix}/log-{index['log']:06d}.jsonl", _encode(messages))
+            return
+        except ResourceModifiedError:
+            continue  # Sealed by a compaction, which switched the index to the next log first
+
+
+@traced("chat_history_clear")
+def clear_chat_history(user_id, use_case_id):
+    """
+    Deletes every message of a chat history.
+
+    Args:
+        user_id (str): The ID of the user whose chat history is to be deleted.
+        use_case_id (str): The ID of the use case of the chat history.
+    """
+    store = get_blob_store()
+    prefix = _prefix(user_id, use_case_id)
+    index, _ = _read_index(prefix)
+    store.delete(f"{prefix}/index.json")
+    for page in range(index["pages"]):
+        store.delete(f"{prefix}/page-{page:06d}.jsonl")
+    for log in range(max(0, index["log"] - 1), index["log"] + 1):
+        store.delete(f"{prefix}/log-{log:06d}.jsonl")
+    store.delete(_legacy_blob_name(user_id, use_case_id))
+
+
+def _already_appended(user_id, use_case_id, messages):
+    """Checks whether the append log already ends with some messages, e.g. stored by an attempt that seemed to fail."""
+    prefix = _prefix(user_id, use_case_id)
+    index, _ = _read_index(prefix)
+    return _read_log(prefix, index)[-len(messages):] == messages
+
+
+class ChatHistoryWriter:
+    """
+    Stores chat history writes in the background, so a turn ends without waiting for the blob store.
+
+    Every write is first recorded in a local journal, one file per write, which is only
+    removed once the write is stored in the blob store; writes left in the journal when the
+    writer is created, e.g. by a server process that crashed, are stored then. The writes of
+    a chat history are stored one at a time, in the order they were made, and retried with a
+    growing delay while the blob store fails. A write that may already have been stored by
+    an earlier attempt is not appended again.
+
+    Until they are stored, load returns the chat history with its pending writes applied, so
+    a session always reads its own messages.
+
+    Args:
+        journal_path (str): The directory of the journal.
+        workers (int): Number of threads storing writes.
+    """
+
+    def __init__(self, journal_path=CHAT_HISTORY_JOURNAL_PATH, workers=CHAT_HISTORY_WRITERS) -> None:
+        os.makedirs(journal_path, exist_ok=True)
+        self.journal_path = journal_path
+        self._pending = {}
+        self._history_locks = {}
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+        journal = sorted(name for name in os.listdir(journal_path) if name.endswith(".json"))
+        self._sequence = max((int(name.split("-")[0]) for name in journal), default=-1) + 1
+        for name in journal:
+            with open(os.path.join(journal_path, name)) as f:
+                write = json.load(f)
+            write["replayed"] = True
+            self._schedule(write)
+        for _ in range(workers):
+            # Daemon threads do not hold up the exit of the process; unstored writes stay in the journal
+            threading.Thread(target=self._work, name="chat-history-writer", daemon=True).start()
+
+    def _history_lock(self, key):
+        """Returns the lock held while a chat history is read or one of its writes is stored."""
+        with self._lock:
+            return self._history_locks.setdefault(key, threading.Lock())
+
+    def _schedule(self, write):
+        key = (write["user_id"], write["use_case_id"])
+        with self._lock:
+            # A history with pending writes is already being stored by a worker, which stores this one too
+            if key in self._pending:
+                self._pending[key].append(write)
+            else:
+                self._pending[key] = [write]
+                self._ready.put(key)
+
+    def _submit(self, user_id, use_case_id, operation, messages=()):
+        with self._lock:
+            sequence = self._sequence
+            self._sequence += 1
+        write = {"journal": f"{sequence:012d}-{uuid.uuid4().hex}.json", "user_id": user_id,
+                 "use_case_id": use_case_id, "operation": operation, "messages": list(messages)}
+        path = os.path.join(self.journal_path, write["journal"])
+        with open(path + ".tmp", "w") as f:
+            json.dump(write, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._schedule(write)
+
+    def append(self, user_id, use_case_id, messages):
+        """
+        Appends messages to the end of a chat history in the background. See append_chat_messages.
+
+        Returns once the messages are in the journal.
+        """
+        self._submit(user_id, use_case_id, "append", messages)
+
+    def clear(self, user_id, use_case_id):
+        """Deletes every message of a chat history in the background. See clear_chat_history."""
+        self._submit(user_id, use_case_id, "clear")
+
+    def _store(self, write):
+        if write["operation"] == "clear":
+            clear_chat_history(write["user_id"], write["use_case_id"])
+        elif not (write.get("replayed") and _already_appended(write["user_id"], write["use_case_id"], write["messages"])):
+            append_chat_messages(write["user_id"], write["use_case_id"], write["messages"])
+
+    def _work(self):
+        while True:
+            key = self._ready.get()
+            delay = 1
+            stored_all = False
+            while not stored_all:
+                with self._lock:
+                    write = self._pending[key][0]
+                try:
+                    with self._history_lock(key), start_trace("chat_history_write"):
+                        self._store(write)
+                        os.remove(os.path.join(self.journal_path, write["journal"]))
+                        with self._lock:
+                            writes = self._pending[key]
+                            writes.pop(0)
+                            stored_all = not writes
+                            if stored_all:
+                                del self._pending[key]
+                                self._idle.notify_all()
+                except Exception as e:
+                    print(f"Exception occurred: {e}")
+                    increment("chat_history_writes_total", outcome="retried")
+                    write["replayed"] = True
+                    time.sleep(delay)
+                    delay = min(2 * delay, _MAX_RETRY_SECONDS)
+                    continue
+                increment("chat_history_writes_total", outcome="stored")
+                delay = 1
+
+    def load(self, user_id, use_case_id, limit=CHAT_HISTORY_DISPLAY_LIMIT):
+        """
+        Loads the most recent messages of a chat history, including its pending writes. See load_chat_history.
+
+        Returns:
+            tuple: The list of messages and the position of the first one in the whole history.
+        """
+        key = (user_id, use_case_id)
+        with self._history_lock(key):
+            messages, start = load_chat_history(user_id, use_case_id, limit)
+            with self._lock:
+                writes = list(self._pending.get(key, []))
+        for write in writes:
+            if write["operation"] == "clear":
+                messages, start = [], 0
+            else:
+                messages = messages + write["messages"]
+        return messages, start
+
+    def flush(self, timeout=None):
+        """
+        Waits until every pending write is stored.
+
+        Returns:
+            bool: True if all writes were stored, False if the timeout expired first.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+
+
+_chat_history_writer = None
+_chat_history_writer_lock = threading.Lock()
+
+
+def get_chat_history_writer():
+    """Returns the process-wide chat history writer, which stores its pending writes before the process exits."""
+    global _chat_history_writer
+    with _chat_history_writer_lock:
+        if _chat_history_writer is None:
+            _chat_history_writer = ChatHistoryWriter()
+            atexit.register(_chat_history_writer.flush, _EXIT_FLUSH_SECONDS)
+        return _chat_history_writer
@@ -0,0 +1,71 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from chat_history import get_chat_history_writer
+from qa_engine import get_use_case_qa_engine
+from telemetry import span, propagate
+
+
+# Number of threads running the loads of chat turns that do not depend on each other
+CHAT_TURN_WORKERS = int(os.environ.get("CHAT_TURN_WORKERS", 8))
+
+
+class ChatTurnExecutor:
+    """
+    Overlaps the independent blob store, library and embedding calls of a chat turn.
+
+    A rerun of the chat page needs the user's use cases, the chat history of the selected
+    use case and its question answering engine. The chat history of the use case selected
+    in the previous run is downloaded while the use cases are loaded, and the engine, whose
+    document library manifest may have to be revalidated, while the history is. When a
+    question is asked, it is embedded while the page renders it and prepares the turn.
+    Chat history writes are left to the background chat history writer.
+
+    Spans of the background loads are recorded in the trace of the run that started them.
+
+    Args:
+        max_workers (int): Number of threads running loads.
+    """
+
+    def __init__(self, max_workers=CHAT_TURN_WORKERS) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-turn")
+
+    def submit(self, name, function, *args, **kwargs):
+        """Runs a function in the background as a span of the current trace, returning its Future."""
+        def run():
+            with span(name):
+                return function(*args, **kwargs)
+        return self._executor.submit(propagate(run))
+
+    def load_history(self, user_id, use_case_name):
+        """Starts loading the recent messages of a chat history, with its pending writes. See ChatHistoryWriter.load."""
+        return self.submit("load_history", get_chat_history_writer().load, user_id, use_case_name)
+
+    def load_qa_engine(self, user_id, use_case_name):
+        """Starts getting the question answering engine of a use case. See get_use_case_qa_engine."""
+        return self.submit("load_qa_engine", get_use_case_qa_engine, user_id, use_case_name)
+
+    def embed_question(self, qa_engine, question, chat_history):
+        """
+        Starts embedding a question for its retrieval and answer cache lookup.
+
+        Returns:
+            Future: The embedding of the question, or None if the engine condenses it with
+                    the chat history, in which case the question itself is not searched.
+        """
+        if qa_engine.will_condense(question, chat_history):
+            return self._executor.submit(lambda: None)
+        return self.submit("embed_query", qa_engine.vectorstore.embeddings.embed_query, question)
+
+
+_chat_turn_executor = None
+_chat_turn_executor_lock = threading.Lock()
+
+
+def get_chat_turn_executor():
+    """Returns the process-wide chat turn executor."""
+    global _chat_turn_executor
+    with _chat_turn_executor_lock:
+        if _chat_turn_executor is None:
+            _chat_turn_executor = ChatTurnExecutor()
+        return _chat_turn_executor
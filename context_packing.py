@@ -0,0 +1,162 @@
+import os
+import re
+from langchain_core.documents import Document
+from embedding_scheduler import estimate_tokens
+
+
+# Maximum number of tokens of retrieved text put into the answer prompt
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000))
+# Weight of relevance against diversity when selecting chunks (1.0 ignores diversity)
+CONTEXT_MMR_LAMBDA = float(os.environ.get("CONTEXT_MMR_LAMBDA", 0.7))
+# Word overlap from which a chunk is a near-duplicate of an already selected one and dropped
+CONTEXT_DUPLICATE_SIMILARITY = float(os.environ.get("CONTEXT_DUPLICATE_SIMILARITY", 0.8))
+
+# Shortest and longest text shared by the end of a chunk and the start of the next one
+_MIN_OVERLAP = 40
+_MAX_OVERLAP = 400
+
+_encoding = None
+
+
+def count_tokens(text):
+    """
+    Counts the tokens of a text with the tokenizer of the chat model.
+
+    Falls back to estimate_tokens if the tokenizer cannot be loaded, e.g. without network
+    access to download its vocabulary.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            try:
+                _encoding = tiktoken.encoding_for_model(os.environ.get("AZURE_CHAT_MODEL", "gpt-4o"))
+            except KeyError:
+                _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print(f"Exception occurred: {e}")
+            _encoding = False
+    if _encoding is False:
+        return estimate_tokens(text)
+    return len(_encoding.encode(text))
+
+
+def _overlap(first, second):
+    """Returns the length of the longest end of first that is also the start of second."""
+    for length in range(min(len(first), len(second), _MAX_OVERLAP), _MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def _merge(first, second):
+    """Merges two chunks of the same source if they overlap or one contains the other, else returns None."""
+    if second in first:
+        return first
+    if first in second:
+        return second
+    overlap = _overlap(first, second)
+    if overlap:
+        return first + second[overlap:]
+    overlap = _overlap(second, first)
+    if overlap:
+        return second + first[overlap:]
+    return None
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def _similarity(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def merge_overlapping_chunks(documents):
+    """
+    Merges the chunks of the same source that overlap, e.g. adjacent chunks of the splitter.
+
+    Args:
+        documents (list of Document): The retrieved chunks, most relevant first.
+
+    Returns:
+        list of Document: The merged passages, in the order of their most relevant chunk. Each
+                          records the number of chunks it was merged from as 'merged_chunks'.
+    """
+    passages = []
+    for doc in documents:
+        text = doc.page_content
+        source = doc.metadata.get("source")
+        merged_into = None
+        for passage in passages:
+            if passage.metadata.get("source") != source:
+                continue
+            merged = _merge(passage.page_content, text)
+            if merged is not None:
+                passage.page_content = merged
+                passage.metadata["merged_chunks"] += 1
+                merged_into = passage
+                break
+        if merged_into is None:
+            passages.append(Document(page_content=text, metadata={**doc.metadata, "merged_chunks": 1}))
+            continue
+        # The grown passage may now overlap another passage of the source
+        for passage in list(passages):
+            if passage is not merged_into and passage.metadata.get("source") == source:
+                merged = _merge(merged_into.page_content, passage.page_content)
+                if merged is not None:
+                    merged_into.page_content = merged
+                    merged_into.metadata["merged_chunks"] += passage.metadata["merged_chunks"]
+                    passages.remove(passage)
+    return passages
+
+
+def pack_context(documents, token_budget=CONTEXT_TOKEN_BUDGET, mmr_lambda=CONTEXT_MMR_LAMBDA,
+                 duplicate_similarity=CONTEXT_DUPLICATE_SIMILARITY):
+    """
+    Assembles the retrieved chunks into a compact context for the answer prompt.
+
+    Overlapping chunks of the same source are merged, then passages are selected in order
+    of relevance with an MMR-style penalty on their word overlap with the passages already
+    selected. Near-duplicates are dropped, and passages are added while they fit in the token
+    budget.
+
+    Args:
+        documents (list of Document): The retrieved chunks, most relevant first.
+        token_budget (int): Maximum number of tokens of the selected passages.
+        mmr_lambda (float): Weight of relevance against diversity.
+        duplicate_similarity (float): Word overlap from which a passage is a near-duplicate.
+
+    Returns:
+        tuple: The selected passages (list of Document) and a report of the 'tokens_before',
+               'tokens_after', 'tokens_saved', 'chunks_before' and 'passages_after'.
+    """
+    tokens_before = sum(count_tokens(doc.page_content) for doc in documents)
+    passages = merge_overlapping_chunks(documents)
+    relevance = {id(passage): 1.0 - rank / len(passages) for rank, passage in enumerate(passages)}
+    shingles = {id(passage): _shingles(passage.page_content) for passage in passages}
+    tokens = {id(passage): count_tokens(passage.page_content) for passage in passages}
+
+    selected, used_tokens = [], 0
+    candidates = list(passages)
+    while candidates:
+        def score(passage):
+            redundancy = max((_similarity(shingles[id(passage)], shingles[id(chosen)]) for chosen in selected), default=0.0)
+            return mmr_lambda * relevance[id(passage)] - (1 - mmr_lambda) * redundancy, redundancy
+
+        best = max(candidates, key=lambda passage: score(passage)[0])
+        candidates.remove(best)
+        if score(best)[1] >= duplicate_similarity:
+            continue
+        # The most relevant passage is always kept, even if it alone exceeds the budget
+        if selected and used_tokens + tokens[id(best)] > token_budget:
+            continue
+        selected.append(best)
+        used_tokens += tokens[id(best)]
+
+    report = {"tokens_before": tokens_before, "tokens_after": used_tokens, "tokens_saved": tokens_before - used_tokens,
+              "chunks_before": len(documents), "passages_after": len(selected)}
+    return selected, report
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import threading
+import time
+from azure.core.exceptions import ResourceNotFoundError, ResourceModifiedError, ResourceExistsError
+from blob_storage import get_blob_store
+from embedding_scheduler import EmbeddingUpsertEngine, chunk_point_id
+from use_case_catalog import CATALOG_REVALIDATE_SECONDS
+from vector_backends import get_vector_backend
+from telemetry import increment, traced
+
+
+# Suffix of the collection holding a user's document library; the double underscore keeps it
+# apart from the '{user}_{use_case}_documents' collections of use cases
+LIBRARY_COLLECTION_SUFFIX = "__library_documents"
+
+
+def document_id(file_bytes):
+    """Returns the identity of a document in the library: the SHA-256 hash of its content."""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def library_collection(user_id):
+    return f"{user_id}{LIBRARY_COLLECTION_SUFFIX}"
+
+
+class _ManifestEntry:
+    """A cached version of a user's library manifest."""
+
+    def __init__(self, manifest, etag) -> None:
+        self.manifest = manifest
+        self.etag = etag
+        self.checked_at = time.monotonic()
+
+
+class DocumentLibrary:
+    """
+    Per-user library of ingested documents, shared by the user's use cases.
+
+    A document is identified by the hash of its content, and chunked, embedded and stored
+    once, in the user's library collection, with its ID in the 'document_id' metadata of its
+    chunks. A library use case is a named list of document IDs, whose retrieval is filtered
+    on them, so creating a use case from documents already in the library costs no parsing
+    or embedding. The number of use cases listing a document is its reference count: when
+    it drops to zero, the document and its vectors are deleted.
+
+    The manifest of a user, i.e. their documents and use cases, is a JSON blob updated under
+    ETag conditions and cached in memory like the use case catalog. A use case references
+    its documents before they are ingested, so they cannot be deleted in the meantime by
+    another use case releasing them.
+
+    Args:
+        store (AzureBlobStore or LocalBlobStore): The blob store holding the manifests.
+        backend (QdrantBackend, SharedQdrantBackend or LocalBackend): The vector backend.
+        revalidate_seconds (float): How long a cached manifest is trusted without revalidation.
+    """
+
+    def __init__(self, store, backend, revalidate_seconds=CATALOG_REVALIDATE_SECONDS) -> None:
+        self.store = store
+        self.backend = backend
+        self.revalidate_seconds = revalidate_seconds
+        self._entries = {}
+        self._user_locks = {}
+        self._ingestion_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def blob_name(user_id):
+        return f"{user_id}_document_library.json"
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def _ingestion_lock(self, user_id):
+        with self._lock:
+            return self._ingestion_locks.setdefault(user_id, threading.Lock())
+
+    def _entry(self, user_id):
+        """Returns the current manifest entry of a user, revalidating it with the blob store if it is stale."""
+        with self._user_lock(user_id):
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry.checked_at < self.revalidate_seconds:
+                return entry
+
+            try:
+                if entry is not None and entry.etag is not None:
+                    data, etag = self.store.read_if_changed(self.blob_name(user_id), entry.etag)
+                else:
+                    data, etag = self.store.read_with_etag(self.blob_name(user_id))
+            except ResourceNotFoundError:
+                data, etag = None, None
+                entry = None
+
+            if data is not None:
+                entry = _ManifestEntry(json.loads(data), etag)
+            elif entry is None:
+                entry = _ManifestEntry({"documents": {}, "use_cases": {}}, None)
+            else:
+                entry.checked_at = time.monotonic()
+            self._entries[user_id] = entry
+            return entry
+
+    def _update(self, user_id, update):
+        """
+        Applies an update to a user's manifest and uploads it, re-applying it to the latest
+        manifest if another session changed it in the meantime.
+
+        Args:
+            user_id (str): The ID of the user whose manifest is to be updated.
+            update (callable): Function changing a copy of the manifest in place, whose
+                               result is returned.
+        """
+        while True:
+            self.invalidate(user_id)
+            entry = self._entry(user_id)
+            manifest = json.loads(json.dumps(entry.manifest))
+            result = update(manifest)
+            try:
+                etag = self.store.write(self.blob_name(user_id), json.dumps(manifest).encode("utf-8"),
+                                        if_match=entry.etag, create_only=entry.etag is None)
+            except (ResourceModifiedError, ResourceExistsError):
+                continue
+            with self._user_lock(user_id):
+                self._entries[user_id] = _ManifestEntry(manifest, etag)
+            return result
+
+    def invalidate(self, user_id):
+        """Forces the next access to a user's manifest to revalidate it with the blob store."""
+        with self._user_lock(user_id):
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry.checked_at = float("-inf")
+
+    def documents(self, user_id):
+        """
+        Returns the documents of a user's library.
+
+        Returns:
+            dict: The 'name', MIME 'type', 'size' in bytes, number of 'chunks', 'added_at'
+                  timestamp and referencing 'use_cases' of every document, by document ID.
+        """
+        manifest = self._entry(user_id).manifest
+        return {doc_id: {**info, "use_cases": [name for name, doc_ids in manifest["use_cases"].items() if doc_id in doc_ids]}
+                for doc_id, info in manifest["documents"].items()}
+
+    def use_case_documents(self, user_id, use_case_name):
+        """Returns the document IDs of a library use case, or None if the use case is not built from the library."""
+        document_ids = self._entry(user_id).manifest["use_cases"].get(use_case_name)
+        return None if document_ids is None else list(document_ids)
+
+    def missing_documents(self, user_id, document_ids):
+        """Returns the document IDs, without duplicates, that are not stored in the library yet."""
+        stored = self._entry(user_id).manifest["documents"]
+        return [doc_id for doc_id in dict.fromkeys(document_ids) if doc_id not in stored]
+
+    @traced("library_add_document")
+    def add_document(self, user_id, doc_id, name, file_type, size, docs, embeddings, progress_callback=None):
+        """
+        Embeds and stores the chunks of a document, then lists it in the library.
+
+        Chunks whose points are already stored, e.g. by an interrupted earlier attempt, are
+        not embedded again. Documents are added one at a time per user and process, so the
+        library collection is only created once.
+
+        Args:
+            user_id (str): The ID of the user owning the library.
+            doc_id (str): The document ID, see document_id.
+            name (str): The file name of the document.
+            file_type (str): The MIME type of the document.
+            size (int): The size of the document in bytes.
+            docs (list of Document): The chunks of the document.
+            embeddings (Embeddings): The embedding model.
+            progress_callback (callable, optional): Called with the (embedded, upserted) chunk
+                                                    counts whenever a batch completes.
+        """
+        collection_name = library_collection(user_id)
+        with self._ingestion_lock(user_id):
+            for doc in docs:
+                doc.metadata["document_id"] = doc_id
+            ids = [chunk_point_id(doc) for doc in docs]
+            stored_ids = set()
+            if self.backend.collection_exists(collection_name):
+                stored_ids = self.backend.point_ids_where(collection_name, "document_id", doc_id)
+            pending = [(point_id, doc) for point_id, doc in zip(ids, docs) if point_id not in stored_ids]
+            if pending:
+                engine = EmbeddingUpsertEngine(self.backend, embeddings)
+                engine.run([doc for _, doc in pending], collection_name, ids=[point_id for point_id, _ in pending],
+                           recreate=False, progress_callback=progress_callback)
+                stored_ids = self.backend.point_ids_where(collection_name, "document_id", doc_id)
+            if len(stored_ids) < len(set(ids)):
+                raise RuntimeError(f"Only {len(stored_ids)} of {len(set(ids))} chunks of {name} are stored in {collection_name}")
+
+        def register(manifest):
+            manifest["documents"][doc_id] = {"name": name, "type": file_type, "size": size,
+                                             "chunks": len(set(ids)), "added_at": time.time()}
+
+        self._update(user_id, register)
+        increment("library_documents_total", outcome="ingested")
+
+    def reference(self, user_id, use_case_name, document_ids):
+        """
+        Sets the documents of a library use case, creating it if needed.
+
+        Documents no longer referenced by any use case are deleted.
+
+        Returns:
+            list of str: The IDs of the deleted documents.
+        """
+        return self._set_references(user_id, use_case_name, list(dict.fromkeys(document_ids)))
+
+    def release(self, user_id, use_case_name):
+        """Removes a use case from the library, deleting the documents only it referenced. See reference."""
+        return self._set_references(user_id, use_case_name, None)
+
+    def _set_references(self, user_id, use_case_name, document_ids):
+        def update(manifest):
+            if document_ids is None:
+                manifest["use_cases"].pop(use_case_name, None)
+            else:
+                manifest["use_cases"][use_case_name] = document_ids
+            referenced = {doc_id for doc_ids in manifest["use_cases"].values() for doc_id in doc_ids}
+            unreferenced = [doc_id for doc_id in manifest["documents"] if doc_id not in referenced]
+            for doc_id in unreferenced:
+                del manifest["documents"][doc_id]
+            return unreferenced
+
+        unreferenced = self._update(user_id, update)
+        collection_name = library_collection(user_id)
+        if unreferenced and self.backend.collection_exists(collection_name):
+            for doc_id in unreferenced:
+                self.backend.delete(collection_name, self.backend.point_ids_where(collection_name, "document_id", doc_id))
+        increment("library_documents_total", len(unreferenced), outcome="deleted")
+        return unreferenced
+
+    def as_vectorstore(self, user_id, embeddings):
+        """Returns a LangChain vector store over the user's library collection."""
+        return self.backend.as_vectorstore(library_collection(user_id), embeddings)
+
+    def search_filter(self, document_ids):
+        """Returns the search filter restricting retrieval to some documents of the library."""
+        return self.backend.metadata_filter("document_id", document_ids)
+
+
+_document_library = None
+_document_library_lock = threading.Lock()
+
+
+def get_document_library():
+    """Returns the process-wide document library."""
+    global _document_library
+    with _document_library_lock:
+        if _document_library is None:
+            _document_library = DocumentLibrary(get_blob_store(), get_vector_backend())
+        return _document_library
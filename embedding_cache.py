@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from langchain_core.embeddings import Embeddings
+from embedding_scheduler import estimate_tokens
+from telemetry import increment
+
+
+# Location of the on-disk embedding cache and the maximum number of vectors it keeps
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 500000))
+
+# SQLite limits the number of parameters of a single statement
+_SQLITE_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed store of embedding vectors backed by SQLite.
+
+    Vectors are stored as float32 blobs keyed by a hash of the embedded text and the
+    embedding deployment name. When the cache holds more than max_entries vectors, the
+    least recently used ones are evicted. The cache can be shared by several threads.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES) -> None:
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+        self._size = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def key(text, namespace):
+        """Returns the cache key of a text embedded with the given deployment."""
+        return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """
+        Looks up the vectors of several keys and marks the found ones as recently used.
+
+        Args:
+            keys (list of str): The cache keys to look up.
+
+        Returns:
+            dict: The vectors (list of float) of the keys found in the cache, by key.
+        """
+        found = {}
+        now = time.time()
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(unique_keys), _SQLITE_BATCH_SIZE):
+                batch = unique_keys[i:i + _SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = array("f", vector).tolist()
+                self._connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                             [(now, key) for key, _ in rows])
+            self._connection.commit()
+            self.hits += len(found)
+            self.misses += len(unique_keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """
+        Stores several vectors and evicts the least recently used ones beyond max_entries.
+
+        Args:
+            items (dict): The vectors (list of float) to store, by cache key.
+        """
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+        with self._lock:
+            inserted = self._connection.total_changes
+            self._connection.executemany("INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            self._size += self._connection.total_changes - inserted
+            if self._size > self.max_entries:
+                self._evict(self._size - self.max_entries)
+            self._connection.commit()
+
+    def _evict(self, count):
+        """Deletes the count least recently used vectors. Must be called with the lock held."""
+        self._connection.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (count,)
+        )
+        self._size -= count
+        self.evictions += count
+
+    def stats(self):
+        """Returns the hit, miss and eviction counters and the number of cached vectors."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": self._size,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Returns the process-wide embedding cache stored at EMBEDDING_CACHE_PATH."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends texts missing from an EmbeddingCache to the model.
+
+    Args:
+        embeddings (Embeddings): The embedding model to wrap.
+        namespace (str): The embedding deployment name, part of every cache key so vectors
+                         of different models never mix.
+        cache (EmbeddingCache, optional): The cache to use. Defaults to the process-wide cache.
+    """
+
+    def __init__(self, embeddings, namespace, cache=None) -> None:
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.cache = cache or get_embedding_cache()
+
+    def embed_documents(self, texts):
+        keys = [EmbeddingCache.key(text, self.namespace) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        # Embed each missing text once, even if it appears several times in the input
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        increment("embedding_cache_lookups_total", len(texts) - len(missing), result="hit")
+        increment("embedding_cache_lookups_total", len(missing), result="miss")
+        if missing:
+            increment("embedding_tokens_total", sum(estimate_tokens(text) for text in missing.values()))
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), new_vectors))
+            self.cache.put_many(new_items)
+            vectors.update(new_items)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        key = EmbeddingCache.key(text, f"{self.namespace}\0query")
+        vector = self.cache.get_many([key]).get(key)
+        increment("embedding_cache_lookups_total", result="hit" if vector is not None else "miss")
+        if vector is None:
+            increment("embedding_tokens_total", estimate_tokens(text))
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many({key: vector})
+        return vector
@@ -0,0 +1,303 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from telemetry import span, increment, propagate
+
+
+# Initial number of chunks per embedding request and number of requests in flight
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 4))
+# Number of Qdrant upserts in flight while the next batches are being embedded
+UPSERT_CONCURRENCY = int(os.environ.get("UPSERT_CONCURRENCY", 2))
+# Token-per-minute quota of the embedding deployment, 0 means no client-side limit; it is enforced by the
+# admission control of the deployment (see request_scheduler)
+AZURE_EMBEDDINGS_TPM = int(os.environ.get("AZURE_EMBEDDINGS_TPM", 0))
+# Number of times a throttled batch is retried before ingestion fails
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", 6))
+
+MIN_BATCH_SIZE = 8
+
+# Namespace of the UUIDs derived from chunk contents
+CHUNK_ID_NAMESPACE = uuid.UUID("5b0d6c8e-52f4-4a7e-9a53-4d3f3c1f6a0b")
+
+
+def chunk_point_id(doc):
+    """
+    Returns the stable Qdrant point ID of a chunk.
+
+    The ID is derived from the chunk's document, i.e. its 'document_id' in the document
+    library or else its source file name, and a hash of its content, so the same chunk of
+    the same document always maps to the same point.
+
+    Args:
+        doc (Document): The chunk, with a 'source' or 'document_id' metadata entry.
+
+    Returns:
+        str: A UUID string.
+    """
+    content_hash = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{doc.metadata.get('document_id', doc.metadata.get('source', ''))}\0{content_hash}"))
+
+
+def estimate_tokens(text):
+    """Estimates the number of tokens of a text (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(error):
+    """Returns True if an exception is an HTTP 429 from the embedding service."""
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status_code == 429
+
+
+def retry_after_seconds(error, default):
+    """
+    Reads the delay requested by a throttled response.
+
+    Args:
+        error (Exception): The rate limit error, usually an openai.RateLimitError.
+        default (float): The delay to use when the response has no retry-after header.
+
+    Returns:
+        float: The number of seconds to wait before retrying.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return default
+
+
+class TokenRateLimiter:
+    """
+    Token bucket enforcing a token-per-minute budget shared by all threads calling a deployment.
+
+    A retry-after delay from the service pauses every thread, not only the throttled one.
+    """
+
+    def __init__(self, tokens_per_minute) -> None:
+        self.tokens_per_minute = tokens_per_minute
+        self._available = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Blocks all callers of acquire for the given number of seconds."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def try_acquire(self, tokens):
+        """
+        Takes a request of the given number of tokens from the budget if it allows it.
+
+        Returns:
+            float: 0 if the tokens were taken, or else the seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = self._paused_until - now
+            if delay > 0:
+                return delay
+            if not self.tokens_per_minute:
+                return 0
+            self._available = min(self.tokens_per_minute,
+                                   self._available + (now - self._updated) * self.tokens_per_minute / 60)
+            self._updated = now
+            # A request larger than the whole budget is let through once the bucket is full
+            needed = min(tokens, self.tokens_per_minute)
+            if self._available >= needed:
+                self._available -= needed
+                return 0
+            return (needed - self._available) * 60 / self.tokens_per_minute
+
+    def acquire(self, tokens):
+        """Waits until the budget allows sending a request of the given number of tokens."""
+        while True:
+            delay = self.try_acquire(tokens)
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+
+class AdaptiveLimits:
+    """
+    Batch size and concurrency that shrink when the service throttles and grow back slowly.
+
+    Throttling halves both limits; every few successful batches raise them again by one
+    step, up to their initial values (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, batch_size, concurrency, recovery_batches=4) -> None:
+        self.max_batch_size = batch_size
+        self.max_concurrency = concurrency
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.recovery_batches = recovery_batches
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    def on_throttle(self):
+        with self._lock:
+            self.batch_size = max(MIN_BATCH_SIZE, self.batch_size // 2)
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+
+    def on_success(self):
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.recovery_batches:
+                self._successes = 0
+                self.batch_size = min(self.max_batch_size, self.batch_size + MIN_BATCH_SIZE)
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+
+def deployment_scheduler(embeddings):
+    """Returns the admission control of the deployment behind an embedding model, or None if it has none."""
+    while embeddings is not None:
+        scheduler = getattr(embeddings, "scheduler", None)
+        if scheduler is not None:
+            return scheduler
+        embeddings = getattr(embeddings, "embeddings", None)
+    return None
+
+
+class EmbeddingUpsertEngine:
+    """
+    Embeds documents in concurrent batches and upserts them to the vector store as batches complete.
+
+    Several embedding requests run in flight on a thread pool while completed batches are
+    upserted on a second pool, so the latency of the embedding service and of the vector
+    store overlap. The token budget of the embedding deployment is enforced by its admission
+    control, shared with every other caller of the deployment. Throttled requests (HTTP 429)
+    are retried after the retry-after delay of the response, and the batch size and
+    concurrency adapt to the throttling. Points are
+    stored with the payload layout of LangChain's vector stores, so the collection can be
+    queried with backend.as_vectorstore(...).as_retriever().
+
+    Args:
+        backend (QdrantBackend or LocalBackend): The vector backend receiving the upserts.
+        embeddings (Embeddings): The embedding model.
+        batch_size (int, optional): Initial number of chunks per embedding request.
+        max_concurrency (int, optional): Maximum number of embedding requests in flight.
+        upsert_concurrency (int, optional): Maximum number of upserts in flight.
+        tokens_per_minute (int, optional): Token budget of this engine's requests, within the budget
+                                           of the deployment's admission control, 0 for none.
+        max_retries (int, optional): Number of retries of a throttled batch.
+    """
+
+    def __init__(self, backend, embeddings, batch_size=None, max_concurrency=None, upsert_concurrency=None,
+                 tokens_per_minute=None, max_retries=None) -> None:
+        self.backend = backend
+        self.embeddings = embeddings
+        self.limits = AdaptiveLimits(batch_size or EMBEDDING_BATCH_SIZE, max_concurrency or EMBEDDING_MAX_CONCURRENCY)
+        self.upsert_concurrency = upsert_concurrency or UPSERT_CONCURRENCY
+        self.scheduler = deployment_scheduler(embeddings)
+        # The engine's own budget leaves the deployment's, shared by every other caller, unchanged
+        self.rate_limiter = TokenRateLimiter(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+
+    def _embed_batch(self, batch):
+        """Embeds a batch of (id, text, metadata) tuples, retrying when throttled."""
+        texts = [text for _, text, _ in batch]
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(sum(estimate_tokens(text) for text in texts))
+            try:
+                with span("embed_batch", chunks=len(texts), attempt=attempt):
+                    vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                increment("embedding_throttled_total")
+                self.limits.on_throttle()
+                # The admission control of the deployment already pauses it for every caller
+                if self.scheduler is None:
+                    time.sleep(retry_after_seconds(e, default=2 ** attempt))
+                continue
+            self.limits.on_success()
+            increment("chunks_total", len(batch), stage="embedded")
+            return batch, vectors
+
+    def _upsert_batch(self, collection_name, batch, vectors):
+        """Upserts an embedded batch in LangChain's vector store payload layout."""
+        ids = [point_id for point_id, _, _ in batch]
+        payloads = [{"page_content": text, "metadata": metadata} for _, text, metadata in batch]
+        with span("upsert_batch", chunks=len(batch)):
+            self.backend.upsert(collection_name, ids, vectors, payloads)
+        increment("chunks_total", len(batch), stage="upserted")
+        return len(batch)
+
+    def run(self, docs, collection_name, ids=None, recreate=True, progress_callback=None):
+        """
+        Embeds and upserts documents into a collection.
+
+        Args:
+            docs (list of Document): The documents to store.
+            collection_name (str): The collection to write to.
+            ids (list of str, optional): Point IDs of the documents. Defaults to chunk_point_id.
+            recreate (bool): Whether to replace the collection before the first upsert. When
+                             False, the collection is created only if it does not exist. With
+                             no documents, there is no vector to size a new collection, so the
+                             existing one is deleted.
+            progress_callback (callable, optional): Called with (embedded, upserted) counts
+                                                    whenever a batch completes.
+
+        Returns:
+            int: The number of points upserted.
+        """
+        with span("embed_upsert", chunks=len(docs)):
+            return self._run(docs, collection_name, ids, recreate, progress_callback)
+
+    def _run(self, docs, collection_name, ids, recreate, progress_callback):
+        if not docs:
+            if recreate and self.backend.collection_exists(collection_name):
+                self.backend.delete_collection(collection_name)
+            if progress_callback:
+                progress_callback(0, 0)
+            return 0
+        ids = ids or [chunk_point_id(doc) for doc in docs]
+        items = [(point_id, doc.page_content, doc.metadata) for point_id, doc in zip(ids, docs)]
+        embedded, upserted, cursor = 0, 0, 0
+        collection_ready = False
+        embed_futures, upsert_futures = set(), set()
+
+        with ThreadPoolExecutor(max_workers=self.limits.max_concurrency) as embed_pool, \
+                ThreadPoolExecutor(max_workers=self.upsert_concurrency) as upsert_pool:
+            while cursor < len(items) or embed_futures:
+                # Keep as many batches in flight as the adaptive limits allow
+                while cursor < len(items) and len(embed_futures) < self.limits.concurrency:
+                    batch = items[cursor:cursor + self.limits.batch_size]
+                    cursor += len(batch)
+                    embed_futures.add(embed_pool.submit(propagate(self._embed_batch), batch))
+
+                done, embed_futures = wait(embed_futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, vectors = future.result()
+                    embedded += len(batch)
+                    if not collection_ready:
+                        if recreate or not self.backend.collection_exists(collection_name):
+                            self.backend.create_collection(collection_name, len(vectors[0]))
+                        collection_ready = True
+                    upsert_futures.add(upsert_pool.submit(propagate(self._upsert_batch), collection_name, batch, vectors))
+
+                finished_upserts = {future for future in upsert_futures if future.done()}
+                for future in finished_upserts:
+                    upserted += future.result()
+                upsert_futures -= finished_upserts
+                if progress_callback:
+                    progress_callback(embedded, upserted)
+
+            for future in upsert_futures:
+                upserted += future.result()
+
+        if progress_callback:
+            progress_callback(embedded, upserted)
+        return upserted
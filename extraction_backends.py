@@ -0,0 +1,77 @@
+import io
+import os
+import pdfplumber
+import pypdfium2 as pdfium
+
+
+# Default PDF text extractor: "pdfplumber" (layout-aware) or "pdfium" (fast, text only)
+PDF_EXTRACTOR = os.environ.get("PDF_EXTRACTOR", "pdfplumber")
+
+
+class PdfplumberExtractor:
+    """
+    Layout-aware extraction with pdfplumber, which analyses the position of every character.
+
+    It is the slowest extractor, but orders the text of complex layouts (e.g. columns,
+    tables) more faithfully.
+    """
+
+    name = "pdfplumber"
+
+    def open(self, file_bytes):
+        return pdfplumber.open(io.BytesIO(file_bytes))
+
+    def page_count(self, pdf_doc):
+        return len(pdf_doc.pages)
+
+    def iter_page_texts(self, pdf_doc, start_page=0, end_page=None):
+        """Yields the 1-based number and the raw text of each page of a range."""
+        for page_number, page in enumerate(pdf_doc.pages[start_page:end_page], start=start_page + 1):
+            yield page_number, page.extract_text()
+            # Release the parsed layout objects of the page once its text is extracted
+            page.close()
+
+
+class PdfiumExtractor:
+    """
+    Text-only extraction with PDFium, reading the text objects of each page in content order.
+
+    It skips layout analysis and is typically an order of magnitude faster than pdfplumber.
+    """
+
+    name = "pdfium"
+
+    def open(self, file_bytes):
+        return pdfium.PdfDocument(file_bytes)
+
+    def page_count(self, pdf_doc):
+        return len(pdf_doc)
+
+    def iter_page_texts(self, pdf_doc, start_page=0, end_page=None):
+        """Yields the 1-based number and the raw text of each page of a range."""
+        end_page = len(pdf_doc) if end_page is None else min(end_page, len(pdf_doc))
+        for page_index in range(start_page, end_page):
+            page = pdf_doc[page_index]
+            text_page = page.get_textpage()
+            yield page_index + 1, text_page.get_text_bounded()
+            text_page.close()
+            page.close()
+
+
+PDF_EXTRACTORS = {extractor.name: extractor for extractor in (PdfplumberExtractor(), PdfiumExtractor())}
+
+
+def get_pdf_extractor(name=None):
+    """
+    Returns a PDF extractor by name.
+
+    Args:
+        name (str, optional): "pdfplumber" or "pdfium". Defaults to PDF_EXTRACTOR.
+
+    Returns:
+        PdfplumberExtractor or PdfiumExtractor: The extractor.
+    """
+    name = name or PDF_EXTRACTOR
+    if name not in PDF_EXTRACTORS:
+        raise ValueError(f"Unknown PDF extractor: {name}")
+    return PDF_EXTRACTORS[name]
@@ -0,0 +1,190 @@
+from langchain_core.documents import Document
+from embedding_scheduler import EmbeddingUpsertEngine, chunk_point_id
+from answer_cache import get_answer_cache
+from telemetry import traced
+from utils import agent, get_use_case_documents, set_use_case_documents
+from vector_backends import get_vector_backend
+from use_case_catalog import get_use_case_catalog
+from document_library import get_document_library, document_id
+from ingestion import ingest_into_library
+
+
+@traced("sync_documents")
+def sync_source_documents(collection_name, docs_by_source):
+    """
+    Brings the points of some source documents in line with their current chunks.
+
+    For every source, the stable point IDs of its chunks are diffed against the points
+    already stored for it. Only chunks that are not stored yet are embedded and upserted,
+    and points whose chunk no longer exists are deleted. A source mapped to an empty list
+    has all its points deleted.
+
+    Chunks collapsed as near-duplicates are only stored as the point of the chunk they were
+    collapsed into, which lists them in its 'duplicate_sources'. A deleted point that stands
+    for chunks of other sources is stored again as the chunk of the first of them, and the
+    synced sources are dropped from the 'duplicate_sources' of the points of other sources.
+
+    Args:
+        collection_name (str): The collection to update, e.g. '{user}_{use_case}_documents'.
+        docs_by_source (dict): The chunks (list of Document) of each source file name.
+
+    Returns:
+        dict: The number of 'added', 'deleted', 'unchanged' and 'repaired' points, the latter
+              being the points rewritten for their near-duplicates of other sources.
+    """
+    vector_backend = get_vector_backend()
+    summary = {"added": 0, "deleted": 0, "unchanged": 0, "repaired": 0}
+    new_docs, new_ids, stale_points = [], [], {}
+    for source, docs in docs_by_source.items():
+        existing = vector_backend.points_where(collection_name, "source", source)
+        current = {chunk_point_id(doc): doc for doc in docs}
+        for point_id, doc in current.items():
+            if point_id not in existing:
+                new_ids.append(point_id)
+                new_docs.append(doc)
+        stale_points.update((point_id, payload) for point_id, payload in existing.items() if point_id not in current)
+        summary["unchanged"] += len(existing.keys() & current.keys())
+
+    repaired_docs = _repaired_duplicates(vector_backend, collection_name, docs_by_source, stale_points)
+    if new_docs or repaired_docs:
+        engine = EmbeddingUpsertEngine(vector_backend, agent.embeddings)
+        added = engine.run(new_docs + repaired_docs, collection_name, recreate=False,
+                           ids=new_ids + [chunk_point_id(doc) for doc in repaired_docs])
+        summary["added"], summary["repaired"] = added - len(repaired_docs), len(repaired_docs)
+    if stale_points:
+        vector_backend.delete(collection_name, list(stale_points))
+        summary["deleted"] = len(stale_points)
+    if new_docs or repaired_docs or stale_points:
+        get_answer_cache().invalidate(collection_name)
+    return summary
+
+
+def _repaired_duplicates(vector_backend, collection_name, docs_by_source, stale_points):
+    """
+    Returns the chunks to store again so that the near-duplicates of other sources survive a sync.
+
+    A stale point whose 'duplicate_sources' name sources that are not synced is promoted to
+    the first of them. Points of other sources whose 'duplicate_sources' name a synced source
+    are stored again without it.
+    """
+    repaired = []
+    for payload in stale_points.values():
+        survivors = [provenance for provenance in payload["metadata"].get("duplicate_sources", [])
+                     if provenance.get("source") not in docs_by_source]
+        if survivors:
+            metadata = dict(survivors[0])
+            if survivors[1:]:
+                metadata["duplicate_sources"] = survivors[1:]
+            repaired.append(Document(page_content=payload["page_content"], metadata=metadata))
+
+    referencing = {}
+    for source in docs_by_source:
+        referencing.update(vector_backend.points_where(collection_name, "duplicate_sources[].source", source))
+    for point_id, payload in referencing.items():
+        if point_id in stale_points or payload["metadata"].get("source") in docs_by_source:
+            continue
+        metadata = {key: value for key, value in payload["metadata"].items() if key != "duplicate_sources"}
+        duplicate_sources = [provenance for provenance in payload["metadata"]["duplicate_sources"]
+                             if provenance.get("source") not in docs_by_source]
+        if duplicate_sources:
+            metadata["duplicate_sources"] = duplicate_sources
+        repaired.append(Document(page_content=payload["page_content"], metadata=metadata))
+    return repaired
+
+
+def _group_by_source(docs):
+    """Groups chunks by their source file name, keeping their order."""
+    docs_by_source = {}
+    for doc in docs:
+        docs_by_source.setdefault(doc.metadata["source"], []).append(doc)
+    return docs_by_source
+
+
+@traced("update_use_case")
+def update_use_case_documents(user_id, use_case_name, docs=(), removed_sources=()):
+    """
+    Adds, replaces and removes documents of an existing use case without recreating its collection.
+
+    Documents in docs whose source is new to the use case are added; documents whose source
+    is already in the use case replace it, only re-embedding the chunks that changed. Sources
+    in removed_sources are deleted. The use case DataFrame is updated to list the documents
+    now in the use case.
+
+    Args:
+        user_id (str): The ID of the user who owns the use case.
+        use_case_name (str): The name of the use case to update.
+        docs (list of Document): The chunks of the documents to add or replace.
+        removed_sources (list of str): The file names of the documents to remove.
+
+    Returns:
+        dict: The number of 'added', 'deleted', 'unchanged' and 'repaired' points, see sync_source_documents.
+    """
+    docs_by_source = _group_by_source(docs)
+    for source in removed_sources:
+        docs_by_source.setdefault(source, [])
+
+    summary = sync_source_documents(f"{user_id}_{use_case_name}_documents", docs_by_source)
+
+    get_use_case_catalog().invalidate(user_id)  # Revalidate, as another process may have changed the use case
+    document_names = get_use_case_documents(user_id, use_case_name)
+    document_names = [name for name in document_names if name not in docs_by_source]
+    document_names += [source for source, source_docs in docs_by_source.items() if source_docs]
+    set_use_case_documents(user_id, use_case_name, document_names)
+    return summary
+
+
+def add_documents_to_use_case(user_id, use_case_name, docs):
+    """Adds (or replaces) documents in a use case. See update_use_case_documents."""
+    return update_use_case_documents(user_id, use_case_name, docs=docs)
+
+
+def replace_document_in_use_case(user_id, use_case_name, source, docs):
+    """Replaces the chunks of one document of a use case with its new chunks."""
+    docs = [doc for doc in docs if doc.metadata["source"] == source]
+    return update_use_case_documents(user_id, use_case_name, docs=docs, removed_sources=[source])
+
+
+def remove_document_from_use_case(user_id, use_case_name, source):
+    """Removes one document from a use case. See update_use_case_documents."""
+    return update_use_case_documents(user_id, use_case_name, removed_sources=[source])
+
+
+@traced("update_library_use_case")
+def update_library_use_case(user_id, use_case_name, files=(), removed_names=(), library_documents=()):
+    """
+    Adds, replaces and removes documents of a use case built from the document library.
+
+    Uploaded files are added to the library, where only new contents are parsed and
+    embedded, and replace the use case's documents of the same name. Documents of the
+    library can be added by ID, and documents removed by name. Documents no longer
+    referenced by any use case are deleted from the library.
+
+    Args:
+        user_id (str): The ID of the user who owns the use case.
+        use_case_name (str): The name of the use case to update.
+        files (list of tuple): (file name, MIME type, file bytes) of the uploaded files.
+        removed_names (list of str): The file names of the documents to remove.
+        library_documents (list of str): The IDs of library documents to add.
+
+    Returns:
+        dict: The number of documents 'added' to and 'removed' from the use case, and of
+              documents 'deleted' from the library.
+    """
+    library = get_document_library()
+    library.invalidate(user_id)  # Revalidate, as another process may have changed the use case
+    documents = library.documents(user_id)
+    current = library.use_case_documents(user_id, use_case_name) or []
+    replaced = set(removed_names) | {file_name for file_name, _, _ in files}
+    kept = [doc_id for doc_id in current if documents.get(doc_id, {}).get("name") not in replaced]
+    document_ids = list(dict.fromkeys(kept + list(library_documents) + [document_id(file_bytes) for _, _, file_bytes in files]))
+
+    # The documents are referenced before the uploaded ones are ingested, so they cannot be deleted meanwhile
+    deleted = library.reference(user_id, use_case_name, document_ids)
+    ingest_into_library(user_id, files, agent.embeddings)
+    get_answer_cache().invalidate(f"{user_id}_{use_case_name}_documents")
+
+    documents = library.documents(user_id)
+    set_use_case_documents(user_id, use_case_name,
+                           list(dict.fromkeys(documents[doc_id]["name"] for doc_id in document_ids if doc_id in documents)))
+    return {"added": len(set(document_ids) - set(current)), "removed": len(set(current) - set(document_ids)),
+            "deleted": len(deleted)}
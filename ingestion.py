@@ -0,0 +1,293 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from extraction_backends import get_pdf_extractor
+from utils import iter_pdf_pages, iter_docx_blocks, stream_text_to_documents, remove_duplicate_documents, text_splitter
+from near_duplicates import collapse_near_duplicates, collapse_near_duplicates_within_sources
+from parsed_cache import get_parsed_document_cache
+from document_library import get_document_library, document_id
+from telemetry import span, traced, increment
+
+
+PDF_MIME_TYPE = "application/pdf"
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Number of worker processes used to parse files. Defaults to one per core.
+INGESTION_MAX_WORKERS = int(os.environ.get("INGESTION_MAX_WORKERS", os.cpu_count() or 1))
+
+# PDFs longer than this are extracted in page ranges of this size on several workers.
+# Set to 0 to always extract a PDF on a single worker.
+INGESTION_PAGES_PER_TASK = int(os.environ.get("INGESTION_PAGES_PER_TASK", 50))
+
+
+def _ingest_file(file_name, file_type, file_bytes, start_page=0, end_page=None, extractor_name=None):
+    """
+    Extracts and splits a single file, or a page range of a PDF, in a worker process.
+
+    Text is streamed page by page (or paragraph by paragraph for DOCX files) into the 
+    splitter, so the full text of the document is never held in memory.
+
+    Args:
+        file_name (str): The name of the uploaded file.
+        file_type (str): The MIME type of the uploaded file.
+        file_bytes (bytes): The content of the uploaded file.
+        start_page (int): Index of the first PDF page to extract.
+        end_page (int, optional): Index after the last PDF page to extract.
+        extractor_name (str, optional): The PDF extractor to use. Defaults to PDF_EXTRACTOR.
+
+    Returns:
+        list of Document: The chunks of the file, or an empty list for unsupported types.
+    """
+    if file_type == PDF_MIME_TYPE:
+        extractor = get_pdf_extractor(extractor_name)
+        with extractor.open(file_bytes) as pdf:
+            return list(stream_text_to_documents(iter_pdf_pages(pdf, start_page, end_page, extractor), file_name))
+    elif file_type == DOCX_MIME_TYPE:
+        return list(stream_text_to_documents(iter_docx_blocks(io.BytesIO(file_bytes)), file_name, location_key="paragraph"))
+    return []
+
+
+def _extract_page_range(file_bytes, start_page, end_page, extractor_name=None):
+    """
+    Extracts the cleaned text of a page range of a PDF in a worker process.
+
+    Returns:
+        list of tuple: The page number and text of each page with text, see iter_pdf_pages.
+    """
+    extractor = get_pdf_extractor(extractor_name)
+    with extractor.open(file_bytes) as pdf:
+        return list(iter_pdf_pages(pdf, start_page, end_page, extractor))
+
+
+def _count_pdf_pages(file_bytes):
+    """Returns the number of pages of a PDF given as bytes."""
+    extractor = get_pdf_extractor("pdfium")
+    with extractor.open(file_bytes) as pdf:
+        return extractor.page_count(pdf)
+
+
+def _page_ranges(page_count, pages_per_task):
+    """Splits a page count into consecutive (start, end) ranges of at most pages_per_task pages."""
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+
+def _ingestion_tasks(files, pages_per_task, extractor=None):
+    """
+    Yields the index of the file, the function and the arguments of every task.
+
+    A task either parses and chunks a whole file (_ingest_file) or extracts a page range
+    of a PDF (_extract_page_range), whose pages are chunked once all its ranges are extracted.
+    """
+    for file_index, (file_name, file_type, file_bytes) in enumerate(files):
+        extractor_name = _extractor_name(file_name, extractor)
+        page_count = _count_pdf_pages(file_bytes) if file_type == PDF_MIME_TYPE and pages_per_task else 0
+        if page_count > pages_per_task:
+            for start_page, end_page in _page_ranges(page_count, pages_per_task):
+                yield file_index, _extract_page_range, (file_bytes, start_page, end_page, extractor_name)
+        else:
+            yield file_index, _ingest_file, (file_name, file_type, file_bytes, 0, None, extractor_name)
+
+
+def _extractor_name(file_name, extractor):
+    return extractor.get(file_name) if isinstance(extractor, dict) else extractor
+
+
+def _parsing_config(file_type, extractor_name):
+    """Returns the settings that determine the chunks of a file, for the parsed-document cache key."""
+    config = {"chunk_size": text_splitter._chunk_size, "chunk_overlap": text_splitter._chunk_overlap}
+    if file_type == PDF_MIME_TYPE:
+        config["extractor"] = get_pdf_extractor(extractor_name).name
+    return config
+
+
+@traced("parse_files")
+def ingest_files(files, max_workers=None, pages_per_task=None, extractor=None, use_cache=True, progress_callback=None,
+                 collapse_across_sources=True):
+    """
+    Parses and chunks files in parallel on a process pool.
+
+    Files that were already parsed with the same configuration are served from the 
+    parsed-document cache, keyed by their content, without being parsed again. Each other 
+    file is parsed on its own worker. The text of PDFs with more pages than pages_per_task is
+    additionally extracted in page ranges on several workers, then split as a whole, so the
+    chunks are those of parsing the PDF in one piece. Exact duplicate chunks are removed from the result, and 
+    near-duplicates across all files are collapsed into the first of them (see 
+    collapse_near_duplicates), which records their sources as 'duplicate_sources'.
+
+    Args:
+        files (list of tuple): (file name, MIME type, file bytes) for each file to ingest.
+        max_workers (int, optional): Number of worker processes. Defaults to INGESTION_MAX_WORKERS.
+        pages_per_task (int, optional): Page range size for large PDFs. Defaults to
+                                        INGESTION_PAGES_PER_TASK; 0 disables page ranges.
+        extractor (str or dict, optional): The PDF extractor ("pdfplumber" or "pdfium"), or a 
+                                           dict choosing it per file name. Defaults to PDF_EXTRACTOR.
+        use_cache (bool): Whether to read and fill the parsed-document cache.
+        progress_callback (callable, optional): Called with the number of files parsed so far 
+                                                whenever a file is done.
+        collapse_across_sources (bool): Whether chunks of different files are collapsed as
+                                        near-duplicates, or only chunks of the same file.
+
+    Returns:
+        list of Document: The chunks of all files in upload order, with 'source' metadata
+                          and the 'page' (PDF) or 'paragraph' (DOCX) each chunk starts in.
+    """
+    max_workers = max_workers or INGESTION_MAX_WORKERS
+    pages_per_task = INGESTION_PAGES_PER_TASK if pages_per_task is None else pages_per_task
+    cache = get_parsed_document_cache() if use_cache else None
+
+    chunks_by_file = [None] * len(files)
+    cache_keys = {}
+    for file_index, (file_name, file_type, file_bytes) in enumerate(files):
+        if cache is None or file_type not in (PDF_MIME_TYPE, DOCX_MIME_TYPE):
+            continue
+        try:
+            config = _parsing_config(file_type, _extractor_name(file_name, extractor))
+            cache_keys[file_index] = cache.key(file_bytes, file_type, config)
+            chunks_by_file[file_index] = cache.get(cache_keys[file_index], file_name)
+        except Exception as e:
+            print(f"Exception occurred: {e}")
+
+    uncached_files = [file_index for file_index, chunks in enumerate(chunks_by_file) if chunks is None]
+    increment("files_total", len(files) - len(uncached_files), source="cache")
+    increment("files_total", len(uncached_files), source="parsed")
+    increment("upload_bytes_total", sum(len(file_bytes) for _, _, file_bytes in files))
+    tasks = [(uncached_files[file_index], function, args) for file_index, function, args in
+             _ingestion_tasks([files[file_index] for file_index in uncached_files], pages_per_task, extractor)]
+    for file_index in uncached_files:
+        chunks_by_file[file_index] = []
+
+    remaining_tasks = {}
+    for file_index, _, _ in tasks:
+        remaining_tasks[file_index] = remaining_tasks.get(file_index, 0) + 1
+    parsed_files = len(files) - len(remaining_tasks)
+    if progress_callback:
+        progress_callback(parsed_files)
+
+    pages_by_file = {}
+
+    def task_done(file_index, function, result):
+        nonlocal parsed_files
+        if function is _extract_page_range:
+            pages_by_file.setdefault(file_index, []).extend(result)
+        else:
+            chunks_by_file[file_index] += result
+        remaining_tasks[file_index] -= 1
+        if remaining_tasks[file_index] == 0:
+            if file_index in pages_by_file:
+                # The pages of all ranges are split as one text, so chunks continue across the ranges
+                chunks_by_file[file_index] = list(stream_text_to_documents(pages_by_file.pop(file_index), files[file_index][0]))
+            parsed_files += 1
+            if progress_callback:
+                progress_callback(parsed_files)
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        for file_index, function, args in tasks:
+            task_done(file_index, function, function(*args))
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+            futures = [executor.submit(function, *args) for _, function, args in tasks]
+            for (file_index, function, _), future in zip(tasks, futures):
+                task_done(file_index, function, future.result())
+
+    for file_index in uncached_files:
+        if file_index in cache_keys:
+            try:
+                cache.put(cache_keys[file_index], chunks_by_file[file_index])
+            except Exception as e:
+                print(f"Exception occurred: {e}")
+
+    docs = [doc for chunks in chunks_by_file for doc in chunks]
+    with span("deduplicate", chunks=len(docs)) as attributes:
+        collapse = collapse_near_duplicates if collapse_across_sources else collapse_near_duplicates_within_sources
+        docs = collapse(remove_duplicate_documents(docs))
+        attributes["kept"] = len(docs)
+    increment("chunks_total", len(docs), stage="parsed")
+    return docs
+
+
+def ingest_uploaded_files(uploaded_files, max_workers=None, pages_per_task=None, extractor=None):
+    """
+    Runs the ingestion pipeline on files uploaded through a Streamlit file uploader.
+
+    Args:
+        uploaded_files (list of UploadedFile): The files uploaded by the user.
+        max_workers (int, optional): Number of worker processes.
+        pages_per_task (int, optional): Page range size for large PDFs.
+        extractor (str or dict, optional): The PDF extractor, or a dict choosing it per file name.
+
+    Returns:
+        list of Document: The chunks of all uploaded files, with 'source' metadata.
+    """
+    files = [(uploaded_file.name, uploaded_file.type, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    return ingest_files(files, max_workers=max_workers, pages_per_task=pages_per_task, extractor=extractor)
+
+
+@traced("library_ingest")
+def ingest_into_library(user_id, files, embeddings, progress_callback=None):
+    """
+    Adds files to a user's document library, only parsing and embedding contents it does not hold yet.
+
+    Files are identified by the hash of their content, so a file already uploaded for another
+    use case, even under another name, is reused as it is. The new files are parsed together
+    on the process pool, then the chunks of each are embedded and stored as its own document.
+    Near-duplicates are only collapsed within a file, as each library document is stored,
+    shared between use cases and deleted on its own.
+
+    Args:
+        user_id (str): The ID of the user owning the library.
+        files (list of tuple): (file name, MIME type, file bytes) for each file to add.
+        embeddings (Embeddings): The embedding model.
+        progress_callback (callable, optional): Called with the number of files 'parsed' and
+                                                of chunks 'chunked', 'embedded' and 'upserted'
+                                                so far, as keyword arguments.
+
+    Returns:
+        list of str: The document IDs of the files, in order.
+    """
+    library = get_document_library()
+    doc_ids = [document_id(file_bytes) for _, _, file_bytes in files]
+    missing = set(library.missing_documents(user_id, doc_ids))
+    new_files = {}
+    for doc_id, file in zip(doc_ids, files):
+        if doc_id in missing:
+            new_files.setdefault(doc_id, file)
+    stored = library.documents(user_id)
+    reused_chunks = sum(stored[doc_id]["chunks"] for doc_id in set(doc_ids) if doc_id in stored)
+    increment("library_documents_total", len(set(doc_ids)) - len(new_files), outcome="reused")
+
+    progress = {"parsed": sum(1 for doc_id in doc_ids if doc_id not in new_files),
+                "chunked": reused_chunks, "embedded": reused_chunks, "upserted": reused_chunks}
+
+    def report(**counts):
+        progress.update(counts)
+        if progress_callback:
+            progress_callback(**progress)
+
+    # The chunks of files parsed together are told apart by their source, i.e. file name, so new files
+    # sharing a name are parsed in separate calls
+    parse_rounds = []
+    for doc_id, file in new_files.items():
+        parse_round = next((parse_round for parse_round in parse_rounds
+                            if all(other[0] != file[0] for other in parse_round.values())), None)
+        if parse_round is None:
+            parse_rounds.append({})
+            parse_round = parse_rounds[-1]
+        parse_round[doc_id] = file
+
+    report()
+    for parse_round in parse_rounds:
+        parsed = progress["parsed"]
+        docs = ingest_files(list(parse_round.values()), progress_callback=lambda files: report(parsed=parsed + files),
+                            collapse_across_sources=False)
+        docs_by_source = {}
+        for doc in docs:
+            docs_by_source.setdefault(doc.metadata["source"], []).append(doc)
+        report(parsed=parsed + sum(doc_ids.count(doc_id) for doc_id in parse_round), chunked=progress["chunked"] + len(docs))
+        for doc_id, (file_name, file_type, file_bytes) in parse_round.items():
+            docs = docs_by_source.get(file_name, [])
+            done = dict(progress)
+            library.add_document(user_id, doc_id, file_name, file_type, len(file_bytes), docs, embeddings,
+                                 progress_callback=lambda embedded, upserted: report(embedded=done["embedded"] + embedded,
+                                                                                     upserted=done["upserted"] + upserted))
+            report(embedded=done["embedded"] + len(docs), upserted=done["upserted"] + len(docs))
+    return doc_ids
@@ -0,0 +1,303 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.exceptions import ResourceNotFoundError, ResourceModifiedError, ResourceExistsError
+from blob_storage import get_blob_store
+from document_library import get_document_library, document_id
+from ingestion import ingest_into_library
+from answer_cache import get_answer_cache
+from telemetry import start_trace
+from request_scheduler import request_user
+from utils import agent, add_use_case
+
+
+# Number of use case creation jobs run at the same time by each server process
+INGESTION_JOB_WORKERS = int(os.environ.get("INGESTION_JOB_WORKERS", 2))
+# Attempts of a job before it is marked as failed; later attempts resume from its checkpoint
+INGESTION_JOB_MAX_ATTEMPTS = int(os.environ.get("INGESTION_JOB_MAX_ATTEMPTS", 3))
+# Seconds without a heartbeat after which a running job is considered interrupted and resumed
+INGESTION_JOB_STALE_SECONDS = float(os.environ.get("INGESTION_JOB_STALE_SECONDS", 120))
+# Delay before the second attempt of a failed job, doubled for every later attempt
+INGESTION_JOB_RETRY_SECONDS = float(os.environ.get("INGESTION_JOB_RETRY_SECONDS", 5))
+# Seconds for which the jobs of a user are shown as last read, before revalidating them with the blob store
+INGESTION_JOB_REVALIDATE_SECONDS = float(os.environ.get("INGESTION_JOB_REVALIDATE_SECONDS", 10))
+
+# Minimum interval between two progress checkpoints of a job in the blob store
+_CHECKPOINT_INTERVAL = 1.0
+# Number of finished jobs kept per user for display
+_FINISHED_JOBS_KEPT = 20
+# Longest delay between two attempts of a failed job
+_MAX_RETRY_SECONDS = 300
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class IngestionJobQueue:
+    """
+    Runs use case creations in the background, on a thread pool of the server process.
+
+    A job adds the uploaded files of a new use case to the user's document library, where
+    only contents the library does not hold yet are parsed, chunked, embedded and upserted.
+    The use case references its uploaded documents and the library documents selected for
+    it, and is only added to the user's DataFrame once all their vectors are stored.
+    The uploaded files and the state of every job are stored in the blob store, so jobs
+    continue when the browser tab is closed or the script reruns, and an interrupted or
+    failed job resumes from its checkpoint: parsed files come from the parsed-document
+    cache, and chunks whose points are already in the library are not upserted again.
+
+    The state of a job this process has claimed, running or waiting for a free worker, is
+    checkpointed with a heartbeat at regular intervals, whether or not it progresses, so a
+    long parse or a long queue is not mistaken for an interruption. A job whose heartbeat
+    stopped is claimed by one process only, with a conditional write. Failed attempts are
+    retried after a delay doubling with every attempt.
+
+    Args:
+        store (AzureBlobStore or LocalBlobStore): The blob store holding job states and files.
+        max_workers (int): Number of jobs run at the same time.
+        stale_seconds (float): Seconds without a heartbeat after which a job is resumed.
+        retry_seconds (float): Delay before the second attempt of a failed job.
+        revalidate_seconds (float): Seconds for which jobs read from the blob store are reused.
+    """
+
+    def __init__(self, store, max_workers=INGESTION_JOB_WORKERS, stale_seconds=INGESTION_JOB_STALE_SECONDS,
+                 retry_seconds=INGESTION_JOB_RETRY_SECONDS, revalidate_seconds=INGESTION_JOB_REVALIDATE_SECONDS) -> None:
+        self.store = store
+        self.stale_seconds = stale_seconds
+        self.retry_seconds = retry_seconds
+        self.revalidate_seconds = revalidate_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion-job")
+        self._running = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _jobs_blob(user_id):
+        return f"{user_id}_ingestion_jobs.json"
+
+    @staticmethod
+    def _file_blob(user_id, job_id, file_index):
+        return f"{user_id}_ingestion_jobs/{job_id}/{file_index}"
+
+    def _read_jobs(self, user_id):
+        try:
+            data, etag = self.store.read_with_etag(self._jobs_blob(user_id))
+        except ResourceNotFoundError:
+            return {}, None
+        return json.loads(data), etag
+
+    def _write_jobs(self, user_id, jobs, etag):
+        """Writes the jobs of a user if the blob still has the given ETag, and caches them."""
+        data = json.dumps(jobs)
+        new_etag = self.store.write(self._jobs_blob(user_id), data.encode("utf-8"), if_match=etag, create_only=etag is None)
+        with self._lock:
+            self._cache[user_id] = (json.loads(data), new_etag, time.monotonic())
+
+    def _cached_jobs(self, user_id):
+        """Returns the jobs of a user, only reading them again once revalidate_seconds have passed."""
+        with self._lock:
+            cached = self._cache.get(user_id)
+        if cached is not None and time.monotonic() - cached[2] < self.revalidate_seconds:
+            return json.loads(json.dumps(cached[0]))
+        try:
+            if cached is not None and cached[1] is not None:
+                data, etag = self.store.read_if_changed(self._jobs_blob(user_id), cached[1])
+            else:
+                data, etag = self.store.read_with_etag(self._jobs_blob(user_id))
+        except ResourceNotFoundError:
+            data, etag = b"{}", None
+        jobs = cached[0] if data is None else json.loads(data)
+        with self._lock:
+            self._cache[user_id] = (jobs, etag, time.monotonic())
+        return json.loads(json.dumps(jobs))
+
+    def _checkpoint(self, job):
+        """Saves the state of a job with the other jobs of its user, under an ETag condition."""
+        job["heartbeat"] = time.time()
+        while True:
+            jobs, etag = self._read_jobs(job["user_id"])
+            jobs[job["id"]] = job
+            finished = sorted((other for other in jobs.values() if other["status"] not in ACTIVE_STATUSES),
+                              key=lambda other: other["created_at"])
+            for old_job in finished[:-_FINISHED_JOBS_KEPT]:
+                del jobs[old_job["id"]]
+            try:
+                self._write_jobs(job["user_id"], jobs, etag)
+                return
+            except (ResourceModifiedError, ResourceExistsError):
+                continue
+
+    def _is_stale(self, job):
+        return job["status"] in ACTIVE_STATUSES and time.time() - job.get("heartbeat", 0) > self.stale_seconds
+
+    def _claim(self, user_id, job_id, claimable, **changes):
+        """
+        Takes over a job if it is still claimable in the blob store, with a conditional write.
+
+        Of several processes claiming the same job, only the first succeeds; the others see
+        its new heartbeat.
+
+        Returns:
+            dict: The claimed job, or None if it is no longer claimable.
+        """
+        while True:
+            jobs, etag = self._read_jobs(user_id)
+            job = jobs.get(job_id)
+            if job is None or not claimable(job):
+                return None
+            job.update(changes, heartbeat=time.time())
+            try:
+                self._write_jobs(user_id, jobs, etag)
+                return job
+            except (ResourceModifiedError, ResourceExistsError):
+                continue
+
+    def _heartbeat(self, job, stopped):
+        """Checkpoints a claimed job at regular intervals until stopped is set."""
+        while not stopped.wait(self.stale_seconds / 4):
+            try:
+                self._checkpoint(job)
+            except Exception as e:
+                print(f"Exception occurred: {e}")
+
+    def submit(self, user_id, use_case_name, files, library_documents=()):
+        """
+        Queues the creation of a use case.
+
+        Args:
+            user_id (str): The ID of the user creating the use case.
+            use_case_name (str): The name of the new use case.
+            files (list of tuple): (file name, MIME type, file bytes) of the uploaded files.
+            library_documents (list of str): The IDs of documents of the user's library to include.
+
+        Returns:
+            str: The ID of the job.
+        """
+        job_id = uuid.uuid4().hex
+        for file_index, (_, _, file_bytes) in enumerate(files):
+            self.store.write(self._file_blob(user_id, job_id, file_index), file_bytes)
+        job = {
+            "id": job_id,
+            "user_id": user_id,
+            "use_case_name": use_case_name,
+            "files": [{"name": file_name, "type": file_type} for file_name, file_type, _ in files],
+            "library_documents": list(library_documents),
+            "status": "queued",
+            "progress": {"parsed": 0, "chunked": 0, "embedded": 0, "upserted": 0},
+            "attempts": 0,
+            "error": None,
+            "created_at": time.time(),
+        }
+        self._checkpoint(job)
+        self._start(job)
+        return job_id
+
+    def _start(self, job):
+        with self._lock:
+            if job["id"] in self._running:
+                return
+            self._running[job["id"]] = job
+        # The heartbeat starts with the claim, so a job waiting for a free worker is not resumed elsewhere
+        stopped = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job, stopped), name="ingestion-job-heartbeat", daemon=True).start()
+        self._executor.submit(self._run, job, stopped)
+
+    def _run(self, job, stopped):
+        try:
+            while True:
+                job["attempts"] += 1
+                job["status"], job["error"] = "running", None
+                self._checkpoint(job)
+                try:
+                    # Embedding requests are queued apart from the user's questions, which they must not hold up
+                    with start_trace("ingestion_job"), request_user(f"{job['user_id']}:ingestion"):
+                        self._execute(job)
+                    job["status"] = "succeeded"
+                    self._checkpoint(job)
+                    for file_index in range(len(job["files"])):
+                        self.store.delete(self._file_blob(job["user_id"], job["id"], file_index))
+                    return
+                except Exception as e:
+                    print(f"Exception occurred: {e}")
+                    job["error"] = str(e)
+                    if job["attempts"] >= INGESTION_JOB_MAX_ATTEMPTS:
+                        job["status"] = "failed"
+                        self._checkpoint(job)
+                        # Documents only this use case referenced are deleted; a retry references them again
+                        get_document_library().release(job["user_id"], job["use_case_name"])
+                        return
+                    self._checkpoint(job)
+                    time.sleep(min(_MAX_RETRY_SECONDS, self.retry_seconds * 2 ** (job["attempts"] - 1)))
+        finally:
+            stopped.set()
+            with self._lock:
+                self._running.pop(job["id"], None)
+
+    def _execute(self, job):
+        """Runs the stages of a job, skipping the work done by its earlier attempts."""
+        user_id, use_case_name = job["user_id"], job["use_case_name"]
+        library = get_document_library()
+        last_checkpoint = [time.monotonic()]
+
+        def report(**progress):
+            job["progress"].update(progress)
+            if time.monotonic() - last_checkpoint[0] >= _CHECKPOINT_INTERVAL:
+                last_checkpoint[0] = time.monotonic()
+                self._checkpoint(job)
+
+        files = [(file["name"], file["type"], self.store.read(self._file_blob(user_id, job["id"], file_index)))
+                 for file_index, file in enumerate(job["files"])]
+        # The documents are referenced first, so that another use case releasing them cannot delete them meanwhile
+        document_ids = list(job.get("library_documents", [])) + [document_id(file_bytes) for _, _, file_bytes in files]
+        library.reference(user_id, use_case_name, document_ids)
+        missing = library.missing_documents(user_id, job.get("library_documents", []))
+        if missing:
+            raise RuntimeError(f"{len(missing)} selected documents are no longer in the document library")
+        ingest_into_library(user_id, files, agent.embeddings, progress_callback=report)
+        get_answer_cache().invalidate(f"{user_id}_{use_case_name}_documents")
+
+        # The use case is only listed once all its vectors are in place
+        documents = library.documents(user_id)
+        add_use_case(user_id, use_case_name, list(dict.fromkeys(documents[doc_id]["name"] for doc_id in document_ids)))
+
+    def jobs(self, user_id):
+        """
+        Returns the jobs of a user, most recent first, resuming the ones that were interrupted.
+
+        A job is interrupted when it is queued or running but no process has checkpointed it
+        for stale_seconds, e.g. after a server restart. The jobs are read from the blob store
+        at most every revalidate_seconds; the jobs this process runs are always current.
+        """
+        jobs = self._cached_jobs(user_id)
+        with self._lock:
+            running = dict(self._running)
+        for job_id, job in list(jobs.items()):
+            if job_id in running:
+                jobs[job_id] = running[job_id]
+            elif self._is_stale(job):
+                claimed = self._claim(user_id, job_id, self._is_stale)
+                if claimed is not None:
+                    jobs[job_id] = claimed
+                    self._start(claimed)
+        return sorted(jobs.values(), key=lambda job: job["created_at"], reverse=True)
+
+    def retry(self, user_id, job_id):
+        """Resumes a failed job from its checkpoint."""
+        job = self._claim(user_id, job_id, lambda job: job["status"] == "failed", status="queued", attempts=0)
+        if job is not None:
+            self._start(job)
+
+
+_ingestion_job_queue = None
+_ingestion_job_queue_lock = threading.Lock()
+
+
+def get_ingestion_job_queue():
+    """Returns the process-wide ingestion job queue."""
+    global _ingestion_job_queue
+    with _ingestion_job_queue_lock:
+        if _ingestion_job_queue is None:
+            _ingestion_job_queue = IngestionJobQueue(get_blob_store())
+        return _ingestion_job_queue
@@ -0,0 +1,81 @@
+"""
+Migrates the per-use-case Qdrant collections to the shared collection layout.
+
+Every collection named '*_documents', other than the shared collections themselves, is
+copied into the shared collections with its name as tenant, and the copy is verified by
+counting its points. Run with:
+
+    python migrate_collections.py [--dry-run] [--delete-source] [--batch-size N] [--collection NAME ...]
+
+Copies are idempotent, as the point IDs of the shared layout are derived from the tenant
+and the original point ID, so an interrupted migration can be run again. Once every use
+case is migrated, set VECTOR_COLLECTION_LAYOUT=shared.
+"""
+import argparse
+import json
+import os
+from qdrant_client import QdrantClient
+from vector_backends import SharedQdrantBackend
+
+
+def per_use_case_collections(client, backend):
+    """Returns the names of the per-use-case collections on the server."""
+    shared = set(backend.shard_names())
+    return sorted(collection.name for collection in client.get_collections().collections
+                  if collection.name.endswith("_documents") and collection.name not in shared)
+
+
+def migrate_collection(client, backend, collection_name, batch_size=256, delete_source=False):
+    """
+    Copies the points of a per-use-case collection into the shared layout.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        backend (SharedQdrantBackend): The shared layout to copy to.
+        collection_name (str): The collection to migrate, which becomes the tenant name.
+        batch_size (int): The number of points read and written at a time.
+        delete_source (bool): Whether to delete the collection once its copy is verified.
+
+    Returns:
+        dict: The 'collection', its number of 'points', the number of points 'migrated' for
+              its tenant and whether it was 'deleted'.
+    """
+    vector_size = client.get_collection(collection_name).config.params.vectors.size
+    backend.ensure_shard(backend.shard(collection_name), vector_size)
+
+    offset = None
+    while True:
+        points, offset = client.scroll(collection_name=collection_name, limit=batch_size, offset=offset,
+                                       with_payload=True, with_vectors=True)
+        if points:
+            backend.upsert(collection_name, [point.id for point in points], [point.vector for point in points],
+                           [point.payload for point in points])
+        if offset is None:
+            break
+
+    source_points = client.count(collection_name, exact=True).count
+    migrated_points = backend.count(collection_name)
+    if migrated_points < source_points:
+        raise RuntimeError(f"Only {migrated_points} of {source_points} points of {collection_name} were migrated")
+    if delete_source:
+        client.delete_collection(collection_name)
+    return {"collection": collection_name, "points": source_points, "migrated": migrated_points, "deleted": delete_source}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", action="append", help="collection to migrate (default: all)")
+    parser.add_argument("--batch-size", type=int, default=256, help="points copied at a time")
+    parser.add_argument("--delete-source", action="store_true", help="delete each collection once its copy is verified")
+    parser.add_argument("--dry-run", action="store_true", help="only list the collections to migrate")
+    args = parser.parse_args()
+
+    client = QdrantClient(url=os.environ["QDRANT_URL"], api_key=os.environ["QDRANT_KEY"])
+    backend = SharedQdrantBackend(client)
+    collections = args.collection or per_use_case_collections(client, backend)
+    for collection_name in collections:
+        if args.dry_run:
+            print(json.dumps({"collection": collection_name, "points": client.count(collection_name, exact=True).count,
+                              "shard": backend.shard(collection_name)}))
+        else:
+            print(json.dumps(migrate_collection(client, backend, collection_name, args.batch_size, args.delete_source)))
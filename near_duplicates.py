@@ -0,0 +1,133 @@
+import os
+import re
+import zlib
+import numpy as np
+
+
+# Estimated Jaccard similarity from which a chunk is collapsed into an earlier one (0 disables)
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", 0.9))
+# Number of hash permutations of the MinHash signatures
+NEAR_DUPLICATE_NUM_PERM = int(os.environ.get("NEAR_DUPLICATE_NUM_PERM", 128))
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_SHINGLE_WORDS = 3
+
+
+def _shingle_hashes(text):
+    """Returns the 32-bit hashes of the word 3-grams of a text, ignoring case and punctuation."""
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[i:i + _SHINGLE_WORDS]) for i in range(max(1, len(words) - _SHINGLE_WORDS + 1))}
+    return np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+
+
+def lsh_parameters(threshold, num_perm):
+    """
+    Chooses the number of LSH bands and rows per band for a similarity threshold.
+
+    Pairs become candidates with probability 1 - (1 - s^rows)^bands, which rises steeply
+    around (1 / bands)^(1 / rows). The split whose steep point is closest below the threshold
+    is chosen, so few true near-duplicates are missed; candidates are verified afterwards.
+
+    Returns:
+        tuple: The number of bands and of rows per band.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        steep_point = (1 / bands) ** (1 / rows)
+        if steep_point <= threshold and threshold - steep_point < threshold - (1 / best[0]) ** (1 / best[1]):
+            best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures of texts with num_perm universal hash permutations.
+
+    Args:
+        num_perm (int): The number of permutations, i.e. the length of the signatures.
+        seed (int): Seed of the permutations, so signatures are reproducible.
+    """
+
+    def __init__(self, num_perm=NEAR_DUPLICATE_NUM_PERM, seed=1) -> None:
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = _shingle_hashes(text)
+        return ((np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME).min(axis=0)
+
+
+def collapse_near_duplicates(documents, threshold=NEAR_DUPLICATE_THRESHOLD, num_perm=NEAR_DUPLICATE_NUM_PERM):
+    """
+    Collapses near-identical chunks, e.g. repeated headers, boilerplate or amended sections.
+
+    Every chunk gets a MinHash signature, and LSH banding finds the earlier chunks it may
+    be similar to in roughly linear time over all chunks. A chunk whose estimated Jaccard
+    similarity with an earlier kept chunk reaches the threshold is dropped, and its source
+    and location are recorded in the 'duplicate_sources' metadata of the kept chunk.
+
+    Only the chunks passed together are compared, e.g. the files of one ingestion; chunks
+    already stored in a collection are not.
+
+    Args:
+        documents (list of Document): The chunks, in order of preference.
+        threshold (float): The similarity from which chunks are collapsed. 0 disables it.
+        num_perm (int): The number of hash permutations of the signatures.
+
+    Returns:
+        list of Document: The kept chunks, in their original order.
+    """
+    if threshold <= 0 or not documents:
+        return list(documents)
+
+    hasher = MinHasher(num_perm)
+    bands, rows = lsh_parameters(threshold, num_perm)
+    buckets = [{} for _ in range(bands)]
+    kept, signatures = [], []
+
+    for doc in documents:
+        signature = hasher.signature(doc.page_content)
+        band_keys = [signature[band * rows:(band + 1) * rows].tobytes() for band in range(bands)]
+        candidates = {index for band, key in enumerate(band_keys) for index in buckets[band].get(key, ())}
+
+        duplicate_of = None
+        for index in sorted(candidates):
+            if np.mean(signatures[index] == signature) >= threshold:
+                duplicate_of = kept[index]
+                break
+
+        if duplicate_of is None:
+            for band, key in enumerate(band_keys):
+                buckets[band].setdefault(key, []).append(len(kept))
+            kept.append(doc)
+            signatures.append(signature)
+        else:
+            provenance = {key: value for key, value in doc.metadata.items() if key != "duplicate_sources"}
+            duplicate_of.metadata.setdefault("duplicate_sources", []).append(provenance)
+            duplicate_of.metadata["duplicate_sources"] += doc.metadata.get("duplicate_sources", [])
+    return kept
+
+
+def collapse_near_duplicates_within_sources(documents, threshold=NEAR_DUPLICATE_THRESHOLD, num_perm=NEAR_DUPLICATE_NUM_PERM):
+    """
+    Collapses near-identical chunks of the same source only. See collapse_near_duplicates.
+
+    Chunks of different sources are all kept, e.g. for the document library, whose documents
+    are stored, shared between use cases and deleted on their own: a chunk collapsed into
+    another document's would not be found in the use cases without that document.
+
+    Args:
+        documents (list of Document): The chunks, with 'source' metadata, in order of preference.
+        threshold (float): The similarity from which chunks are collapsed. 0 disables it.
+        num_perm (int): The number of hash permutations of the signatures.
+
+    Returns:
+        list of Document: The kept chunks, grouped by source in order of first appearance.
+    """
+    documents_by_source = {}
+    for doc in documents:
+        documents_by_source.setdefault(doc.metadata.get("source"), []).append(doc)
+    return [doc for source_documents in documents_by_source.values()
+            for doc in collapse_near_duplicates(source_documents, threshold, num_perm)]
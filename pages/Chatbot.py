@@ -1,10 +1,11 @@
 import streamlit as st
-from langchain.chains import ConversationalRetrievalChain
-from qdrant_client import QdrantClient
-from base_agent import BaseAgent
-import time
-import random
 from utils import *
+from streaming import StreamingAnswerHandler
+from telemetry import start_trace, span, metrics, TELEMETRY_DEBUG_PANEL
+from resources import startup_report
+from chat_history import load_older_chat_history, get_chat_history_writer, CHAT_HISTORY_DISPLAY_LIMIT
+from chat_turn import get_chat_turn_executor
+from request_scheduler import set_request_user
 
 from dotenv import load_dotenv
 load_dotenv() # Load our environment variables
@@ -21,11 +22,6 @@ def username_popup():
     else:
         st.error("Username cannot be empty.")
 
-agent = BaseAgent()
-
-q_client = QdrantClient(url=os.environ["QDRANT_URL"],
-                        api_key=os.environ["QDRANT_KEY"])
-
 st.set_page_config(page_title="👩‍🔬🔬💬 BioRAG Analyser")
 st.title('👩‍🔬🔬💬 BioRAG Analyser')
 
@@ -34,94 +30,135 @@ st.title('👩‍🔬🔬💬 BioRAG Analyser')
 if "user" not in st.session_state:
     username_popup()
 else:
-
-    use_case_df = get_use_case_dataframe(st.session_state.user)
-
-    if "use_cases" not in st.session_state.keys():
-        st.session_state['use_cases'] = use_case_df['Use Case Name'].tolist()
-    else:
-        st.session_state['use_cases'] = use_case_df['Use Case Name'].tolist()
+    # Every stage of this run is timed in one trace, whose breakdown is kept when a question is answered;
+    # the trace is also ended when the run is interrupted, e.g. by st.rerun()
+    with start_trace("chat_page") as page_trace:
+        # Model requests of this run are queued fairly with those of other users
+        set_request_user(st.session_state.user)
+        turn_executor = get_chat_turn_executor()
+        history_writer = get_chat_history_writer()
+
+        # The chat history of the use case selected in the previous run is downloaded while the use cases are loaded
+        previous_use_case = st.session_state.get("history_use_case")
+        if previous_use_case is not None:
+            history_load = turn_executor.load_history(st.session_state.user, previous_use_case)
+
+        use_case_df = get_use_case_dataframe(st.session_state.user)
+
+        if "use_cases" not in st.session_state.keys():
+            st.session_state['use_cases'] = use_case_df['Use Case Name'].tolist()
+        else:
+            st.session_state['use_cases'] = use_case_df['Use Case Name'].tolist()
 
 
-    if len(use_case_df) > 0:
-        # Add a sidebar with a dropdown menu and document names
-        st.sidebar.title("Select a Use Case")
-        selected_use_case = st.sidebar.selectbox("Choose a use case 👇:", st.session_state['use_cases'])
+        if len(use_case_df) > 0:
+            # Add a sidebar with a dropdown menu and document names
+            st.sidebar.title("Select a Use Case")
+            selected_use_case = st.sidebar.selectbox("Choose a use case 👇:", st.session_state['use_cases'])
 
-        vectordb_documents = Qdrant(q_client, f"{st.session_state.user}_{selected_use_case}_documents", agent.embeddings)
+            if selected_use_case != previous_use_case:
+                history_load = turn_executor.load_history(st.session_state.user, selected_use_case)
+            # The question answering engine of the use case is shared by all turns and sessions
+            qa_engine_load = turn_executor.load_qa_engine(st.session_state.user, selected_use_case)
 
-        st.sidebar.write("The documents being analysed are:")
-        for document_name_sb in get_document_names(use_case_df, selected_use_case):
-            st.sidebar.write(f"📑 {document_name_sb}")
-        # Display the selected use case
-        st.write(f"Always double check important info.")
+            document_names = get_use_case_documents(st.session_state.user, selected_use_case)
+            st.sidebar.write("The documents being analysed are:")
+            for document_name_sb in document_names:
+                st.sidebar.write(f"📑 {document_name_sb}")
+            # Display the selected use case
+            st.write(f"Always double check important info.")
 
             
-        # Initialize or load chat history
-        if "messages" not in st.session_state.keys():
-            st.session_state.messages = get_chat_history(st.session_state.user, selected_use_case)
-        else:
-            st.session_state.messages = get_chat_history(st.session_state.user, selected_use_case)
-
-
-        # Sidebar with a button to delete chat history
-        with st.sidebar:
-            if st.button("Delete Chat History"):
-                st.session_state.messages = []
-                update_chat_history([], st.session_state.user, selected_use_case)
-
-
-        # Display chat messages
-        for message in st.session_state.messages: # May need to alter to not show system message
-            avatar = "🧑" if message["role"] == "user" else "👩‍🔬"
-            with st.chat_message(message["role"], avatar=avatar):
-                st.markdown(message["content"])
-
-
-        # Main chat interface
-        if prompt := st.chat_input("Please enter your question"):
-            retrieval_chat_history = convert_chat_history(st.session_state.messages)
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user", avatar="🧑"):
-                st.markdown(prompt)
-
-            with st.chat_message("assistant", avatar="👩‍🔬"):
-                message_placeholder = st.empty()
-                full_response = ""
-
-                with st.spinner("Smart assistant is thinking..."):
-                    qa_chain = ConversationalRetrievalChain.from_llm(
-                        llm=agent.model,
-                        retriever=vectordb_documents.as_retriever(
-                            search_kwargs={"k": 20, "score_threshold": 0.6}
-                        ),
-                        condense_question_prompt=summarization_prompt,
-                        combine_docs_chain_kwargs={"prompt": qa_prompt},
-                        return_source_documents=True,
-                        verbose=True
-                    )
-
-                    answer_bundle = qa_chain({"question": prompt, 
-                                            "chat_history": retrieval_chat_history, 
-                                            "n_documents": len(get_document_names(use_case_df, selected_use_case))})
+            # Initialize or load chat history, only downloading the most recent messages
+            messages, history_start = history_load.result()
+
+            # Older messages are downloaded on demand, from the position selected with "Load older messages"
+            if st.session_state.get("history_use_case") != selected_use_case:
+                st.session_state['history_use_case'] = selected_use_case
+                st.session_state['history_from'] = history_start
+            history_from = min(st.session_state['history_from'], history_start)
+            if history_from < history_start:
+                older_messages, _ = load_older_chat_history(st.session_state.user, selected_use_case,
+                                                            history_start, history_start - history_from)
+                messages = older_messages + messages
+            st.session_state.messages = messages
+
+
+            # Sidebar with a button to delete chat history
+            with st.sidebar:
+                if st.button("Delete Chat History"):
+                    st.session_state.messages = []
+                    st.session_state['history_from'] = 0
+                    history_writer.clear(st.session_state.user, selected_use_case)
+
+
+            if history_from > 0 and st.session_state.messages:
+                if st.button("Load older messages"):
+                    st.session_state['history_from'] = max(0, history_from - CHAT_HISTORY_DISPLAY_LIMIT)
+                    st.rerun()
+
+
+            # Display chat messages
+            for message in st.session_state.messages: # May need to alter to not show system message
+                avatar = "🧑" if message["role"] == "user" else "👩‍🔬"
+                with st.chat_message(message["role"], avatar=avatar):
+                    st.markdown(message["content"])
+
+
+            # Main chat interface
+            if prompt := st.chat_input("Please enter your question"):
+                retrieval_chat_history = convert_chat_history(st.session_state.messages)
+                # The question is embedded while it is displayed and the answer is prepared
+                qa_engine = qa_engine_load.result()
+                query_embedding = turn_executor.embed_question(qa_engine, prompt, retrieval_chat_history)
+                st.session_state.messages.append({"role": "user", "content": prompt})
+                with st.chat_message("user", avatar="🧑"):
+                    st.markdown(prompt)
+
+                with st.chat_message("assistant", avatar="👩‍🔬"):
+                    message_placeholder = st.empty()
+                    # Tokens of the answer are rendered into the placeholder as they arrive
+                    stream_handler = StreamingAnswerHandler(message_placeholder)
+
+                    with st.spinner("Smart assistant is thinking..."), span("chat_turn"):
+                        answer_bundle = qa_engine.answer(prompt, 
+                                                         retrieval_chat_history, 
+                                                         len(document_names),
+                                                         callbacks=[stream_handler],
+                                                         query_vector=query_embedding.result())
                 
-                response = answer_bundle["answer"]
-                source_documents = answer_bundle["source_documents"]
-                source_names = extract_source_names(source_documents)
-                response += f"\n\nSources:\n" + "\n".join(f"- {name}" for name in source_names)
-                
-                # Simulate typing effect
-                for char in response.split(" "):
-                    full_response += f" {char} "
-                    message_placeholder.markdown(full_response + " | ")
-                    time.sleep(round(random.uniform(0.015, 0.2), 3)) 
-
-                message_placeholder.markdown(full_response)
-                st.session_state.messages.append({"role": "assistant", "content": full_response})
-
+                    full_response = answer_bundle["answer"]
+                    source_documents = answer_bundle["source_documents"]
+                    source_names = extract_source_names(source_documents)
+                    full_response += f"\n\nSources:\n" + "\n".join(f"- {name}" for name in source_names)
+
+                    # Cached answers are shown at once, with the sources they were originally given with
+                    timings = stream_handler.finish(full_response)
+                    timings["cached"] = answer_bundle["cached"]
+                    timings["context_tokens_saved"] = answer_bundle["context_report"]["tokens_saved"]
+                    if timings["time_to_first_token"] is not None:
+                        metrics.observe("answer_time_to_first_token_seconds", timings["time_to_first_token"], cached=str(timings["cached"]).lower())
+                    metrics.observe("answer_total_seconds", timings["total_time"], cached=str(timings["cached"]).lower())
+                    st.session_state.messages.append({"role": "assistant", "content": full_response, "timings": timings})
+
+
+                    # Save the messages of this interaction to the chat history; they are journaled here and
+                    # uploaded in the background, while later loads already include them
+                    history_writer.append(st.session_state.user, selected_use_case, st.session_state.messages[-2:])
+                    st.session_state['last_trace'] = page_trace
 
-                # Save chat history after each interaction
-                update_chat_history(st.session_state.messages, st.session_state.user, selected_use_case)
-
-    else:
-        st.warning("⚠️You have no use cases! Please create one in the use cases tab")
+        else:
+            st.warning("⚠️You have no use cases! Please create one in the use cases tab")
+
+    # Latency breakdown of the run that answered the last question
+    if TELEMETRY_DEBUG_PANEL and "last_trace" in st.session_state:
+        with st.sidebar.expander("⏱️ Latency breakdown of the last answer"):
+            st.dataframe(pd.DataFrame([{"Stage": "\u2003" * row["depth"] + row["stage"],
+                                        "Start (ms)": row["start_ms"],
+                                        "Duration (ms)": row["duration_ms"],
+                                        "Details": ", ".join(f"{name}={value}" for name, value in row["attributes"].items())}
+                                       for row in st.session_state['last_trace'].breakdown()]),
+                         hide_index=True)
+    if TELEMETRY_DEBUG_PANEL:
+        with st.sidebar.expander("🚀 Startup of this server process"):
+            st.json(startup_report())
@@ -0,0 +1,173 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from azure.core.exceptions import ResourceNotFoundError, ResourceModifiedError, ResourceExistsError
+from langchain_core.documents import Document
+from blob_storage import get_blob_store
+
+
+# Local directory of the parsed-document cache and its maximum size
+PARSED_CACHE_PATH = os.environ.get("PARSED_CACHE_PATH", os.path.join(".cache", "parsed_documents"))
+PARSED_CACHE_LOCAL_MAX_MB = float(os.environ.get("PARSED_CACHE_LOCAL_MAX_MB", 512))
+# Maximum size of the parsed documents shared through the blob container (0 disables the blob tier)
+PARSED_CACHE_BLOB_MAX_MB = float(os.environ.get("PARSED_CACHE_BLOB_MAX_MB", 2048))
+
+# Bump when extraction or chunking changes in a way that is not captured by the configuration
+PARSED_CACHE_VERSION = 2
+
+_BLOB_PREFIX = "parsed_documents"
+
+
+class ParsedDocumentCache:
+    """
+    Two-tier cache of the chunks of parsed files, keyed by file content and parsing configuration.
+
+    Chunks are stored as gzip-compressed JSON artifacts, first on local disk and then in
+    the blob container, where they are shared by every process. Each tier evicts its least
+    recently used artifacts beyond its size limit; the blob tier keeps their sizes and last
+    use in an index blob updated with ETag conditions.
+
+    Args:
+        store (AzureBlobStore or LocalBlobStore, optional): The blob tier, None to disable it.
+        local_path (str): The directory of the local tier.
+        local_max_bytes (float): Maximum size of the local tier.
+        blob_max_bytes (float): Maximum size of the blob tier.
+    """
+
+    def __init__(self, store, local_path=PARSED_CACHE_PATH, local_max_bytes=PARSED_CACHE_LOCAL_MAX_MB * 2**20,
+                 blob_max_bytes=PARSED_CACHE_BLOB_MAX_MB * 2**20) -> None:
+        self.store = store if blob_max_bytes > 0 else None
+        self.local_path = local_path
+        self.local_max_bytes = local_max_bytes
+        self.blob_max_bytes = blob_max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(file_bytes, file_type, config):
+        """
+        Returns the cache key of a file parsed with a given configuration.
+
+        Args:
+            file_bytes (bytes): The content of the file.
+            file_type (str): The MIME type of the file.
+            config (dict): Everything that changes the chunks, e.g. extractor and splitter settings.
+        """
+        digest = hashlib.sha256(file_bytes).hexdigest()
+        config_digest = hashlib.sha256(json.dumps({**config, "file_type": file_type, "version": PARSED_CACHE_VERSION},
+                                                  sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        return f"{digest}-{config_digest}"
+
+    def _local_file(self, key):
+        return os.path.join(self.local_path, f"{key}.json.gz")
+
+    @staticmethod
+    def _encode(docs):
+        payload = [{"page_content": doc.page_content,
+                    "metadata": {name: value for name, value in doc.metadata.items() if name != "source"}} for doc in docs]
+        return gzip.compress(json.dumps(payload).encode("utf-8"))
+
+    @staticmethod
+    def _decode(data, file_name):
+        return [Document(page_content=chunk["page_content"], metadata={"source": file_name, **chunk["metadata"]})
+                for chunk in json.loads(gzip.decompress(data))]
+
+    def get(self, key, file_name):
+        """
+        Returns the cached chunks of a file, or None if it was not parsed with this configuration.
+
+        Chunks are returned with file_name as their source, so a file uploaded under another
+        name reuses the same artifact.
+        """
+        try:
+            with open(self._local_file(key), "rb") as artifact:
+                data = artifact.read()
+            os.utime(self._local_file(key))
+            return self._decode(data, file_name)
+        except FileNotFoundError:
+            pass
+
+        if self.store is None:
+            return None
+        try:
+            data = self.store.read(f"{_BLOB_PREFIX}/{key}.json.gz")
+        except ResourceNotFoundError:
+            return None
+        self._touch_blob_index(key, len(data))
+        self._write_local(key, data)
+        return self._decode(data, file_name)
+
+    def put(self, key, docs):
+        """Stores the chunks of a file in both tiers."""
+        data = self._encode(docs)
+        self._write_local(key, data)
+        if self.store is not None:
+            self.store.write(f"{_BLOB_PREFIX}/{key}.json.gz", data)
+            self._touch_blob_index(key, len(data))
+
+    def _write_local(self, key, data):
+        os.makedirs(self.local_path, exist_ok=True)
+        temp_path = f"{self._local_file(key)}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as artifact:
+            artifact.write(data)
+        os.replace(temp_path, self._local_file(key))
+        self._evict_local()
+
+    def _evict_local(self):
+        """Deletes the least recently used local artifacts beyond local_max_bytes."""
+        with self._lock:
+            artifacts = []
+            for entry in os.scandir(self.local_path):
+                if entry.name.endswith(".json.gz"):
+                    stat = entry.stat()
+                    artifacts.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in artifacts)
+            for _, size, path in sorted(artifacts):
+                if total <= self.local_max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def _touch_blob_index(self, key, size):
+        """Records the use of a blob artifact and evicts the least recently used ones beyond blob_max_bytes."""
+        index_name = f"{_BLOB_PREFIX}/index.json"
+        while True:
+            try:
+                data, etag = self.store.read_with_etag(index_name)
+                index = json.loads(data)
+            except ResourceNotFoundError:
+                index, etag = {}, None
+            index[key] = {"size": size, "last_used": time.time()}
+            evicted = []
+            total = sum(entry["size"] for entry in index.values())
+            for old_key in sorted(index, key=lambda name: index[name]["last_used"]):
+                if total <= self.blob_max_bytes or old_key == key:
+                    break
+                total -= index.pop(old_key)["size"]
+                evicted.append(old_key)
+            try:
+                self.store.write(index_name, json.dumps(index).encode("utf-8"), if_match=etag, create_only=etag is None)
+            except (ResourceModifiedError, ResourceExistsError):
+                continue
+            for old_key in evicted:
+                self.store.delete(f"{_BLOB_PREFIX}/{old_key}.json.gz")
+            return
+
+
+_parsed_document_cache = None
+_parsed_document_cache_lock = threading.Lock()
+
+
+def get_parsed_document_cache():
+    """Returns the process-wide parsed-document cache, with the shared blob store as its second tier."""
+    global _parsed_document_cache
+    with _parsed_document_cache_lock:
+        if _parsed_document_cache is None:
+            _parsed_document_cache = ParsedDocumentCache(get_blob_store())
+        return _parsed_document_cache
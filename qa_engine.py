@@ -0,0 +1,245 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from utils import agent, summarization_prompt, qa_prompt
+from vector_backends import get_vector_backend
+from document_library import get_document_library
+from answer_cache import get_answer_cache
+from context_packing import pack_context, count_tokens
+from telemetry import span, increment, propagate
+
+
+# When to condense a follow-up question with the chat history before answering:
+# "auto" only when the question refers back to the conversation, "speculative" like "auto" but
+# retrieving documents while the question is condensed, "always" whenever there is a history
+QA_CONDENSE_MODE = os.environ.get("QA_CONDENSE_MODE", "auto")
+# Number of question answering engines kept per process; the least recently used ones are dropped beyond it
+QA_ENGINE_CACHE_SIZE = int(os.environ.get("QA_ENGINE_CACHE_SIZE", 64))
+
+# Words through which a question refers back to the conversation
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|they|them|their|this|that|these|those|he|she|his|her|above|previous|earlier|"
+    r"same|also|more|else|again|other|former|latter|mentioned)\b",
+    re.IGNORECASE
+)
+
+
+def format_chat_history(chat_history):
+    """Formats (question, answer) pairs the way ConversationalRetrievalChain passes them to the prompt."""
+    return "".join(f"\nHuman: {question}\nAssistant: {answer}" for question, answer in chat_history)
+
+
+def needs_condensing(question, chat_history):
+    """
+    Decides whether a question has to be rewritten with the chat history to be answered.
+
+    Questions without a history, or that neither refer back to the conversation nor are too
+    short to stand on their own, are answered as they are.
+
+    Args:
+        question (str): The user's question.
+        chat_history (list of tuple): The recent (question, answer) pairs.
+
+    Returns:
+        bool: True if the question should be condensed.
+    """
+    if not chat_history:
+        return False
+    return bool(FOLLOW_UP_PATTERN.search(question)) or len(question.split()) <= 3
+
+
+def record_token_usage(stage, prompt, response):
+    """Counts the prompt and completion tokens of an LLM call, estimated when the response does not report them."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    increment("llm_tokens_total", usage.get("input_tokens") or count_tokens(prompt), stage=stage, kind="prompt")
+    increment("llm_tokens_total", usage.get("output_tokens") or count_tokens(response.content), stage=stage, kind="completion")
+
+
+class RetrievalQAEngine:
+    """
+    Retrieval question answering over one use case collection, built once and reused across turns.
+
+    Each answer takes a single LLM call, unless the question needs to be condensed with the
+    chat history first (see needs_condensing and QA_CONDENSE_MODE). In "speculative" mode, the
+    documents are retrieved with the raw question and the last question of the history while
+    the question is condensed, so retrieval is not on the critical path.
+
+    Standalone questions are looked up in the answer cache first, and their answers cached.
+
+    Args:
+        vectorstore (VectorStore): The vector store of the use case collection.
+        model (BaseChatModel): The model condensing questions.
+        answer_model (BaseChatModel): The model answering, usually streaming.
+        search_kwargs (dict): The search arguments, e.g. "k" and "score_threshold".
+        condense_mode (str): "auto", "speculative" or "always".
+        collection_name (str, optional): The collection name under which answers are cached.
+        answer_cache (AnswerCache, optional): The cache of answers, None to disable caching.
+    """
+
+    def __init__(self, vectorstore, model, answer_model, search_kwargs=None, condense_mode=QA_CONDENSE_MODE,
+                 collection_name=None, answer_cache=None) -> None:
+        self.vectorstore = vectorstore
+        self.collection_name = collection_name
+        self.answer_cache = answer_cache
+        self.search_kwargs = search_kwargs or {"k": 20, "score_threshold": 0.6}
+        self.model = model
+        self.answer_model = answer_model
+        self.condense_mode = condense_mode
+
+    def condense(self, question, chat_history, callbacks=None):
+        """Rewrites a follow-up question into a standalone prompt with the condensation LLM call."""
+        prompt = summarization_prompt.format(question=question, chat_history=format_chat_history(chat_history))
+        with span("condense"):
+            response = self.model.invoke(prompt, config={"callbacks": callbacks})
+        record_token_usage("condense", prompt, response)
+        return response.content
+
+    def retrieve(self, query, query_vector=None):
+        """
+        Returns the chunks most similar to a query.
+
+        The query is embedded and searched as two stages, so each is timed on its own; the
+        vector of the answer cache lookup is reused when given.
+        """
+        if query_vector is None:
+            with span("embed_query"):
+                query_vector = self.vectorstore.embeddings.embed_query(query)
+        with span("vector_search") as attributes:
+            documents = self.vectorstore.similarity_search_by_vector(query_vector, **self.search_kwargs)
+            attributes["documents"] = len(documents)
+        return documents
+
+    def will_condense(self, question, chat_history):
+        """Returns whether answer condenses the question with the chat history, in which case the question itself is not embedded."""
+        if self.condense_mode == "always":
+            return bool(chat_history)
+        return needs_condensing(question, chat_history)
+
+    def answer(self, question, chat_history, n_documents, callbacks=None, query_vector=None):
+        """
+        Answers a question from the documents of the use case.
+
+        Args:
+            question (str): The user's question.
+            chat_history (list of tuple): The recent (question, answer) pairs.
+            n_documents (int): The number of documents of the use case, given to the prompt.
+            callbacks (list, optional): Callback handlers, e.g. to stream the answer's tokens.
+            query_vector (list of float, optional): The embedding of the question, if already
+                computed; only used when the question is not condensed.
+
+        Returns:
+            dict: The "answer", the "source_documents" it is based on, the "question" sent
+                  to the answer model, the "context_report" of pack_context and whether the
+                  answer was "cached".
+        """
+        condense = self.will_condense(question, chat_history)
+        if condense:
+            query_vector = None
+
+        # Only standalone questions are cached, as follow-ups depend on the conversation
+        if not condense and self.answer_cache is not None:
+            generation = self.answer_cache.generation(self.collection_name)
+            if query_vector is None:
+                with span("embed_query"):
+                    query_vector = self.vectorstore.embeddings.embed_query(question)
+            with span("answer_cache_lookup") as attributes:
+                cached_answer = self.answer_cache.get(self.collection_name, query_vector)
+                attributes["hit"] = cached_answer is not None
+            if cached_answer is not None:
+                return {**cached_answer, "cached": True}
+
+        if not condense:
+            standalone_question = question
+            source_documents = self.retrieve(question, query_vector)
+        elif self.condense_mode == "speculative":
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                retrieval = executor.submit(propagate(self.retrieve), f"{chat_history[-1][0]}\n{question}")
+                standalone_question = self.condense(question, chat_history, callbacks)
+                source_documents = retrieval.result()
+        else:
+            standalone_question = self.condense(question, chat_history, callbacks)
+            source_documents = self.retrieve(standalone_question)
+
+        # Overlapping and redundant chunks are merged or dropped to fit the context token budget
+        with span("pack_context") as attributes:
+            passages, context_report = pack_context(source_documents)
+            attributes.update(context_report)
+        prompt = qa_prompt.format(question=standalone_question,
+                                  context="\n\n".join(passage.page_content for passage in passages),
+                                  n_documents=n_documents)
+        with span("answer"):
+            response = self.answer_model.invoke(prompt, config={"callbacks": callbacks})
+        record_token_usage("answer", prompt, response)
+        answer = {"answer": response.content, "source_documents": passages, "question": standalone_question,
+                  "context_report": context_report}
+        if not condense and self.answer_cache is not None:
+            self.answer_cache.put(self.collection_name, query_vector, answer, generation)
+        return {**answer, "cached": False}
+
+
+_qa_engines = OrderedDict()
+_qa_engines_lock = threading.Lock()
+
+
+def _cached_qa_engine(key, create):
+    """Returns the engine cached under key, or else caches the one made by create, dropping the least recently used ones."""
+    with _qa_engines_lock:
+        if key in _qa_engines:
+            _qa_engines.move_to_end(key)
+        else:
+            _qa_engines[key] = create()
+            while len(_qa_engines) > max(1, QA_ENGINE_CACHE_SIZE):
+                _qa_engines.popitem(last=False)
+        return _qa_engines[key]
+
+
+def get_qa_engine(collection_name):
+    """
+    Returns the process-wide question answering engine of a use case collection.
+
+    Args:
+        collection_name (str): The name of the use case collection.
+
+    Returns:
+        RetrievalQAEngine: The engine, created on first use and shared by all sessions while
+                           it is among the QA_ENGINE_CACHE_SIZE most recently used ones.
+    """
+    return _cached_qa_engine(collection_name, lambda: RetrievalQAEngine(
+        get_vector_backend().as_vectorstore(collection_name, agent.embeddings),
+        agent.model,
+        agent.streaming_model,
+        collection_name=collection_name,
+        answer_cache=get_answer_cache()
+    ))
+
+
+def get_use_case_qa_engine(user_id, use_case_name):
+    """
+    Returns the process-wide question answering engine of a use case.
+
+    Use cases built from the document library search the user's library collection,
+    restricted to their documents; an engine is created for each set of documents. Other
+    use cases search their own collection.
+
+    Args:
+        user_id (str): The ID of the user owning the use case.
+        use_case_name (str): The name of the use case.
+
+    Returns:
+        RetrievalQAEngine: The engine, created on first use and shared by all sessions.
+    """
+    collection_name = f"{user_id}_{use_case_name}_documents"
+    library = get_document_library()
+    document_ids = library.use_case_documents(user_id, use_case_name)
+    if document_ids is None:
+        return get_qa_engine(collection_name)
+    return _cached_qa_engine((collection_name, frozenset(document_ids)), lambda: RetrievalQAEngine(
+        library.as_vectorstore(user_id, agent.embeddings),
+        agent.model,
+        agent.streaming_model,
+        search_kwargs={"k": 20, "score_threshold": 0.6, "filter": library.search_filter(document_ids)},
+        collection_name=collection_name,
+        answer_cache=get_answer_cache()
+    ))
@@ -0,0 +1,317 @@
+import contextlib
+import contextvars
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from embedding_scheduler import TokenRateLimiter, estimate_tokens, is_rate_limit_error, retry_after_seconds
+from telemetry import span, increment, set_gauge, metrics
+
+
+# Requests sent to the chat deployment at the same time by each server process, 0 means no limit
+AZURE_CHAT_MAX_CONCURRENCY = int(os.environ.get("AZURE_CHAT_MAX_CONCURRENCY", 16))
+# Token-per-minute quota of the chat deployment, 0 means no client-side limit
+AZURE_CHAT_TPM = int(os.environ.get("AZURE_CHAT_TPM", 0))
+# Requests sent to the embedding deployment at the same time by each server process, 0 means no limit
+AZURE_EMBEDDINGS_MAX_CONCURRENCY = int(os.environ.get("AZURE_EMBEDDINGS_MAX_CONCURRENCY", 16))
+
+# Tokens reserved for the completion of a chat request in the token budget of its deployment
+_COMPLETION_TOKENS = 500
+
+_request_user = contextvars.ContextVar("request_user", default=None)
+
+
+def set_request_user(user_id):
+    """Makes user_id the user on whose behalf the requests of the current context are queued."""
+    _request_user.set(user_id)
+
+
+@contextlib.contextmanager
+def request_user(user_id):
+    """Context manager queuing the requests of its block on behalf of user_id."""
+    token = _request_user.set(user_id)
+    try:
+        yield
+    finally:
+        _request_user.reset(token)
+
+
+class DeploymentScheduler:
+    """
+    Admission control in front of one model deployment, shared by all sessions of the process.
+
+    A request is sent once fewer than max_concurrency requests of the deployment are in
+    flight and its estimated tokens fit in the deployment's token-per-minute budget. Waiting
+    requests are queued per user and admitted round-robin across users, so a user sending
+    many requests, e.g. while ingesting documents, does not hold up the others; each user's
+    requests are admitted in order. A throttled response pauses the whole deployment for
+    the delay the service asks for.
+
+    The depth of the queue and the requests in flight are exposed as gauges, and the time
+    spent queuing as a histogram, labelled by deployment.
+
+    Args:
+        name (str): The name of the deployment.
+        max_concurrency (int): Number of requests in flight at the same time, 0 for no limit.
+        tokens_per_minute (int): Token budget of the deployment, 0 for none.
+    """
+
+    def __init__(self, name, max_concurrency=0, tokens_per_minute=0) -> None:
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenRateLimiter(tokens_per_minute)
+        self._queues = {}
+        self._rotation = deque()
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def queue_depth(self):
+        """Returns the number of requests waiting to be admitted."""
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _update_gauges(self):
+        set_gauge("request_queue_depth", sum(len(queue) for queue in self._queues.values()), deployment=self.name)
+        set_gauge("requests_in_flight", self._in_flight, deployment=self.name)
+
+    def _admit(self, user_id, tokens):
+        ticket = object()
+        start = time.monotonic()
+        with self._condition:
+            queue = self._queues.setdefault(user_id, deque())
+            queue.append(ticket)
+            if len(queue) == 1:
+                self._rotation.append(user_id)
+            self._update_gauges()
+            while True:
+                delay = None
+                if self._rotation[0] == user_id and queue[0] is ticket and \
+                        (not self.max_concurrency or self._in_flight < self.max_concurrency):
+                    delay = self.rate_limiter.try_acquire(tokens)
+                    if delay <= 0:
+                        break
+                self._condition.wait(delay)
+            queue.popleft()
+            self._rotation.popleft()
+            if queue:
+                self._rotation.append(user_id)
+            else:
+                del self._queues[user_id]
+            self._in_flight += 1
+            self._update_gauges()
+            self._condition.notify_all()
+        metrics.observe("request_queue_wait_seconds", time.monotonic() - start, deployment=self.name)
+
+    def _release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._update_gauges()
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def admitted(self, tokens):
+        """
+        Context manager waiting until a request may be sent, and holding its slot during its block.
+
+        Args:
+            tokens (int): The estimated number of tokens of the request.
+        """
+        with span("request_queue", deployment=self.name):
+            self._admit(_request_user.get(), tokens)
+        try:
+            yield
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.rate_limiter.pause(retry_after_seconds(e, default=1))
+            raise
+        finally:
+            self._release()
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls in flight: the first call of a key runs, later ones wait for its result.
+
+    The first caller can attach a shared object to the call, e.g. to stream its progress,
+    which is given to the join function of every caller that joins it.
+    """
+
+    class _Call:
+        def __init__(self, shared) -> None:
+            self.shared = shared
+            self.result = None
+            self.error = None
+            self.done = threading.Event()
+
+    def __init__(self, name) -> None:
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, shared=None, join=None):
+        """
+        Runs function, unless a call of the same key is in flight, whose result is then returned.
+
+        Args:
+            key (str): The key identifying identical calls.
+            function (callable): The call to run, without arguments.
+            shared (object, optional): Object attached to the call if this caller runs it.
+            join (callable, optional): Called with the shared object of the running call when
+                                       this caller joins it, before waiting for its result.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call(shared)
+
+        if not leader:
+            increment("requests_total", deployment=self.name, outcome="coalesced")
+            if join is not None:
+                join(call.shared)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        increment("requests_total", deployment=self.name, outcome="sent")
+        try:
+            call.result = function()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def _request_key(*parts):
+    return hashlib.sha256("\0".join(map(repr, parts)).encode("utf-8")).hexdigest()
+
+
+class _TokenFanOut(BaseCallbackHandler):
+    """Records the tokens streamed by a chat request, for the callers that joined it to replay in their own thread."""
+
+    def __init__(self) -> None:
+        self.tokens = []
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def on_llm_new_token(self, token, **kwargs) -> None:
+        with self._condition:
+            self.tokens.append(token)
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def replay(self, callbacks):
+        """Passes every token streamed so far, then those that follow, to callbacks until the request ends."""
+        position = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self.tokens) > position or self.closed)
+                tokens, closed = self.tokens[position:], self.closed
+            position += len(tokens)
+            for token in tokens:
+                for callback in callbacks:
+                    if hasattr(callback, "on_llm_new_token"):
+                        callback.on_llm_new_token(token)
+            if closed and not tokens:
+                return
+
+
+class ScheduledChatModel:
+    """
+    Chat model whose requests go through the admission control of its deployment.
+
+    Identical requests in flight, e.g. the same question asked by several sessions of a
+    shared use case, are sent once. The callers that join a streamed request receive its
+    tokens in their own thread, from the first one. Other attributes are those of the
+    wrapped model.
+
+    Args:
+        model (BaseChatModel): The chat model to wrap.
+        scheduler (DeploymentScheduler): The admission control of the model's deployment.
+    """
+
+    def __init__(self, model, scheduler) -> None:
+        self.model = model
+        self.scheduler = scheduler
+        self._flight = SingleFlight(scheduler.name)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def invoke(self, input, config=None, **kwargs):
+        config = dict(config or {})
+        callbacks = list(config.get("callbacks") or [])
+        fan_out = _TokenFanOut()
+
+        def send():
+            try:
+                with self.scheduler.admitted(estimate_tokens(str(input)) + _COMPLETION_TOKENS):
+                    return self.model.invoke(input, config={**config, "callbacks": callbacks + [fan_out]}, **kwargs)
+            finally:
+                fan_out.close()
+
+        key = _request_key(input, sorted(kwargs.items()), getattr(self.model, "streaming", False))
+        return self._flight.do(key, send, shared=fan_out, join=lambda shared: shared.replay(callbacks))
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embeddings whose requests go through the admission control of their deployment.
+
+    Identical requests in flight are sent once.
+
+    Args:
+        embeddings (Embeddings): The embedding model to wrap.
+        scheduler (DeploymentScheduler): The admission control of the model's deployment.
+    """
+
+    def __init__(self, embeddings, scheduler) -> None:
+        self.embeddings = embeddings
+        self.scheduler = scheduler
+        self._flight = SingleFlight(scheduler.name)
+
+    def _send(self, function, tokens, *args):
+        with self.scheduler.admitted(tokens):
+            return function(*args)
+
+    def embed_documents(self, texts):
+        return self._flight.do(_request_key("documents", texts), lambda: self._send(
+            self.embeddings.embed_documents, sum(estimate_tokens(text) for text in texts), texts))
+
+    def embed_query(self, text):
+        return self._flight.do(_request_key("query", text), lambda: self._send(
+            self.embeddings.embed_query, estimate_tokens(text), text))
+
+
+_deployment_schedulers = {}
+_deployment_schedulers_lock = threading.Lock()
+
+
+def get_deployment_scheduler(name, max_concurrency=0, tokens_per_minute=0):
+    """
+    Returns the process-wide admission control of a deployment, created with the given limits on first use.
+
+    Args:
+        name (str): The name of the deployment.
+        max_concurrency (int): Number of requests in flight at the same time, 0 for no limit.
+        tokens_per_minute (int): Token budget of the deployment, 0 for none.
+
+    Returns:
+        DeploymentScheduler: The scheduler shared by every model of the deployment.
+    """
+    with _deployment_schedulers_lock:
+        if name not in _deployment_schedulers:
+            _deployment_schedulers[name] = DeploymentScheduler(name, max_concurrency, tokens_per_minute)
+        return _deployment_schedulers[name]
@@ -0,0 +1,96 @@
+import threading
+import time
+from telemetry import metrics
+
+
+# Reference time of the startup measurements: when the app started importing its modules
+PROCESS_START = time.perf_counter()
+
+_MISSING = object()
+
+
+class ResourceRegistry:
+    """
+    Process-wide resources, e.g. API clients, created on first use and shared by every session and rerun.
+
+    Modules register a factory per resource at import, which costs nothing; the resource is
+    only created when first requested, under a lock of its own so a slow client does not hold
+    up the others. Creation times are recorded for the startup report.
+    """
+
+    def __init__(self) -> None:
+        self._factories = {}
+        self._resources = {}
+        self._locks = {}
+        self._timings = {}
+        self._milestones = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        """Registers the factory creating a resource. Re-registering a created resource does not replace it."""
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        """Returns a resource, creating it on first use. Raises KeyError if it was never registered."""
+        resource = self._resources.get(name, _MISSING)
+        if resource is not _MISSING:
+            return resource
+        with self._locks[name]:
+            if name not in self._resources:
+                start = time.perf_counter()
+                self._resources[name] = self._factories[name]()
+                seconds = time.perf_counter() - start
+                self._timings[name] = {"init_seconds": round(seconds, 4),
+                                       "ready_after_seconds": round(time.perf_counter() - PROCESS_START, 4)}
+                metrics.observe("resource_init_seconds", seconds, resource=name)
+        return self._resources[name]
+
+    def set(self, name, resource):
+        """Replaces a resource, e.g. with an offline stand-in in tests and benchmarks."""
+        with self._lock:
+            self._locks.setdefault(name, threading.Lock())
+            self._resources[name] = resource
+
+    def reset(self, name):
+        """Drops a resource, so that it is created again on next use."""
+        with self._lock:
+            self._resources.pop(name, None)
+            self._timings.pop(name, None)
+
+    def mark(self, milestone):
+        """Records the time since PROCESS_START at which a startup milestone was reached, once."""
+        with self._lock:
+            self._milestones.setdefault(milestone, round(time.perf_counter() - PROCESS_START, 4))
+
+    def startup_report(self):
+        """
+        Returns the startup measurements.
+
+        Returns:
+            dict: The 'milestones' reached, in seconds since PROCESS_START, and for every
+                  resource created so far its 'init_seconds' and the 'ready_after_seconds'
+                  since PROCESS_START at which it was available.
+        """
+        with self._lock:
+            return {"milestones": dict(self._milestones), "resources": {name: dict(timing) for name, timing in self._timings.items()}}
+
+
+registry = ResourceRegistry()
+
+
+def register_resource(name, factory):
+    registry.register(name, factory)
+
+
+def get_resource(name):
+    return registry.get(name)
+
+
+def set_resource(name, resource):
+    registry.set(name, resource)
+
+
+def startup_report():
+    return registry.startup_report()
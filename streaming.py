@@ -0,0 +1,42 @@
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class StreamingAnswerHandler(BaseCallbackHandler):
+    """
+    Callback handler rendering the tokens of an answer into a Streamlit placeholder as they arrive.
+
+    It also records the time to the first token and the total time of the answer, both
+    measured from the creation of the handler, i.e. from when the question was asked.
+
+    Args:
+        placeholder (st.empty): The Streamlit placeholder the answer is written to.
+        cursor (str): Text shown after the partial answer while it is being generated.
+    """
+
+    def __init__(self, placeholder, cursor=" | ") -> None:
+        self.placeholder = placeholder
+        self.cursor = cursor
+        self.text = ""
+        self.started_at = time.perf_counter()
+        self.time_to_first_token = None
+        self.total_time = None
+
+    def on_llm_new_token(self, token, **kwargs) -> None:
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.started_at
+        self.text += token
+        self.placeholder.markdown(self.text + self.cursor)
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        # Calls that did not stream, e.g. condensing the question, are not the answer
+        if self.time_to_first_token is not None:
+            self.total_time = time.perf_counter() - self.started_at
+
+    def finish(self, text):
+        """Replaces the streamed text with the final answer and returns the recorded timings."""
+        if self.total_time is None:
+            self.total_time = time.perf_counter() - self.started_at
+        self.text = text
+        self.placeholder.markdown(text)
+        return {"time_to_first_token": self.time_to_first_token, "total_time": self.total_time}
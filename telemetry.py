@@ -0,0 +1,406 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Port of the Prometheus metrics endpoint served by each app process (0 disables it)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+# Base URL of an OpenTelemetry collector receiving traces and metrics over OTLP/HTTP, e.g. http://localhost:4318
+OTEL_EXPORTER_OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+# Seconds between two exports of the metrics to the OpenTelemetry collector
+OTEL_METRIC_EXPORT_INTERVAL = float(os.environ.get("OTEL_METRIC_EXPORT_INTERVAL", 30))
+# Show the latency breakdown of the last answer in the Chatbot page
+TELEMETRY_DEBUG_PANEL = os.environ.get("TELEMETRY_DEBUG_PANEL", "false").lower() == "true"
+
+SERVICE_NAME = "biorag"
+# Upper bounds in seconds of the buckets of the stage duration histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters, gauges and duration histograms, labelled by stage and kind.
+
+    Metrics are cumulative since the process started, and can be rendered in the Prometheus
+    text format or as OTLP metrics.
+    """
+
+    def __init__(self) -> None:
+        self.start_time_ns = time.time_ns()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        """Adds value to the counter name with the given labels."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Sets the gauge name with the given labels to its current value."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        """Records a duration in the histogram name with the given labels."""
+        key = (name, tuple(sorted(labels.items())))
+        bucket = next((index for index, bound in enumerate(DURATION_BUCKETS) if seconds <= bound), len(DURATION_BUCKETS))
+        with self._lock:
+            histogram = self._histograms.setdefault(key, {"buckets": [0] * (len(DURATION_BUCKETS) + 1), "sum": 0.0, "count": 0})
+            histogram["buckets"][bucket] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def snapshot(self):
+        """Returns copies of the counters, gauges and histograms, by (name, labels)."""
+        with self._lock:
+            return dict(self._counters), dict(self._gauges), {key: {**value, "buckets": list(value["buckets"])}
+                                          for key, value in self._histograms.items()}
+
+    def prometheus_text(self):
+        """Renders the metrics in the Prometheus text exposition format."""
+        counters, gauges, histograms = self.snapshot()
+
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            # Backslashes, double quotes and line feeds are escaped in label values, as the format requires
+            return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+        lines = []
+        for metric_name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {SERVICE_NAME}_{metric_name} counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric_name:
+                    lines.append(f"{SERVICE_NAME}_{name}{labels_text(labels)} {value}")
+        for metric_name in sorted({name for name, _ in gauges}):
+            lines.append(f"# TYPE {SERVICE_NAME}_{metric_name} gauge")
+            for (name, labels), value in sorted(gauges.items()):
+                if name == metric_name:
+                    lines.append(f"{SERVICE_NAME}_{name}{labels_text(labels)} {value}")
+        for metric_name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {SERVICE_NAME}_{metric_name} histogram")
+            for (name, labels), histogram in sorted(histograms.items()):
+                if name != metric_name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(DURATION_BUCKETS) + ["+Inf"], histogram["buckets"]):
+                    cumulative += count
+                    lines.append(f"{SERVICE_NAME}_{name}_bucket{labels_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{SERVICE_NAME}_{name}_sum{labels_text(labels)} {histogram['sum']}")
+                lines.append(f"{SERVICE_NAME}_{name}_count{labels_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def otlp_metrics(self):
+        """Returns the metrics as an OTLP/JSON ExportMetricsServiceRequest, with cumulative temporality."""
+        counters, gauges, histograms = self.snapshot()
+        now = str(time.time_ns())
+        start = str(self.start_time_ns)
+        metrics = {}
+        for (name, labels), value in counters.items():
+            metric = metrics.setdefault(name, {"name": f"{SERVICE_NAME}_{name}",
+                                               "sum": {"dataPoints": [], "aggregationTemporality": 2, "isMonotonic": True}})
+            metric["sum"]["dataPoints"].append({"attributes": _otlp_attributes(dict(labels)), "startTimeUnixNano": start,
+                                                "timeUnixNano": now, "asDouble": float(value)})
+        for (name, labels), value in gauges.items():
+            metric = metrics.setdefault(name, {"name": f"{SERVICE_NAME}_{name}", "gauge": {"dataPoints": []}})
+            metric["gauge"]["dataPoints"].append({"attributes": _otlp_attributes(dict(labels)), "timeUnixNano": now,
+                                                  "asDouble": float(value)})
+        for (name, labels), histogram in histograms.items():
+            metric = metrics.setdefault(name, {"name": f"{SERVICE_NAME}_{name}", "unit": "s",
+                                               "histogram": {"dataPoints": [], "aggregationTemporality": 2}})
+            metric["histogram"]["dataPoints"].append({
+                "attributes": _otlp_attributes(dict(labels)), "startTimeUnixNano": start, "timeUnixNano": now,
+                "count": str(histogram["count"]), "sum": histogram["sum"],
+                "bucketCounts": [str(count) for count in histogram["buckets"]], "explicitBounds": list(DURATION_BUCKETS),
+            })
+        return {"resourceMetrics": [{"resource": _otlp_resource(),
+                                     "scopeMetrics": [{"scope": {"name": SERVICE_NAME}, "metrics": list(metrics.values())}]}]}
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _otlp_attributes(attributes):
+    def value(attribute):
+        if isinstance(attribute, bool):
+            return {"boolValue": attribute}
+        if isinstance(attribute, int):
+            return {"intValue": str(attribute)}
+        if isinstance(attribute, float):
+            return {"doubleValue": attribute}
+        return {"stringValue": str(attribute)}
+    return [{"key": key, "value": value(attribute)} for key, attribute in attributes.items()]
+
+
+def _otlp_resource():
+    return {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})}
+
+
+metrics = MetricsRegistry()
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Trace:
+    """
+    The spans of one request, e.g. a chat turn or an ingestion job.
+
+    Spans opened with span() while the trace is active are recorded in it, including those
+    of threads started with propagate().
+
+    Args:
+        name (str): The name of the request.
+    """
+
+    def __init__(self, name) -> None:
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.spans = []
+        self._lock = threading.Lock()
+        self._tokens = None
+
+    def add(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def end(self):
+        """Ends the trace, records its duration and exports it to the OpenTelemetry collector."""
+        if self._tokens is not None:
+            _current_span.reset(self._tokens[1])
+            _current_trace.reset(self._tokens[0])
+            self._tokens = None
+        self.end_ns = time.time_ns()
+        metrics.observe("request_duration_seconds", (self.end_ns - self.start_ns) / 1e9, request=self.name)
+        _export_trace(self)
+
+    def breakdown(self):
+        """
+        Returns the spans of the trace in start order, for display.
+
+        Returns:
+            list of dict: The 'stage', its 'depth' in the span tree, its 'start_ms' from the
+                          start of the trace, its 'duration_ms' and its 'attributes'.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda record: record["start_ns"])
+        depths = {self.span_id: -1}
+        rows = []
+        for record in spans:
+            depth = depths.get(record["parent_id"], -1) + 1
+            depths[record["span_id"]] = depth
+            rows.append({"stage": record["name"], "depth": depth,
+                         "start_ms": round((record["start_ns"] - self.start_ns) / 1e6, 1),
+                         "duration_ms": round((record["end_ns"] - record["start_ns"]) / 1e6, 1),
+                         "attributes": record["attributes"]})
+        total_ms = round(((self.end_ns or time.time_ns()) - self.start_ns) / 1e6, 1)
+        return [{"stage": self.name, "depth": 0, "start_ms": 0.0, "duration_ms": total_ms, "attributes": {}}] + \
+            [{**row, "depth": row["depth"] + 1} for row in rows]
+
+
+def begin_trace(name):
+    """Starts a trace and makes it the active trace of the current context. End it with Trace.end()."""
+    trace = Trace(name)
+    trace._tokens = (_current_trace.set(trace), _current_span.set(trace.span_id))
+    return trace
+
+
+@contextlib.contextmanager
+def start_trace(name):
+    """Context manager running its block in a new trace."""
+    trace = begin_trace(name)
+    try:
+        yield trace
+    finally:
+        trace.end()
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Times a stage, recording it in the stage duration histogram and in the active trace.
+
+    Yields the attributes of the span, which the block can complete, e.g. with the number
+    of items it processed.
+
+    Args:
+        name (str): The name of the stage, e.g. "vector_search".
+        **attributes: Initial attributes of the span.
+    """
+    trace = _current_trace.get()
+    parent_id = _current_span.get()
+    span_id = uuid.uuid4().hex[:16]
+    token = _current_span.set(span_id)
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current_span.reset(token)
+        metrics.observe("stage_duration_seconds", duration, stage=name)
+        if trace is not None:
+            trace.add({"name": name, "span_id": span_id, "parent_id": parent_id, "start_ns": start_ns,
+                       "end_ns": start_ns + int(duration * 1e9), "attributes": attributes})
+
+
+def traced(name):
+    """Decorator recording every call of a function as a span named name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def increment(name, value=1, **labels):
+    """Adds value to a process-wide counter, e.g. increment("blob_bytes_total", 1024, direction="read")."""
+    metrics.increment(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    """Sets a process-wide gauge, e.g. set_gauge("request_queue_depth", 3, deployment="gpt-4")."""
+    metrics.set_gauge(name, value, **labels)
+
+
+def propagate(function):
+    """Wraps a function so that, run in another thread, its spans are recorded in the current trace."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+
+def _otlp_trace(trace):
+    """Returns a finished trace as an OTLP/JSON ExportTraceServiceRequest."""
+    def otlp_span(span_id, parent_id, name, start_ns, end_ns, attributes):
+        record = {"traceId": trace.trace_id, "spanId": span_id, "name": name, "kind": 1,
+                  "startTimeUnixNano": str(start_ns), "endTimeUnixNano": str(end_ns),
+                  "attributes": _otlp_attributes(attributes)}
+        if parent_id:
+            record["parentSpanId"] = parent_id
+        if "error" in attributes:
+            record["status"] = {"code": 2, "message": attributes["error"]}
+        return record
+
+    spans = [otlp_span(trace.span_id, None, trace.name, trace.start_ns, trace.end_ns, {})]
+    with trace._lock:
+        spans += [otlp_span(record["span_id"], record["parent_id"], record["name"], record["start_ns"],
+                            record["end_ns"], record["attributes"]) for record in trace.spans]
+    return {"resourceSpans": [{"resource": _otlp_resource(),
+                               "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}]}]}
+
+
+class OtlpExporter:
+    """
+    Sends finished traces and, periodically, the metrics to an OpenTelemetry collector over OTLP/HTTP.
+
+    Exports run on a background thread, so requests never wait for the collector; traces
+    are dropped when the collector cannot keep up or is unreachable.
+
+    Args:
+        endpoint (str): The base URL of the collector, e.g. http://localhost:4318.
+        interval (float): Seconds between two metric exports.
+    """
+
+    def __init__(self, endpoint, interval=OTEL_METRIC_EXPORT_INTERVAL) -> None:
+        self.endpoint = endpoint.rstrip("/")
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=1000)
+        threading.Thread(target=self._loop, name="otlp-exporter", daemon=True).start()
+
+    def export_trace(self, trace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            pass
+
+    def _post(self, path, payload):
+        request = urllib.request.Request(f"{self.endpoint}{path}", data=json.dumps(payload).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except Exception as e:
+            print(f"Exception occurred: {e}")
+
+    def _loop(self):
+        next_metrics = time.monotonic() + self.interval
+        while True:
+            try:
+                trace = self._queue.get(timeout=max(0.0, next_metrics - time.monotonic()))
+                self._post("/v1/traces", _otlp_trace(trace))
+            except queue.Empty:
+                pass
+            if time.monotonic() >= next_metrics:
+                self._post("/v1/metrics", metrics.otlp_metrics())
+                next_metrics = time.monotonic() + self.interval
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_otlp_exporter = None
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def _export_trace(trace):
+    if _otlp_exporter is not None:
+        _otlp_exporter.export_trace(trace)
+
+
+def start_exporters(metrics_port=METRICS_PORT, otlp_endpoint=OTEL_EXPORTER_OTLP_ENDPOINT):
+    """
+    Starts, once per process, the Prometheus endpoint and the OpenTelemetry exporter that are configured.
+
+    Args:
+        metrics_port (int): The port serving /metrics, 0 to not serve it.
+        otlp_endpoint (str): The base URL of the OpenTelemetry collector, empty to not export.
+    """
+    global _otlp_exporter, _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+        if metrics_port:
+            try:
+                server = ThreadingHTTPServer(("", metrics_port), _MetricsHandler)
+                threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+            except OSError as e:
+                print(f"Exception occurred: {e}")
+        if otlp_endpoint:
+            _otlp_exporter = OtlpExporter(otlp_endpoint)
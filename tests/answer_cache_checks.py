@@ -0,0 +1,58 @@
+import tempfile
+import time
+import unittest
+
+from answer_cache import AnswerCache
+from blob_storage import LocalBlobStore
+
+
+class TestAnswerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = LocalBlobStore(self.tmp_dir.name)
+        self.cache = AnswerCache(similarity=0.95, ttl_seconds=3600, max_entries=2, store=self.store)
+        self.answer = {"answer": "The primary endpoint is overall survival.", "source_documents": []}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_similar_question_hits(self):
+        """ Test that a close question of the same collection hits and other collections miss """
+        self.cache.put("user_case_documents", [1.0, 0.0, 0.1], self.answer, self.cache.generation("user_case_documents"))
+        self.assertEqual(self.cache.get("user_case_documents", [1.0, 0.01, 0.1]), self.answer)
+        self.assertIsNone(self.cache.get("user_case_documents", [0.0, 1.0, 0.0]))
+        self.assertIsNone(self.cache.get("user_other_documents", [1.0, 0.0, 0.1]))
+
+    def test_invalidation_drops_answers(self):
+        """ Test that invalidating a collection drops its answers and answers computed meanwhile """
+        generation = self.cache.generation("user_case_documents")
+        self.cache.put("user_case_documents", [1.0, 0.0], self.answer, generation)
+        self.cache.invalidate("user_case_documents")
+        self.assertIsNone(self.cache.get("user_case_documents", [1.0, 0.0]))
+        self.cache.put("user_case_documents", [1.0, 0.0], self.answer, generation)
+        self.assertIsNone(self.cache.get("user_case_documents", [1.0, 0.0]))
+
+    def test_invalidation_reaches_other_processes(self):
+        """ Test that answers are no longer served once another process invalidated their collection and the version is revalidated """
+        cache = AnswerCache(similarity=0.95, ttl_seconds=3600, max_entries=2, store=self.store, revalidate_seconds=0.2)
+        cache.put("user_case_documents", [1.0, 0.0], self.answer, cache.generation("user_case_documents"))
+        AnswerCache(store=self.store).invalidate("user_case_documents")
+        self.assertEqual(cache.get("user_case_documents", [1.0, 0.0]), self.answer)
+        time.sleep(0.2)
+        self.assertIsNone(cache.get("user_case_documents", [1.0, 0.0]))
+        cache.put("user_case_documents", [1.0, 0.0], self.answer, cache.generation("user_case_documents"))
+        self.assertEqual(cache.get("user_case_documents", [1.0, 0.0]), self.answer)
+
+    def test_least_recently_used_answer_is_evicted(self):
+        """ Test LRU eviction beyond max_entries """
+        for vector in ([1.0, 0.0, 0.0], [0.0, 1.0, 0.0]):
+            self.cache.put("user_case_documents", vector, self.answer, 0)
+        self.cache.get("user_case_documents", [1.0, 0.0, 0.0])
+        self.cache.put("user_case_documents", [0.0, 0.0, 1.0], self.answer, 0)
+        self.assertIsNotNone(self.cache.get("user_case_documents", [1.0, 0.0, 0.0]))
+        self.assertIsNone(self.cache.get("user_case_documents", [0.0, 1.0, 0.0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
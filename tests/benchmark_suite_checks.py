@@ -0,0 +1,28 @@
+import unittest
+
+import numpy as np
+from benchmark_suite import HashingEmbeddings, find_regressions
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+
+    def test_hashing_embeddings_are_deterministic_and_similar_for_shared_words(self):
+        """ Test that the fake embeddings are reproducible and reflect shared words """
+        embeddings = HashingEmbeddings(size=256)
+        query = embeddings.embed_query("primary endpoint of the trial")
+        self.assertEqual(query, HashingEmbeddings(size=256).embed_query("primary endpoint of the trial"))
+        related, unrelated = embeddings.embed_documents(["The primary endpoint is survival.", "Dosing schedule"])
+        self.assertGreater(np.dot(query, related), np.dot(query, unrelated))
+
+    def test_find_regressions(self):
+        """ Test that only slowdowns beyond the tolerance of benchmarks long enough are reported """
+        baseline = {"ingest": {"best_seconds": 1.0}, "search": {"best_seconds": 0.5}, "tiny": {"best_seconds": 0.0001}}
+        results = {"ingest": {"best_seconds": 1.2}, "search": {"best_seconds": 1.0}, "tiny": {"best_seconds": 0.01},
+                   "new": {"best_seconds": 3.0}}
+        regressions = find_regressions(results, baseline, tolerance=0.5)
+        self.assertEqual(list(regressions), ["search"])
+        self.assertEqual(regressions["search"]["slowdown"], 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+import tempfile
+
+from azure.core.exceptions import ResourceNotFoundError, ResourceModifiedError, ResourceExistsError
+from blob_storage import LocalBlobStore
+
+
+class TestLocalBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = LocalBlobStore(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip_and_delete(self):
+        """ Test that blobs are written, read and deleted in memory """
+        self.store.write("user_use_cases_df.pkl", b"data")
+        self.assertEqual(self.store.read("user_use_cases_df.pkl"), b"data")
+        self.store.delete("user_use_cases_df.pkl")
+        self.store.delete("user_use_cases_df.pkl")
+        with self.assertRaises(ResourceNotFoundError):
+            self.store.read("user_use_cases_df.pkl")
+
+    def test_conditional_writes(self):
+        """ Test that a stale ETag or an existing blob rejects the write """
+        etag = self.store.write("blob", b"first", create_only=True)
+        with self.assertRaises(ResourceExistsError):
+            self.store.write("blob", b"again", create_only=True)
+        self.store.write("blob", b"second", if_match=etag)
+        with self.assertRaises(ResourceModifiedError):
+            self.store.write("blob", b"third", if_match=etag)
+        self.assertEqual(self.store.read("blob"), b"second")
+
+    def test_blob_names_cannot_escape_root(self):
+        """ Test that blob names are confined to the store directory """
+        with self.assertRaises(ValueError):
+            self.store.write("../outside", b"data")
+
+
+if __name__ == '__main__':
+    unittest.main()
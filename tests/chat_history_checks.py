@@ -0,0 +1,156 @@
+import os
+import pickle
+import time
+import unittest
+import tempfile
+
+import chat_history
+from azure.core.exceptions import HttpResponseError
+from blob_storage import LocalBlobStore
+from chat_history import ChatHistoryWriter, load_chat_history, load_older_chat_history, append_chat_messages
+from resources import set_resource, registry
+
+
+def turn(question):
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": f"Answer to {question}"}]
+
+
+class TypedBlobStore(LocalBlobStore):
+    """ Local blob store that, like Azure, only appends to append blobs """
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.append_blobs = set()
+
+    def write(self, name, data, if_match=None, create_only=False):
+        etag = super().write(name, data, if_match, create_only)
+        self.append_blobs.discard(name)
+        return etag
+
+    def create_append(self, name, data):
+        super().write(name, data)
+        self.append_blobs.add(name)
+
+    def append(self, name, data):
+        if self.exists(name) and name not in self.append_blobs:
+            raise HttpResponseError(f"InvalidBlobType: {name} is not an append blob")
+        self.append_blobs.add(name)
+        super().append(name, data)
+
+    def delete(self, name):
+        super().delete(name)
+        self.append_blobs.discard(name)
+
+
+class TestChatHistoryLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = TypedBlobStore(self.tmp_dir.name)
+        set_resource("blob_store", self.store)
+        self.page_size = chat_history.CHAT_HISTORY_PAGE_SIZE
+        chat_history.CHAT_HISTORY_PAGE_SIZE = 2
+
+    def tearDown(self):
+        chat_history.CHAT_HISTORY_PAGE_SIZE = self.page_size
+        registry.reset("blob_store")
+        self.tmp_dir.cleanup()
+
+    def test_compacted_log_is_still_appendable(self):
+        """ Test that the log written by a compaction is an append blob, so later turns can be appended """
+        questions = [f"question {index}" for index in range(6)]
+        for question in questions[:2]:
+            append_chat_messages("alice", "trial", turn(question))
+        load_chat_history("alice", "trial")  # Compacts the log of two pages
+        for question in questions[2:]:
+            append_chat_messages("alice", "trial", turn(question))
+        expected = [message for question in questions for message in turn(question)]
+        messages, start = load_chat_history("alice", "trial", limit=4)
+        self.assertEqual((messages, start), (expected[8:], 8))
+        self.assertEqual(load_older_chat_history("alice", "trial", start, limit=8), (expected[:8], 0))
+
+    def test_messages_appended_during_compaction_are_kept(self):
+        """ Test that messages appended to the old log just before it is sealed, or after, end up in the new log """
+        for question in ("dose", "endpoint"):
+            append_chat_messages("alice", "trial", turn(question))
+        stale_index = chat_history._read_index("alice_trial_chat_history")
+        seal = self.store.seal
+
+        def seal_after_late_append(name):
+            # Another session appends between the index switch and the seal
+            self.store.append(name, chat_history._encode(turn("criteria")))
+            seal(name)
+
+        self.store.seal = seal_after_late_append
+        load_chat_history("alice", "trial")
+        self.store.seal = seal
+        # A session that read the index before the compaction appends once it is done
+        read_index = chat_history._read_index
+        reads = [stale_index]
+        chat_history._read_index = lambda prefix: reads.pop() if reads else read_index(prefix)
+        try:
+            append_chat_messages("alice", "trial", turn("safety"))
+        finally:
+            chat_history._read_index = read_index
+        expected = [message for question in ("dose", "endpoint", "criteria", "safety") for message in turn(question)]
+        self.assertEqual(load_chat_history("alice", "trial", limit=8), (expected, 0))
+
+    def test_migrated_log_is_still_appendable(self):
+        """ Test that a pickled chat history is migrated to an append blob """
+        self.store.write("alice_trial_chat_history.pkl", pickle.dumps(turn("dose")))
+        self.assertEqual(load_chat_history("alice", "trial"), (turn("dose"), 0))
+        append_chat_messages("alice", "trial", turn("endpoint"))
+        self.assertEqual(load_chat_history("alice", "trial"), (turn("dose") + turn("endpoint"), 0))
+        self.assertFalse(self.store.exists("alice_trial_chat_history.pkl"))
+
+
+class TestChatHistoryWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        set_resource("blob_store", LocalBlobStore(os.path.join(self.tmp_dir.name, "blobs")))
+        self.journal_path = os.path.join(self.tmp_dir.name, "journal")
+
+    def tearDown(self):
+        registry.reset("blob_store")
+        self.tmp_dir.cleanup()
+
+    def test_pending_writes_are_read_and_stored_in_order(self):
+        """ Test that a session reads its pending writes, which are then stored in the order they were made """
+        writer = ChatHistoryWriter(self.journal_path, workers=2)
+        writer.append("alice", "trial", turn("dose"))
+        writer.clear("alice", "trial")
+        writer.append("alice", "trial", turn("endpoint"))
+        writer.append("alice", "trial", turn("criteria"))
+        self.assertEqual(writer.load("alice", "trial"), (turn("endpoint") + turn("criteria"), 0))
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(load_chat_history("alice", "trial"), (turn("endpoint") + turn("criteria"), 0))
+        self.assertEqual(os.listdir(self.journal_path), [])
+
+    def test_writes_made_while_storing_are_stored_once(self):
+        """ Test that writes made while earlier ones of the same history are being stored are each stored once, in order """
+        writer = ChatHistoryWriter(self.journal_path, workers=4)
+        questions = [f"question {index}" for index in range(40)]
+        for question in questions:
+            writer.append("alice", "trial", turn(question))
+            time.sleep(0.002)
+        self.assertTrue(writer.flush(timeout=30))
+        expected = [message for question in questions for message in turn(question)]
+        self.assertEqual(load_chat_history("alice", "trial", limit=len(expected)), (expected, 0))
+
+    def test_journaled_writes_are_replayed_once(self):
+        """ Test that writes left in the journal are stored by the next writer, without appending them twice """
+        crashed = ChatHistoryWriter(self.journal_path, workers=0)
+        crashed.append("alice", "trial", turn("dose"))
+        crashed.append("alice", "trial", turn("endpoint"))
+        append_chat_messages("alice", "trial", turn("dose"))  # Stored before the crash, but still journaled
+        self.assertEqual(len(os.listdir(self.journal_path)), 2)
+
+        writer = ChatHistoryWriter(self.journal_path, workers=1)
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(load_chat_history("alice", "trial"), (turn("dose") + turn("endpoint"), 0))
+        self.assertEqual(os.listdir(self.journal_path), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from langchain_core.documents import Document
+from context_packing import merge_overlapping_chunks, pack_context
+
+
+TEXT = " ".join(f"Sentence {i} of the protocol describes visit {i} and its assessments." for i in range(100))
+
+
+class TestContextPacking(unittest.TestCase):
+
+    def test_adjacent_chunks_are_merged(self):
+        """ Test that chunks sharing their overlap are merged back into one passage """
+        chunks = [Document(page_content=TEXT[800:1800], metadata={"source": "protocol.pdf"}),
+                  Document(page_content=TEXT[0:1000], metadata={"source": "protocol.pdf"}),
+                  Document(page_content=TEXT[0:1000], metadata={"source": "brochure.pdf"})]
+        passages = merge_overlapping_chunks(chunks)
+        self.assertEqual([passage.page_content for passage in passages], [TEXT[0:1800], TEXT[0:1000]])
+        self.assertEqual(passages[0].metadata["merged_chunks"], 2)
+
+    def test_budget_and_near_duplicates(self):
+        """ Test that near-duplicates are dropped and the budget is respected """
+        chunks = [Document(page_content=TEXT[0:1000], metadata={"source": "protocol.pdf"}),
+                  Document(page_content=TEXT[0:990] + " Amended.", metadata={"source": "amendment.pdf"}),
+                  Document(page_content=TEXT[2000:3000], metadata={"source": "protocol.pdf"})]
+        passages, report = pack_context(chunks, token_budget=600)
+        self.assertEqual([passage.metadata["source"] for passage in passages], ["protocol.pdf", "protocol.pdf"])
+        self.assertLessEqual(report["tokens_after"], 600)
+        self.assertEqual(report["tokens_saved"], report["tokens_before"] - report["tokens_after"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import unittest
+import tempfile
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from blob_storage import LocalBlobStore
+from document_library import DocumentLibrary, document_id, library_collection
+from vector_backends import LocalBackend
+
+
+class CountingEmbeddings(Embeddings):
+    """ Embeds texts by counting a few keywords, and counts the texts it embeds """
+
+    keywords = ["endpoint", "criteria", "dose", "safety"]
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded += texts
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [text.count(keyword) + 0.01 for keyword in self.keywords]
+
+
+def chunks(source, texts):
+    return [Document(page_content=text, metadata={"source": source}) for text in texts]
+
+
+class TestDocumentLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = LocalBackend(os.path.join(self.tmp_dir.name, "vectors"))
+        self.library = DocumentLibrary(LocalBlobStore(os.path.join(self.tmp_dir.name, "blobs")), self.backend)
+        self.embeddings = CountingEmbeddings()
+        self.protocol = document_id(b"protocol v1")
+        self.brochure = document_id(b"brochure")
+        self.library.reference("alice", "trial", [self.protocol])
+        self.library.reference("alice", "safety", [self.protocol, self.brochure])
+        self.library.add_document("alice", self.protocol, "protocol.pdf", "application/pdf", 11,
+                                  chunks("protocol.pdf", ["primary endpoint", "exclusion criteria"]), self.embeddings)
+        self.library.add_document("alice", self.brochure, "brochure.pdf", "application/pdf", 8,
+                                  chunks("brochure.pdf", ["dose escalation", "safety profile"]), self.embeddings)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_documents_are_stored_once_and_reused(self):
+        """ Test that a document shared by use cases is embedded once and no longer reported as missing """
+        self.assertEqual(len(self.embeddings.embedded), 4)
+        self.assertEqual(self.library.missing_documents("alice", [self.protocol, self.brochure]), [])
+        self.assertEqual(self.library.missing_documents("alice", [document_id(b"protocol v2")]), [document_id(b"protocol v2")])
+        self.assertEqual(self.library.documents("alice")[self.protocol]["use_cases"], ["trial", "safety"])
+        self.assertEqual(self.backend.count(library_collection("alice")), 4)
+
+    def test_retrieval_is_restricted_to_the_use_case_documents(self):
+        """ Test that the search filter only returns chunks of the referenced documents """
+        store = self.library.as_vectorstore("alice", self.embeddings)
+        documents = store.similarity_search("dose", k=5, filter=self.library.search_filter(self.library.use_case_documents("alice", "trial")))
+        self.assertEqual({doc.metadata["source"] for doc in documents}, {"protocol.pdf"})
+
+    def test_documents_are_deleted_with_their_last_reference(self):
+        """ Test that vectors are only deleted once no use case references their document """
+        self.assertEqual(self.library.release("alice", "trial"), [])
+        self.assertEqual(self.backend.count(library_collection("alice")), 4)
+        self.assertEqual(self.library.reference("alice", "safety", [self.brochure]), [self.protocol])
+        self.assertEqual(self.backend.count(library_collection("alice")), 2)
+        self.assertIsNone(self.library.use_case_documents("alice", "trial"))
+        self.assertEqual(sorted(self.library.release("alice", "safety")), [self.brochure])
+        self.assertEqual(self.library.documents("alice"), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import os
+import tempfile
+
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+
+
+class CountingEmbeddings:
+    """ Deterministic embedding model that records the texts it embeds """
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append([text])
+        return [float(len(text)), 0.0, 0.5]
+
+
+class TestEmbeddingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = EmbeddingCache(os.path.join(self.tmp_dir.name, "embeddings.sqlite3"), max_entries=3)
+
+    def tearDown(self):
+        self.cache._connection.close()
+        self.tmp_dir.cleanup()
+
+    def test_only_missing_texts_are_embedded(self):
+        """ Test that cached texts are not sent to the model again """
+        model = CountingEmbeddings()
+        embeddings = CachedEmbeddings(model, "deployment", cache=self.cache)
+        first = embeddings.embed_documents(["a", "bb", "a"])
+        second = embeddings.embed_documents(["bb", "ccc"])
+        self.assertEqual(model.calls, [["a", "bb"], ["ccc"]])
+        self.assertEqual(first, [[1.0, 1.0, 0.5], [2.0, 1.0, 0.5], [1.0, 1.0, 0.5]])
+        self.assertEqual(second[0], first[1])
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_namespace_separates_deployments(self):
+        """ Test that vectors of different deployments are cached separately """
+        model = CountingEmbeddings()
+        CachedEmbeddings(model, "deployment-a", cache=self.cache).embed_documents(["a"])
+        CachedEmbeddings(model, "deployment-b", cache=self.cache).embed_documents(["a"])
+        self.assertEqual(len(model.calls), 2)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """ Test that the cache stays within max_entries """
+        embeddings = CachedEmbeddings(CountingEmbeddings(), "deployment", cache=self.cache)
+        embeddings.embed_documents(["a", "b", "c"])
+        embeddings.embed_documents(["a"])
+        embeddings.embed_documents(["d"])
+        stats = self.cache.stats()
+        self.assertEqual(stats["entries"], 3)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertIn(EmbeddingCache.key("a", "deployment"), self.cache.get_many([EmbeddingCache.key("a", "deployment")]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from embedding_scheduler import EmbeddingUpsertEngine, chunk_point_id
+from vector_backends import LocalBackend
+
+
+class ThrottledResponse:
+    status_code = 429
+    headers = {"retry-after-ms": "10"}
+
+
+class RateLimitError(Exception):
+
+    def __init__(self):
+        super().__init__("Too Many Requests")
+        self.response = ThrottledResponse()
+
+
+class RecordingEmbeddings(Embeddings):
+    """ Embeds texts by their length, records the size of each request, and throttles the first ones """
+
+    def __init__(self, throttled=0):
+        self.throttled = throttled
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            if self.throttled:
+                self.throttled -= 1
+                raise RateLimitError()
+            self.batches.append(len(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+
+def chunks(prefix, count):
+    return [Document(page_content=f"{prefix} chunk {index}", metadata={"source": f"{prefix}.pdf"}) for index in range(count)]
+
+
+class TestEmbeddingUpsertEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = LocalBackend(os.path.join(self.tmp_dir.name, "vectors"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_documents_are_embedded_in_batches(self):
+        """ Test that every chunk is embedded once in requests of at most batch_size chunks, and upserted """
+        embeddings = RecordingEmbeddings()
+        progress = []
+        engine = EmbeddingUpsertEngine(self.backend, embeddings, batch_size=4, max_concurrency=2)
+        docs = chunks("protocol", 10)
+        self.assertEqual(engine.run(docs, "trial", progress_callback=lambda *counts: progress.append(counts)), 10)
+        self.assertEqual(sum(embeddings.batches), 10)
+        self.assertLessEqual(max(embeddings.batches), 4)
+        self.assertEqual(progress[-1], (10, 10))
+        self.assertEqual(sorted(self.backend.collection("trial").ids), sorted(chunk_point_id(doc) for doc in docs))
+
+    def test_throttled_batches_are_retried(self):
+        """ Test that throttled requests are retried, shrinking the batch size, and fail once out of retries """
+        embeddings = RecordingEmbeddings(throttled=2)
+        engine = EmbeddingUpsertEngine(self.backend, embeddings, batch_size=16, max_concurrency=1)
+        self.assertEqual(engine.run(chunks("protocol", 40), "trial"), 40)
+        self.assertEqual(sum(embeddings.batches), 40)
+        self.assertEqual(embeddings.batches[0], 16)
+        self.assertLess(min(embeddings.batches), 16)
+
+        engine = EmbeddingUpsertEngine(self.backend, RecordingEmbeddings(throttled=3), max_retries=2)
+        with self.assertRaises(RateLimitError):
+            engine.run(chunks("brochure", 4), "other")
+
+    def test_recreate_replaces_the_collection(self):
+        """ Test that recreating a collection drops its points, even with no documents, unlike adding to it """
+        engine = EmbeddingUpsertEngine(self.backend, RecordingEmbeddings())
+        engine.run(chunks("protocol", 3), "trial")
+        engine.run(chunks("brochure", 2), "trial", recreate=False)
+        self.assertEqual(self.backend.count("trial"), 5)
+        engine.run(chunks("amendment", 2), "trial")
+        self.assertEqual(sorted(self.backend.collection("trial").ids), sorted(map(chunk_point_id, chunks("amendment", 2))))
+        self.assertEqual(engine.run([], "trial"), 0)
+        self.assertFalse(self.backend.collection_exists("trial"))
+        self.assertEqual(self.backend.count("trial"), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
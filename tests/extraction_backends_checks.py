@@ -0,0 +1,28 @@
+import re
+import unittest
+
+from extraction_backends import get_pdf_extractor
+
+
+class TestPdfExtractors(unittest.TestCase):
+
+    def test_extractors_read_the_same_pages(self):
+        """ Test that the fast and layout-aware extractors read the same words from the example brochure """
+        with open("Investigator Brochure.pdf", "rb") as pdf_file:
+            file_bytes = pdf_file.read()
+        words = {}
+        for name in ("pdfplumber", "pdfium"):
+            extractor = get_pdf_extractor(name)
+            with extractor.open(file_bytes) as pdf:
+                self.assertEqual(extractor.page_count(pdf), 3)
+                words[name] = [re.findall(r"[a-zA-Z0-9]+", text) for _, text in extractor.iter_page_texts(pdf, start_page=1)]
+        self.assertEqual(len(words["pdfium"]), 2)
+        self.assertEqual(words["pdfplumber"], words["pdfium"])
+
+    def test_unknown_extractor(self):
+        with self.assertRaises(ValueError):
+            get_pdf_extractor("ocr")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from embedding_scheduler import chunk_point_id
+from incremental_index import sync_source_documents, _group_by_source
+from near_duplicates import collapse_near_duplicates
+from resources import set_resource, registry
+from blob_storage import LocalBlobStore
+from vector_backends import LocalBackend
+
+
+class CountingEmbeddings(Embeddings):
+    """ Embeds texts by their length, and records the texts it embeds """
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded += texts
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+
+def chunks(source, texts):
+    return [Document(page_content=text, metadata={"source": source}) for text in texts]
+
+
+class TestSyncSourceDocuments(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = LocalBackend(os.path.join(self.tmp_dir.name, "vectors"))
+        self.embeddings = CountingEmbeddings()
+        set_resource("vector_backend", self.backend)
+        set_resource("blob_store", LocalBlobStore(os.path.join(self.tmp_dir.name, "blobs")))
+        set_resource("embeddings", self.embeddings)
+        self.protocol = chunks("protocol.pdf", ["primary endpoint", "exclusion criteria", "dose escalation"])
+        self.brochure = chunks("brochure.pdf", ["safety profile", "pharmacokinetics"])
+        sync_source_documents("trial", {"protocol.pdf": self.protocol, "brochure.pdf": self.brochure})
+        self.embeddings.embedded = []
+
+    def tearDown(self):
+        registry.reset("vector_backend")
+        registry.reset("blob_store")
+        registry.reset("embeddings")
+        self.tmp_dir.cleanup()
+
+    def point_ids(self):
+        return sorted(self.backend.collection("trial").ids)
+
+    def test_unchanged_sources_are_skipped(self):
+        """ Test that syncing sources whose chunks are all stored embeds and deletes nothing """
+        before = self.point_ids()
+        summary = sync_source_documents("trial", {"protocol.pdf": self.protocol, "brochure.pdf": self.brochure})
+        self.assertEqual(summary, {"added": 0, "deleted": 0, "unchanged": 5, "repaired": 0})
+        self.assertEqual(self.embeddings.embedded, [])
+        self.assertEqual(self.point_ids(), before)
+
+    def test_removed_source_deletes_only_its_points(self):
+        """ Test that a source mapped to no chunks has its points deleted, and the other sources kept """
+        summary = sync_source_documents("trial", {"protocol.pdf": []})
+        self.assertEqual(summary, {"added": 0, "deleted": 3, "unchanged": 0, "repaired": 0})
+        self.assertEqual(self.point_ids(), sorted(map(chunk_point_id, self.brochure)))
+
+    def test_replaced_source_only_updates_its_changed_chunks(self):
+        """ Test that a new version of a source embeds its new chunks and deletes its old ones, and only those """
+        protocol_v2 = chunks("protocol.pdf", ["primary endpoint", "exclusion criteria", "dose expansion"])
+        summary = sync_source_documents("trial", {"protocol.pdf": protocol_v2})
+        self.assertEqual(summary, {"added": 1, "deleted": 1, "unchanged": 2, "repaired": 0})
+        self.assertEqual(self.embeddings.embedded, ["dose expansion"])
+        self.assertEqual(self.point_ids(), sorted(map(chunk_point_id, protocol_v2 + self.brochure)))
+
+    def test_same_text_in_another_source_is_kept(self):
+        """ Test that removing a source keeps the identical chunks of another source, which have their own points """
+        copy = chunks("protocol copy.pdf", [doc.page_content for doc in self.protocol])
+        self.assertEqual(sync_source_documents("trial", {"protocol copy.pdf": copy})["added"], 3)
+        sync_source_documents("trial", {"protocol.pdf": []})
+        self.assertEqual(self.point_ids(), sorted(map(chunk_point_id, copy + self.brochure)))
+
+
+class TestCrossDocumentDuplicates(unittest.TestCase):
+
+    boilerplate = "This document contains confidential information of the sponsor and must not be disclosed to third parties."
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = LocalBackend(os.path.join(self.tmp_dir.name, "vectors"))
+        set_resource("vector_backend", self.backend)
+        set_resource("blob_store", LocalBlobStore(os.path.join(self.tmp_dir.name, "blobs")))
+        set_resource("embeddings", CountingEmbeddings())
+        docs = chunks("protocol.pdf", [self.boilerplate, "primary endpoint is overall survival"]) + \
+            chunks("amendment.pdf", [self.boilerplate + " ", "the dose is reduced to 20 mg"]) + \
+            chunks("brochure.pdf", [self.boilerplate, "pharmacokinetics of the study drug"])
+        sync_source_documents("trial", _group_by_source(collapse_near_duplicates(docs)))
+
+    def tearDown(self):
+        registry.reset("vector_backend")
+        registry.reset("blob_store")
+        registry.reset("embeddings")
+        self.tmp_dir.cleanup()
+
+    def boilerplate_points(self):
+        return [payload["metadata"] for payload in self.backend.collection("trial").payloads
+                if payload["page_content"].strip() == self.boilerplate]
+
+    def test_duplicates_are_collapsed_across_documents(self):
+        """ Test that a chunk repeated by several documents is stored once, listing the other documents """
+        self.assertEqual(self.backend.count("trial"), 4)
+        [metadata] = self.boilerplate_points()
+        self.assertEqual(metadata["source"], "protocol.pdf")
+        self.assertEqual([provenance["source"] for provenance in metadata["duplicate_sources"]], ["amendment.pdf", "brochure.pdf"])
+
+    def test_removing_the_kept_source_promotes_a_duplicate(self):
+        """ Test that removing the document of a collapsed chunk hands the chunk over to the next document repeating it """
+        summary = sync_source_documents("trial", {"protocol.pdf": []})
+        self.assertEqual(summary, {"added": 0, "deleted": 2, "unchanged": 0, "repaired": 1})
+        [metadata] = self.boilerplate_points()
+        self.assertEqual(metadata["source"], "amendment.pdf")
+        self.assertEqual([provenance["source"] for provenance in metadata["duplicate_sources"]], ["brochure.pdf"])
+        self.assertEqual(len(self.backend.source_point_ids("trial", "amendment.pdf")), 2)
+
+        sync_source_documents("trial", {"amendment.pdf": []})
+        [metadata] = self.boilerplate_points()
+        self.assertEqual(metadata["source"], "brochure.pdf")
+        self.assertNotIn("duplicate_sources", metadata)
+
+    def test_removing_a_duplicate_source_updates_the_kept_chunk(self):
+        """ Test that removing a document whose chunk was collapsed drops it from the kept chunk's sources """
+        sync_source_documents("trial", {"amendment.pdf": []})
+        self.assertEqual(self.backend.count("trial"), 3)
+        [metadata] = self.boilerplate_points()
+        self.assertEqual(metadata["source"], "protocol.pdf")
+        self.assertEqual([provenance["source"] for provenance in metadata["duplicate_sources"]], ["brochure.pdf"])
+
+    def test_replacing_the_kept_source_keeps_the_duplicate(self):
+        """ Test that a new version of a document without the collapsed chunk leaves it to the other documents """
+        sync_source_documents("trial", {"protocol.pdf": chunks("protocol.pdf", ["primary endpoint is overall survival"])})
+        [metadata] = self.boilerplate_points()
+        self.assertEqual(metadata["source"], "amendment.pdf")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import os
+import random
+import tempfile
+import unittest
+
+import document_library
+import ingestion
+import parsed_cache
+from langchain_core.embeddings import Embeddings
+from blob_storage import LocalBlobStore
+from document_library import DocumentLibrary, document_id
+from extraction_backends import get_pdf_extractor
+from ingestion import ingest_files, ingest_into_library, _page_ranges, PDF_MIME_TYPE
+from parsed_cache import ParsedDocumentCache
+from vector_backends import LocalBackend
+from utils import iter_pdf_pages, stream_text_to_documents, text_splitter
+
+
+PDF_FILES = ("Clinical Trial Protocol.pdf", "Investigator Brochure.pdf", "Training Material.pdf")
+
+WORDS = "patients cohort dose level mg day endpoint survival criteria exclusion inclusion randomised".split()
+
+
+def paragraphs(seed, count, max_words):
+    generator = random.Random(seed)
+    return [(number, " ".join(generator.choice(WORDS) for _ in range(generator.randint(5, max_words))) + ".\n")
+            for number in range(1, count + 1)]
+
+
+class TestStreamingSplitter(unittest.TestCase):
+
+    def test_streamed_chunks_match_the_whole_text_split(self):
+        """ Test that splitting a stream of paragraphs gives the chunks of splitting their whole text at once """
+        for seed in range(5):
+            blocks = paragraphs(seed, 80, max_words=120)
+            streamed = list(stream_text_to_documents(blocks, "protocol.docx", "paragraph"))
+            self.assertEqual([doc.page_content for doc in streamed], text_splitter.split_text("".join(text for _, text in blocks)))
+            self.assertEqual([doc.metadata["paragraph"] for doc in streamed],
+                             sorted(doc.metadata["paragraph"] for doc in streamed))
+
+    def test_streamed_pdf_pages_match_the_whole_text_split(self):
+        """ Test that streaming the pages of the bundled PDFs gives the chunks of splitting their whole text at once """
+        for file_name in PDF_FILES:
+            with open(file_name, "rb") as pdf_file:
+                file_bytes = pdf_file.read()
+            for name in ("pdfplumber", "pdfium"):
+                extractor = get_pdf_extractor(name)
+                with extractor.open(file_bytes) as pdf:
+                    pages = list(iter_pdf_pages(pdf, extractor=extractor))
+                streamed = list(stream_text_to_documents(pages, file_name))
+                self.assertEqual([doc.page_content for doc in streamed],
+                                 text_splitter.split_text("".join(text for _, text in pages)), (file_name, name))
+
+    def test_long_paragraphs_are_covered_in_order(self):
+        """ Test that paragraphs longer than a chunk are split into chunks covering the text in order """
+        blocks = paragraphs(0, 40, max_words=600)
+        text = "".join(text for _, text in blocks)
+        position = 0
+        for doc in stream_text_to_documents(blocks, "protocol.docx", "paragraph"):
+            self.assertLessEqual(len(doc.page_content), text_splitter._chunk_size)
+            start = text.find(doc.page_content, max(0, position - text_splitter._chunk_overlap))
+            self.assertGreaterEqual(start, 0)
+            self.assertEqual(text[position:start].strip(), "")
+            position = start + len(doc.page_content)
+        self.assertEqual(text[position:].strip(), "")
+
+    def test_chunks_are_located_in_their_first_block(self):
+        """ Test that each chunk is tagged with the block it starts in """
+        blocks = [(1, "Title page.\n"), (2, "a" * 50 + "\n"), (3, "Endpoint section.\n")]
+        docs = list(stream_text_to_documents(blocks, "protocol.pdf", buffer_size=10))
+        self.assertEqual([(doc.page_content, doc.metadata["page"]) for doc in docs],
+                         [("Title page.\n" + "a" * 50 + "\nEndpoint section.", 1)])
+
+    def test_leading_whitespace_blocks(self):
+        """ Test that a buffer of whitespace only, e.g. thousands of empty paragraphs, is skipped """
+        blocks = [(number, "\n") for number in range(1, 5001)] + [(5001, "Primary endpoint: overall survival.")]
+        docs = list(stream_text_to_documents(blocks, "protocol.docx", "paragraph"))
+        self.assertEqual([(doc.page_content, doc.metadata["paragraph"]) for doc in docs],
+                         [("Primary endpoint: overall survival.", 5001)])
+
+
+class TestPageRangeExtraction(unittest.TestCase):
+
+    def setUp(self):
+        with open("Investigator Brochure.pdf", "rb") as pdf_file:
+            self.file_bytes = pdf_file.read()
+
+    def test_page_ranges_concatenate_to_the_serial_pages(self):
+        """ Test that extracting a PDF in page ranges gives the pages of extracting it in one piece, in order """
+        for name in ("pdfplumber", "pdfium"):
+            extractor = get_pdf_extractor(name)
+            with extractor.open(self.file_bytes) as pdf:
+                serial = list(iter_pdf_pages(pdf, extractor=extractor))
+                for pages_per_task in (1, 2):
+                    ranges = [page for start_page, end_page in _page_ranges(extractor.page_count(pdf), pages_per_task)
+                              for page in iter_pdf_pages(pdf, start_page, end_page, extractor=extractor)]
+                    self.assertEqual(ranges, serial)
+
+    def test_parallel_ingestion_gives_the_serial_chunks(self):
+        """ Test that parsing PDFs in page ranges on several workers gives the chunks of parsing them in one piece """
+        files = []
+        for file_name in PDF_FILES:
+            with open(file_name, "rb") as pdf_file:
+                files.append((file_name, PDF_MIME_TYPE, pdf_file.read()))
+        serial = ingest_files(files, max_workers=1, pages_per_task=0, use_cache=False)
+        for pages_per_task in (1, 2):
+            parallel = ingest_files(files, max_workers=3, pages_per_task=pages_per_task, use_cache=False)
+            self.assertEqual([(doc.page_content, doc.metadata) for doc in parallel],
+                             [(doc.page_content, doc.metadata) for doc in serial])
+
+
+class LengthEmbeddings(Embeddings):
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+
+class TestLibraryIngestion(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        store = LocalBlobStore(os.path.join(self.tmp_dir.name, "blobs"))
+        self.library = DocumentLibrary(store, LocalBackend(os.path.join(self.tmp_dir.name, "vectors")))
+        document_library._document_library = self.library
+        parsed_cache._parsed_document_cache = ParsedDocumentCache(store, local_path=os.path.join(self.tmp_dir.name, "parsed"))
+        self.calls = []
+        self.ingest_files = ingestion.ingest_files
+
+        def recording_ingest_files(files, **kwargs):
+            self.calls.append([file_name for file_name, _, _ in files])
+            return self.ingest_files(files, **kwargs)
+        ingestion.ingest_files = recording_ingest_files
+
+    def tearDown(self):
+        ingestion.ingest_files = self.ingest_files
+        document_library._document_library = None
+        parsed_cache._parsed_document_cache = None
+        self.tmp_dir.cleanup()
+
+    def test_new_files_are_parsed_together(self):
+        """ Test that the new files of a library ingestion are parsed in one call, then stored as separate documents """
+        files = []
+        for file_name in ("Investigator Brochure.pdf", "Clinical Trial Protocol.pdf"):
+            with open(file_name, "rb") as pdf_file:
+                files.append((file_name, PDF_MIME_TYPE, pdf_file.read()))
+        progress = []
+        doc_ids = ingest_into_library("alice", files, LengthEmbeddings(), progress_callback=lambda **counts: progress.append(counts))
+        self.assertEqual(self.calls, [["Investigator Brochure.pdf", "Clinical Trial Protocol.pdf"]])
+        self.assertEqual(doc_ids, [document_id(file_bytes) for _, _, file_bytes in files])
+        documents = self.library.documents("alice")
+        self.assertEqual([documents[doc_id]["name"] for doc_id in doc_ids], ["Investigator Brochure.pdf", "Clinical Trial Protocol.pdf"])
+        for doc_id, (file_name, _, file_bytes) in zip(doc_ids, files):
+            serial = self.ingest_files([(file_name, PDF_MIME_TYPE, file_bytes)], use_cache=False)
+            self.assertEqual(documents[doc_id]["chunks"], len(serial))
+        self.assertEqual(progress[-1]["parsed"], 2)
+        self.assertEqual(progress[-1]["upserted"], sum(documents[doc_id]["chunks"] for doc_id in doc_ids))
+
+        ingest_into_library("alice", files[:1] + [("Protocol copy.pdf", PDF_MIME_TYPE, files[1][2])], LengthEmbeddings())
+        self.assertEqual(len(self.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+
+from blob_storage import LocalBlobStore
+from ingestion_jobs import IngestionJobQueue
+
+
+class ScriptedJobQueue(IngestionJobQueue):
+    """ Job queue whose jobs fail a given number of times, each attempt lasting a given time """
+
+    def __init__(self, store, failures=0, duration=0.0, executions=None, **kwargs):
+        super().__init__(store, **kwargs)
+        self.failures = failures
+        self.duration = duration
+        self.executions = executions if executions is not None else []
+        self._executions_lock = threading.Lock()
+
+    def _execute(self, job):
+        with self._executions_lock:
+            self.executions.append((job["id"], time.monotonic()))
+            attempt = len(self.executions)
+        time.sleep(self.duration)
+        if attempt <= self.failures:
+            raise RuntimeError(f"attempt {attempt} failed")
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.02)
+
+
+class TestIngestionJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = LocalBlobStore(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_interrupted_job(self, status="running", heartbeat=0.0):
+        job = {"id": "job1", "user_id": "alice", "use_case_name": "trial", "files": [], "library_documents": [],
+               "status": status, "progress": {}, "attempts": 1, "error": None, "created_at": 0.0, "heartbeat": heartbeat}
+        self.store.write("alice_ingestion_jobs.json", json.dumps({"job1": job}).encode("utf-8"))
+
+    def status(self, queue):
+        return {job["id"]: job["status"] for job in queue.jobs("alice")}
+
+    def test_failed_attempts_are_retried_with_backoff(self):
+        """ Test that a failing job is retried after delays doubling with every attempt """
+        queue = ScriptedJobQueue(self.store, failures=2, retry_seconds=0.2, revalidate_seconds=0)
+        job_id = queue.submit("alice", "trial", [], [])
+        wait_for(lambda: self.status(queue)[job_id] == "succeeded")
+        times = [start for _, start in queue.executions]
+        self.assertEqual(len(times), 3)
+        self.assertGreaterEqual(times[1] - times[0], 0.2)
+        self.assertGreaterEqual(times[2] - times[1], 0.4)
+        self.assertEqual(queue.jobs("alice")[0]["attempts"], 3)
+
+    def test_stale_job_is_claimed_by_one_process(self):
+        """ Test that a job interrupted by a crash is resumed by exactly one of the processes listing it """
+        self.write_interrupted_job()
+        executions = []
+        queues = [ScriptedJobQueue(self.store, duration=0.5, executions=executions, revalidate_seconds=0)
+                  for _ in range(4)]
+        threads = [threading.Thread(target=queue.jobs, args=("alice",)) for queue in queues]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wait_for(lambda: self.status(queues[0])["job1"] == "succeeded")
+        self.assertEqual([job_id for job_id, _ in executions], ["job1"])
+
+    def test_heartbeat_keeps_long_attempts_claimed(self):
+        """ Test that a job busy without reporting progress for longer than the stale delay is not resumed elsewhere """
+        executions = []
+        running = ScriptedJobQueue(self.store, duration=1.5, executions=executions, stale_seconds=0.4, revalidate_seconds=0)
+        other = ScriptedJobQueue(self.store, executions=executions, stale_seconds=0.4, revalidate_seconds=0)
+        job_id = running.submit("alice", "trial", [], [])
+        while self.status(running)[job_id] != "succeeded":
+            self.assertIn(self.status(other)[job_id], ("queued", "running", "succeeded"))
+            time.sleep(0.1)
+        self.assertEqual(len(executions), 1)
+
+    def test_queued_jobs_keep_their_claim(self):
+        """ Test that jobs waiting for a free worker for longer than the stale delay are not resumed elsewhere """
+        executions = []
+        running = ScriptedJobQueue(self.store, max_workers=1, duration=1.0, executions=executions,
+                                   stale_seconds=0.4, revalidate_seconds=0)
+        other = ScriptedJobQueue(self.store, executions=executions, stale_seconds=0.4, revalidate_seconds=0)
+        job_ids = [running.submit("alice", "trial", [], []), running.submit("alice", "safety", [], [])]
+        while any(self.status(running)[job_id] != "succeeded" for job_id in job_ids):
+            other.jobs("alice")
+            time.sleep(0.1)
+        self.assertEqual(sorted(job_id for job_id, _ in executions), sorted(job_ids))
+
+    def test_failed_job_is_retried_once(self):
+        """ Test that retrying a failed job resumes it, and that retrying it again meanwhile does nothing """
+        self.write_interrupted_job(status="failed", heartbeat=time.time())
+        queue = ScriptedJobQueue(self.store, duration=0.3, revalidate_seconds=0)
+        self.assertEqual(self.status(queue), {"job1": "failed"})
+        queue.retry("alice", "job1")
+        ScriptedJobQueue(self.store).retry("alice", "job1")
+        wait_for(lambda: self.status(queue)["job1"] == "succeeded")
+        self.assertEqual(len(queue.executions), 1)
+
+    def test_job_states_are_revalidated_after_a_delay(self):
+        """ Test that listing jobs reuses the jobs last read until revalidate_seconds have passed """
+        queue = ScriptedJobQueue(self.store, revalidate_seconds=0.3)
+        self.assertEqual(self.status(queue), {})
+        self.write_interrupted_job(status="failed")
+        self.assertEqual(self.status(queue), {})
+        time.sleep(0.3)
+        self.assertEqual(self.status(queue), {"job1": "failed"})
+
+
+if __name__ == '__main__':
+    unittest.main()
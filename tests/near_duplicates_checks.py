@@ -0,0 +1,41 @@
+import unittest
+
+from langchain_core.documents import Document
+from near_duplicates import collapse_near_duplicates, collapse_near_duplicates_within_sources
+
+
+SECTION = " ".join(f"Patients in cohort {i} receive dose level {i * 10} mg on day {i + 1}." for i in range(30))
+
+
+class TestNearDuplicates(unittest.TestCase):
+
+    def test_near_duplicates_are_collapsed_with_provenance(self):
+        """ Test that an amended copy of a chunk is collapsed into the original """
+        chunks = [Document(page_content=SECTION, metadata={"source": "protocol.pdf", "page": 3}),
+                  Document(page_content=SECTION.replace("day 5.", "day 6."), metadata={"source": "amendment.pdf", "page": 1}),
+                  Document(page_content="Exclusion criteria: prior treatment with any investigational drug.",
+                           metadata={"source": "amendment.pdf", "page": 2})]
+        kept = collapse_near_duplicates(chunks, threshold=0.8)
+        self.assertEqual([doc.metadata["source"] for doc in kept], ["protocol.pdf", "amendment.pdf"])
+        self.assertEqual(kept[0].metadata["duplicate_sources"], [{"source": "amendment.pdf", "page": 1}])
+
+    def test_sources_are_collapsed_separately(self):
+        """ Test that chunks are only collapsed into chunks of their own source """
+        chunks = [Document(page_content=SECTION, metadata={"source": "protocol.pdf", "page": 3}),
+                  Document(page_content=SECTION, metadata={"source": "amendment.pdf", "page": 1}),
+                  Document(page_content=SECTION.replace("day 5.", "day 6."), metadata={"source": "protocol.pdf", "page": 9})]
+        kept = collapse_near_duplicates_within_sources(chunks, threshold=0.8)
+        self.assertEqual([(doc.metadata["source"], doc.metadata["page"]) for doc in kept],
+                         [("protocol.pdf", 3), ("amendment.pdf", 1)])
+        self.assertEqual(kept[0].metadata["duplicate_sources"], [{"source": "protocol.pdf", "page": 9}])
+        self.assertNotIn("duplicate_sources", kept[1].metadata)
+
+    def test_threshold_zero_disables(self):
+        """ Test that a threshold of 0 keeps every chunk """
+        chunks = [Document(page_content=SECTION, metadata={"source": "a.pdf"}),
+                  Document(page_content=SECTION, metadata={"source": "b.pdf"})]
+        self.assertEqual(len(collapse_near_duplicates(chunks, threshold=0)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import unittest
+import tempfile
+
+from langchain_core.documents import Document
+from blob_storage import LocalBlobStore
+from parsed_cache import ParsedDocumentCache
+
+
+class TestParsedDocumentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = LocalBlobStore(os.path.join(self.tmp_dir.name, "blobs"))
+        self.local_path = os.path.join(self.tmp_dir.name, "local")
+        self.cache = ParsedDocumentCache(self.store, self.local_path)
+        self.docs = [Document(page_content="Primary endpoint", metadata={"source": "protocol.pdf", "page": 1})]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_blob_tier_serves_other_processes(self):
+        """ Test that an artifact is found through the blob tier, under the name of the new upload """
+        key = self.cache.key(b"%PDF", "application/pdf", {"chunk_size": 1000})
+        self.cache.put(key, self.docs)
+        other_cache = ParsedDocumentCache(self.store, os.path.join(self.tmp_dir.name, "other"))
+        docs = other_cache.get(key, "renamed.pdf")
+        self.assertEqual(docs[0].page_content, "Primary endpoint")
+        self.assertEqual(docs[0].metadata, {"source": "renamed.pdf", "page": 1})
+        self.assertIsNone(other_cache.get(self.cache.key(b"%PDF", "application/pdf", {"chunk_size": 500}), "protocol.pdf"))
+
+    def test_least_recently_used_artifacts_are_evicted(self):
+        """ Test that both tiers stay under their size limits """
+        cache = ParsedDocumentCache(self.store, self.local_path, local_max_bytes=200, blob_max_bytes=200)
+        keys = [cache.key(str(i).encode(), "application/pdf", {}) for i in range(3)]
+        for key in keys:
+            cache.put(key, self.docs * 2)
+        self.assertEqual(len(os.listdir(self.local_path)), 2)
+        self.assertIsNone(cache.get(keys[0], "protocol.pdf"))
+        self.assertIsNotNone(cache.get(keys[2], "protocol.pdf"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import unittest
+
+import qa_engine
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from qa_engine import RetrievalQAEngine, get_qa_engine
+from resources import set_resource, registry
+from vector_backends import LocalBackend
+
+
+class RecordingModel:
+    """ Chat model answering with a fixed text, and recording its prompts """
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.prompts = []
+
+    def invoke(self, prompt, config=None):
+        self.prompts.append(prompt)
+        return AIMessage(content=self.answer)
+
+
+class RecordingEmbeddings:
+
+    def embed_query(self, text):
+        return [1.0, float(len(text))]
+
+
+class RecordingVectorStore:
+    """ Vector store returning the same chunk for any query, and recording the queries it embeds """
+
+    def __init__(self):
+        self.embeddings = RecordingEmbeddings()
+        self.queries = []
+
+    def similarity_search_by_vector(self, vector, **kwargs):
+        self.queries.append(vector)
+        return [Document(page_content="The cohort received 10 mg of the study drug.", metadata={"source": "protocol.pdf"})]
+
+
+HISTORY = [("What was the starting dose?", "The starting dose was 10 mg.")]
+
+
+class TestRetrievalQAEngine(unittest.TestCase):
+
+    def engine(self, condense_mode):
+        self.vectorstore = RecordingVectorStore()
+        self.model = RecordingModel("What was the maximum dose of the study drug?")
+        self.answer_model = RecordingModel("The maximum dose was 40 mg.")
+        return RetrievalQAEngine(self.vectorstore, self.model, self.answer_model, condense_mode=condense_mode)
+
+    def test_standalone_questions_are_not_condensed(self):
+        """ Test that a question standing on its own is answered with a single LLM call """
+        engine = self.engine("auto")
+        answer = engine.answer("What were the inclusion criteria of the study?", HISTORY, 1)
+        self.assertEqual(answer["answer"], "The maximum dose was 40 mg.")
+        self.assertEqual(answer["question"], "What were the inclusion criteria of the study?")
+        self.assertEqual(self.model.prompts, [])
+        self.assertEqual(len(self.answer_model.prompts), 1)
+
+    def test_follow_up_questions_are_condensed_before_retrieval(self):
+        """ Test that a follow-up question is rewritten with the history, and the rewrite used to retrieve and answer """
+        engine = self.engine("auto")
+        answer = engine.answer("And what was its maximum?", HISTORY, 1)
+        self.assertEqual(len(self.model.prompts), 1)
+        self.assertIn("What was the starting dose?", self.model.prompts[0])
+        self.assertEqual(answer["question"], "What was the maximum dose of the study drug?")
+        self.assertEqual(self.vectorstore.queries, [RecordingEmbeddings().embed_query(answer["question"])])
+        self.assertIn(answer["question"], self.answer_model.prompts[0])
+
+    def test_speculative_retrieval_uses_the_last_question(self):
+        """ Test that speculative mode retrieves with the last and the new question while condensing """
+        engine = self.engine("speculative")
+        answer = engine.answer("And what was its maximum?", HISTORY, 1)
+        self.assertEqual(len(self.model.prompts), 1)
+        self.assertEqual(self.vectorstore.queries,
+                         [RecordingEmbeddings().embed_query("What was the starting dose?\nAnd what was its maximum?")])
+        self.assertEqual(answer["question"], "What was the maximum dose of the study drug?")
+
+    def test_always_mode_condenses_with_any_history(self):
+        """ Test that "always" mode condenses standalone questions when there is a history, and not without one """
+        engine = self.engine("always")
+        engine.answer("What were the inclusion criteria of the study?", HISTORY, 1)
+        self.assertEqual(len(self.model.prompts), 1)
+        engine.answer("What were the inclusion criteria of the study?", [], 1)
+        self.assertEqual(len(self.model.prompts), 1)
+
+
+class TestQAEngineCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        set_resource("vector_backend", LocalBackend(os.path.join(self.tmp_dir.name, "vectors")))
+        set_resource("embeddings", RecordingEmbeddings())
+        set_resource("chat_model", RecordingModel("condensed"))
+        set_resource("streaming_chat_model", RecordingModel("answer"))
+        self.cache_size = qa_engine.QA_ENGINE_CACHE_SIZE
+        qa_engine.QA_ENGINE_CACHE_SIZE = 2
+        qa_engine._qa_engines.clear()
+
+    def tearDown(self):
+        qa_engine.QA_ENGINE_CACHE_SIZE = self.cache_size
+        qa_engine._qa_engines.clear()
+        for name in ("vector_backend", "embeddings", "chat_model", "streaming_chat_model"):
+            registry.reset(name)
+        self.tmp_dir.cleanup()
+
+    def test_engines_are_reused_and_least_recently_used_dropped(self):
+        """ Test that an engine is shared while it is among the most recently used ones, and then dropped """
+        trial = get_qa_engine("alice_trial_documents")
+        safety = get_qa_engine("alice_safety_documents")
+        self.assertIs(get_qa_engine("alice_trial_documents"), trial)
+        get_qa_engine("bob_trial_documents")  # Drops the safety engine, used less recently than the trial one
+        self.assertEqual(list(qa_engine._qa_engines), ["alice_trial_documents", "bob_trial_documents"])
+        self.assertIs(get_qa_engine("alice_trial_documents"), trial)
+        self.assertIsNot(get_qa_engine("alice_safety_documents"), safety)
+        self.assertEqual(len(qa_engine._qa_engines), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
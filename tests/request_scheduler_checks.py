@@ -0,0 +1,134 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from embedding_scheduler import EmbeddingUpsertEngine
+from vector_backends import LocalBackend
+from request_scheduler import DeploymentScheduler, ScheduledChatModel, ScheduledEmbeddings, request_user
+
+
+class SlowEmbeddings(Embeddings):
+    """ Embeds texts by their length, slowly, and counts its calls """
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        time.sleep(0.2)
+        return [float(len(text))]
+
+
+class SlowStreamingModel:
+    """ Streams the words of a fixed answer to the callbacks of each call, and counts its calls """
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = 0
+
+    def invoke(self, prompt, config=None):
+        self.calls += 1
+        for word in self.answer.split():
+            time.sleep(0.05)
+            for callback in config["callbacks"]:
+                callback.on_llm_new_token(word + " ")
+        return self.answer
+
+
+class TokenRecorder:
+
+    def __init__(self):
+        self.text = ""
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.text += token
+
+
+def run_concurrently(functions):
+    results = [None] * len(functions)
+
+    def run(index):
+        results[index] = functions[index]()
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(functions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestRequestScheduler(unittest.TestCase):
+
+    def test_identical_requests_are_sent_once(self):
+        """ Test that concurrent identical embedding requests share one call to the deployment """
+        embeddings = SlowEmbeddings()
+        scheduled = ScheduledEmbeddings(embeddings, DeploymentScheduler("embeddings", max_concurrency=2))
+        results = run_concurrently([lambda: scheduled.embed_query("primary endpoint")] * 6
+                                   + [lambda: scheduled.embed_query("dose")])
+        self.assertEqual(results, [[16.0]] * 6 + [[4.0]])
+        self.assertEqual(embeddings.calls, 2)
+
+    def test_coalesced_answers_are_streamed_to_every_caller(self):
+        """ Test that a caller joining a streamed chat request receives all its tokens """
+        model = SlowStreamingModel("the primary endpoint is overall survival")
+        scheduled = ScheduledChatModel(model, DeploymentScheduler("chat"))
+        recorders = [TokenRecorder(), TokenRecorder()]
+
+        def ask(recorder, delay):
+            time.sleep(delay)
+            return scheduled.invoke("What is the primary endpoint?", config={"callbacks": [recorder]})
+        results = run_concurrently([lambda: ask(recorders[0], 0), lambda: ask(recorders[1], 0.12)])
+        self.assertEqual(model.calls, 1)
+        self.assertEqual(results, [model.answer] * 2)
+        self.assertEqual([recorder.text.strip() for recorder in recorders], [model.answer] * 2)
+
+    def test_users_are_admitted_round_robin(self):
+        """ Test that queued requests are admitted alternately across users, and in order for each user """
+        scheduler = DeploymentScheduler("chat", max_concurrency=1)
+        admitted = []
+        release = threading.Event()
+
+        def send(user_id, label):
+            with request_user(user_id), scheduler.admitted(tokens=10):
+                admitted.append(label)
+                release.wait()
+
+        threads = [threading.Thread(target=send, args=("alice", "alice-0"))]
+        threads[0].start()
+        while not admitted:
+            time.sleep(0.01)
+        for user_id, label in [("alice", "alice-1"), ("alice", "alice-2"), ("bob", "bob-1")]:
+            threads.append(threading.Thread(target=send, args=(user_id, label)))
+            threads[-1].start()
+            while scheduler.queue_depth() < len(threads) - 1:
+                time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(admitted, ["alice-0", "alice-1", "bob-1", "alice-2"])
+
+    def test_ingestion_is_charged_once_to_the_deployment_budget(self):
+        """ Test that the embedding engine's token budget is charged apart from the deployment's, which it leaves unchanged """
+        scheduler = DeploymentScheduler("embeddings", tokens_per_minute=100000)
+        scheduled = ScheduledEmbeddings(SlowEmbeddings(), scheduler)
+        docs = [Document(page_content=str(index) * 4000, metadata={"source": f"doc{index}.pdf"}) for index in range(4)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = EmbeddingUpsertEngine(LocalBackend(os.path.join(tmp_dir, "vectors")), scheduled,
+                                           batch_size=2, tokens_per_minute=6000)
+            self.assertEqual(engine.run(docs, "alice_trial_documents"), 4)
+        self.assertEqual(scheduler.rate_limiter.tokens_per_minute, 100000)
+        # The 4000 tokens of the chunks leave about 2000 of the engine's budget, plus the little refilled meanwhile
+        self.assertGreater(engine.rate_limiter.try_acquire(2800), 0)
+        self.assertEqual(engine.rate_limiter.try_acquire(1500), 0)
+        # and were taken once from the deployment's budget
+        self.assertEqual(scheduler.rate_limiter.try_acquire(95000), 0)
+
+if __name__ == '__main__':
+    unittest.main()
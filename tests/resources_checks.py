@@ -0,0 +1,48 @@
+import threading
+import time
+import unittest
+
+from resources import ResourceRegistry
+
+
+class TestResourceRegistry(unittest.TestCase):
+
+    def test_resource_is_created_once_on_first_use(self):
+        """ Test that concurrent first uses share one lazily created resource """
+        registry = ResourceRegistry()
+        created = []
+
+        def factory():
+            time.sleep(0.05)
+            created.append(object())
+            return created[-1]
+
+        registry.register("client", factory)
+        self.assertEqual(created, [])
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get("client"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(created), 1)
+        self.assertTrue(all(result is created[0] for result in results))
+        self.assertGreaterEqual(registry.startup_report()["resources"]["client"]["init_seconds"], 0.05)
+
+    def test_set_and_reset(self):
+        """ Test that a resource can be replaced by a stand-in and recreated """
+        registry = ResourceRegistry()
+        registry.register("client", lambda: "real")
+        registry.set("client", "fake")
+        self.assertEqual(registry.get("client"), "fake")
+        registry.reset("client")
+        self.assertEqual(registry.get("client"), "real")
+
+    def test_unregistered_resource(self):
+        """ Test that unknown resources are reported """
+        with self.assertRaises(KeyError):
+            ResourceRegistry().get("missing")
+
+
+if __name__ == '__main__':
+    unittest.main()
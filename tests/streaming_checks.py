@@ -0,0 +1,35 @@
+import unittest
+
+from streaming import StreamingAnswerHandler
+
+
+class RecordingPlaceholder:
+    """ Stand-in for st.empty() recording what is rendered """
+
+    def __init__(self):
+        self.renders = []
+
+    def markdown(self, text):
+        self.renders.append(text)
+
+
+class TestStreamingAnswerHandler(unittest.TestCase):
+
+    def test_tokens_are_rendered_as_they_arrive(self):
+        """ Test that each token updates the placeholder and the final answer replaces the cursor """
+        placeholder = RecordingPlaceholder()
+        handler = StreamingAnswerHandler(placeholder)
+        handler.on_llm_end(None)  # Condensing the question does not stream
+        self.assertIsNone(handler.total_time)
+        for token in ["The", " primary", " endpoint"]:
+            handler.on_llm_new_token(token)
+        handler.on_llm_end(None)
+        timings = handler.finish("The primary endpoint\n\nSources:\n- protocol.pdf")
+
+        self.assertEqual(placeholder.renders[:3], ["The | ", "The primary | ", "The primary endpoint | "])
+        self.assertEqual(placeholder.renders[-1], "The primary endpoint\n\nSources:\n- protocol.pdf")
+        self.assertLessEqual(timings["time_to_first_token"], timings["total_time"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import MetricsRegistry, start_trace, span, propagate, metrics
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_trace_breakdown_nests_spans_across_threads(self):
+        """ Test that spans, including those of propagated threads, are nested in the trace """
+        def search():
+            with span("vector_search"):
+                pass
+
+        with start_trace("chat_page") as trace:
+            with span("retrieve"):
+                with span("embed_query"):
+                    pass
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    executor.submit(propagate(search)).result()
+            with span("answer", model="chat") as attributes:
+                attributes["tokens"] = 12
+        rows = trace.breakdown()
+        self.assertEqual([(row["stage"], row["depth"]) for row in rows],
+                         [("chat_page", 0), ("retrieve", 1), ("embed_query", 2), ("vector_search", 2), ("answer", 1)])
+        self.assertEqual(rows[-1]["attributes"], {"model": "chat", "tokens": 12})
+        self.assertGreaterEqual(rows[0]["duration_ms"], rows[1]["duration_ms"])
+
+    def test_span_records_errors_and_durations(self):
+        """ Test that failing stages are recorded with their error """
+        with start_trace("job") as trace:
+            with self.assertRaises(ValueError):
+                with span("parse"):
+                    raise ValueError("bad file")
+        self.assertEqual(trace.breakdown()[1]["attributes"], {"error": "ValueError"})
+        self.assertIn('biorag_stage_duration_seconds_count{stage="parse"}', metrics.prometheus_text())
+
+    def test_prometheus_text(self):
+        """ Test the Prometheus exposition of counters and cumulative histogram buckets """
+        registry = MetricsRegistry()
+        registry.increment("blob_bytes_total", 100, direction="read")
+        registry.increment("blob_bytes_total", 50, direction="read")
+        registry.observe("stage_duration_seconds", 0.02, stage="answer")
+        registry.observe("stage_duration_seconds", 3, stage="answer")
+        text = registry.prometheus_text()
+        self.assertIn("# TYPE biorag_blob_bytes_total counter", text)
+        self.assertIn('biorag_blob_bytes_total{direction="read"} 150', text)
+        self.assertIn('biorag_stage_duration_seconds_bucket{stage="answer",le="0.025"} 1', text)
+        self.assertIn('biorag_stage_duration_seconds_bucket{stage="answer",le="+Inf"} 2', text)
+        self.assertIn('biorag_stage_duration_seconds_count{stage="answer"} 2', text)
+
+    def test_prometheus_label_values_are_escaped(self):
+        """ Test that backslashes, double quotes and line feeds in label values are escaped """
+        registry = MetricsRegistry()
+        registry.increment("blob_reads_total", blob='alice "trial"\\notes\n.json')
+        self.assertIn('biorag_blob_reads_total{blob="alice \\"trial\\"\\\\notes\\n.json"} 1', registry.prometheus_text())
+
+    def test_otlp_metrics(self):
+        """ Test that histograms are exported with per-bucket counts """
+        registry = MetricsRegistry()
+        registry.observe("stage_duration_seconds", 0.02, stage="answer")
+        metric = registry.otlp_metrics()["resourceMetrics"][0]["scopeMetrics"][0]["metrics"][0]
+        point = metric["histogram"]["dataPoints"][0]
+        self.assertEqual(point["count"], "1")
+        self.assertEqual(len(point["bucketCounts"]), len(point["explicitBounds"]) + 1)
+        self.assertEqual(point["attributes"], [{"key": "stage", "value": {"stringValue": "answer"}}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import tempfile
+
+from blob_storage import LocalBlobStore
+from use_case_catalog import UseCaseCatalog
+
+
+class CountingBlobStore(LocalBlobStore):
+    """ Local blob store counting the blobs it downloads """
+
+    downloads = 0
+
+    def read_with_etag(self, name):
+        data, etag = super().read_with_etag(name)
+        self.downloads += 1
+        return data, etag
+
+    def read_if_changed(self, name, etag):
+        data, current_etag = LocalBlobStore.read_with_etag(self, name)
+        if current_etag == etag:
+            return None, etag
+        self.downloads += 1
+        return data, current_etag
+
+
+class TestUseCaseCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = CountingBlobStore(self.tmp_dir.name)
+        self.catalog = UseCaseCatalog(self.store, revalidate_seconds=0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def add(self, catalog, name, documents):
+        def update(temp_df):
+            temp_df.loc[len(temp_df)] = {"Use Case Name": name, "Use Case Documents": ", ".join(documents)}
+            return temp_df
+        catalog.update("user", update)
+
+    def test_unchanged_dataframe_is_not_downloaded_again(self):
+        """ Test that revalidating an unchanged DataFrame does not download it """
+        self.add(self.catalog, "case", ["protocol.pdf", "brochure.pdf"])
+        downloads = self.store.downloads
+        for _ in range(3):
+            self.assertEqual(self.catalog.get_documents("user", "case"), ["protocol.pdf", "brochure.pdf"])
+        self.assertEqual(self.store.downloads, downloads)
+        self.assertEqual(self.catalog.get_documents("user", "missing"), [])
+
+    def test_changes_from_another_process_are_picked_up(self):
+        """ Test that a DataFrame updated through another catalog is downloaded on revalidation """
+        self.add(self.catalog, "first", ["a.pdf"])
+        other_catalog = UseCaseCatalog(self.store, revalidate_seconds=0)
+        self.add(other_catalog, "second", ["b.pdf"])
+        self.assertEqual(self.catalog.get_dataframe("user")["Use Case Name"].tolist(), ["first", "second"])
+        self.assertEqual(self.catalog.get_documents("user", "second"), ["b.pdf"])
+
+
+if __name__ == '__main__':
+    unittest.main()
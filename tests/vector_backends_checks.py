@@ -0,0 +1,154 @@
+import os
+import unittest
+import tempfile
+
+import numpy as np
+import vector_backends
+
+from langchain_core.embeddings import Embeddings
+from qdrant_client import QdrantClient
+from vector_backends import LocalBackend, QdrantBackend, SharedQdrantBackend
+from migrate_collections import migrate_collection
+
+
+class KeywordEmbeddings(Embeddings):
+    """ Embeds texts by counting a few keywords, so similar texts get similar vectors """
+
+    keywords = ["endpoint", "criteria", "dose", "safety"]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [text.count(keyword) + 0.01 for keyword in self.keywords]
+
+
+class TestLocalBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = LocalBackend(self.tmp_dir.name)
+        self.backend.create_collection("user_case_documents", 4)
+        self.store = self.backend.as_vectorstore("user_case_documents", KeywordEmbeddings())
+        self.store.add_texts(["primary endpoint", "exclusion criteria", "dose escalation"],
+                             metadatas=[{"source": "protocol.pdf"}, {"source": "protocol.pdf"}, {"source": "brochure.pdf"}],
+                             ids=["a", "b", "c"])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_retriever_returns_most_similar_document(self):
+        """ Test that the retriever interface used by the Chatbot works on the local backend """
+        retriever = self.store.as_retriever(search_kwargs={"k": 20, "score_threshold": 0.6})
+        documents = retriever.invoke("what is the endpoint")
+        self.assertEqual([doc.page_content for doc in documents], ["primary endpoint"])
+        self.assertEqual(documents[0].metadata["source"], "protocol.pdf")
+
+    def test_filter_and_delete(self):
+        """ Test metadata filters and deleting the points of a source """
+        documents = self.store.similarity_search("dose", k=5, filter={"source": "protocol.pdf"})
+        self.assertEqual({doc.page_content for doc in documents}, {"primary endpoint", "exclusion criteria"})
+        self.backend.delete("user_case_documents", self.backend.source_point_ids("user_case_documents", "protocol.pdf"))
+        self.assertEqual(self.backend.count("user_case_documents"), 1)
+
+    def test_collections_persist_across_backends(self):
+        """ Test that a collection is reloaded from its memory-mapped files """
+        reloaded = LocalBackend(self.tmp_dir.name)
+        self.assertEqual(reloaded.count("user_case_documents"), 3)
+        self.assertEqual(reloaded.source_point_ids("user_case_documents", "brochure.pdf"), {"c"})
+
+    def test_upserts_append_to_the_collection_files(self):
+        """ Test that upserted batches are written in place, and reloaded with updated points replaced """
+        vectors_path = os.path.join(self.backend._path("user_case_documents"), "vectors.npy")
+        inode = os.stat(vectors_path).st_ino
+        minimum = vector_backends._MIN_LOGGED_POINTS
+        vector_backends._MIN_LOGGED_POINTS = 4
+        try:
+            for batch in range(4):
+                self.store.add_texts([f"safety report {batch}", f"dose cohort {batch}"],
+                                     metadatas=[{"source": f"report{batch}.pdf"}] * 2, ids=[f"r{batch}", f"d{batch}"])
+        finally:
+            vector_backends._MIN_LOGGED_POINTS = minimum
+        self.store.add_texts(["primary endpoint and safety"], metadatas=[{"source": "amendment.pdf"}], ids=["a"])
+        self.assertEqual(os.stat(vectors_path).st_ino, inode)
+
+        reloaded = LocalBackend(self.tmp_dir.name)
+        self.assertEqual(reloaded.count("user_case_documents"), 11)
+        self.assertEqual(reloaded.source_point_ids("user_case_documents", "amendment.pdf"), {"a"})
+        documents = reloaded.as_vectorstore("user_case_documents", KeywordEmbeddings()).similarity_search("safety", k=1,
+                                                                                                           filter={"source": "amendment.pdf"})
+        self.assertEqual([doc.page_content for doc in documents], ["primary endpoint and safety"])
+        self.assertEqual(np.array(reloaded.collection("user_case_documents").vectors).tolist(),
+                         np.array(self.backend.collection("user_case_documents").vectors).tolist())
+
+    def test_interrupted_upsert_is_ignored(self):
+        """ Test that vectors and a log line left by an upsert cut short are ignored on reload """
+        self.store.add_texts(["safety report"], metadatas=[{"source": "report.pdf"}], ids=["d"])
+        path = self.backend._path("user_case_documents")
+        with open(os.path.join(path, "points.log"), "ab") as log_file:
+            log_file.write(b'["e", {"page_content": "dose')
+        self.backend.collection("user_case_documents")._append_rows(np.ones((1, 4), np.float32))
+        reloaded = LocalBackend(self.tmp_dir.name)
+        self.assertEqual(reloaded.count("user_case_documents"), 4)
+        self.assertEqual(len(reloaded.collection("user_case_documents").vectors), 4)
+        reloaded.upsert("user_case_documents", ["f"], [[0, 0, 1, 0]], [{"page_content": "dose", "metadata": {"source": "f.pdf"}}])
+        self.assertEqual(LocalBackend(self.tmp_dir.name).source_point_ids("user_case_documents", "f.pdf"), {"f"})
+
+
+class TestSharedQdrantBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.client = QdrantClient(":memory:")
+        self.backend = SharedQdrantBackend(self.client, "shared_documents", shards=2)
+        for tenant in ["alice_trial_documents", "bob_trial_documents"]:
+            self.backend.create_collection(tenant, 4)
+            self.backend.upsert(tenant, ["a", "b"], [[1, 0, 0, 0], [0, 1, 0, 0]],
+                                [{"metadata": {"source": "protocol.pdf"}}, {"metadata": {"source": "brochure.pdf"}}])
+
+    def test_tenants_are_isolated(self):
+        """ Test that use cases sharing chunk IDs neither collide nor see each other's points """
+        self.assertEqual(self.backend.count("alice_trial_documents"), 2)
+        self.assertEqual(self.backend.source_point_ids("bob_trial_documents", "protocol.pdf"), {"a"})
+        self.backend.delete_collection("alice_trial_documents")
+        self.assertFalse(self.backend.collection_exists("alice_trial_documents"))
+        self.assertEqual(self.backend.count("bob_trial_documents"), 2)
+        self.backend.delete("bob_trial_documents", ["b"])
+        self.assertEqual(self.backend.count("bob_trial_documents"), 1)
+
+    def test_migrate_collection(self):
+        """ Test that a per-use-case collection is copied into the shared layout, idempotently """
+        self.client.create_collection("carol_trial_documents", vectors_config=self.backend.models.VectorParams(
+            size=4, distance=self.backend.models.Distance.COSINE))
+        self.client.upsert("carol_trial_documents", [self.backend.models.PointStruct(
+            id=f"00000000-0000-0000-0000-00000000000{i}", vector=[1, i, 0, 0], payload={"metadata": {"source": "a.pdf"}})
+            for i in range(3)])
+        for _ in range(2):
+            report = migrate_collection(self.client, self.backend, "carol_trial_documents", batch_size=2, delete_source=False)
+        self.assertEqual(report["migrated"], 3)
+        self.assertIn(self.backend.shard("carol_trial_documents"), self.backend.shard_names())
+        self.assertEqual(self.backend.source_point_ids("carol_trial_documents", "a.pdf"),
+                         {f"00000000-0000-0000-0000-00000000000{i}" for i in range(3)})
+
+
+class TestStorageProfiles(unittest.TestCase):
+
+    def test_profiles_configure_collections_and_searches(self):
+        """ Test that a profile sets the storage of new collections and the parameters of searches """
+        client = QdrantClient(":memory:")
+        backend = QdrantBackend(client, "low-memory")
+        config = backend.collection_config(4)
+        self.assertTrue(config["vectors_config"].on_disk)
+        self.assertEqual(config["quantization_config"].scalar.type, backend.models.ScalarType.INT8)
+        self.assertEqual(config["hnsw_config"].m, 16)
+        store = backend.as_vectorstore("user_case_documents", KeywordEmbeddings())
+        self.assertEqual(store.search_params.hnsw_ef, 128)
+        self.assertTrue(store.search_params.quantization.rescore)
+        self.assertIsNone(QdrantBackend(client).search_params())
+        shared = SharedQdrantBackend(client, "shared_documents", profile="binary")
+        self.assertEqual(shared.as_vectorstore("user_case_documents", KeywordEmbeddings()).search_params.quantization.oversampling, 3.0)
+        with self.assertRaises(ValueError):
+            QdrantBackend(client, "unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
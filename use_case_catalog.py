@@ -0,0 +1,137 @@
+import io
+import os
+import threading
+import time
+import pandas as pd
+from azure.core.exceptions import ResourceNotFoundError, ResourceModifiedError, ResourceExistsError
+from blob_storage import get_blob_store
+
+
+# Seconds a cached use case DataFrame is served without asking the blob store whether it changed
+CATALOG_REVALIDATE_SECONDS = float(os.environ.get("CATALOG_REVALIDATE_SECONDS", 30))
+
+
+def empty_use_case_dataframe():
+    return pd.DataFrame(columns=['Use Case Name', 'Use Case Documents'])
+
+
+class _CatalogEntry:
+    """A cached version of a user's use case DataFrame and its document lookup."""
+
+    def __init__(self, df, etag) -> None:
+        self.df = df
+        self.etag = etag
+        self.checked_at = time.monotonic()
+        self.documents = {
+            name: [document for document in documents.split(', ') if document]
+            for name, documents in zip(df['Use Case Name'], df['Use Case Documents'])
+        }
+
+
+class UseCaseCatalog:
+    """
+    Per-user cache of the use case DataFrames, shared by all sessions of the process.
+
+    A cached DataFrame is served from memory for revalidate_seconds. After that, the next
+    access revalidates it with a conditional GET on the blob's ETag, which only downloads
+    the DataFrame if another process changed it. Updates made through this catalog refresh
+    the cached entry directly.
+
+    Args:
+        store (AzureBlobStore or LocalBlobStore): The blob store holding the DataFrames.
+        revalidate_seconds (float): How long a cached DataFrame is trusted without revalidation.
+    """
+
+    def __init__(self, store, revalidate_seconds=CATALOG_REVALIDATE_SECONDS) -> None:
+        self.store = store
+        self.revalidate_seconds = revalidate_seconds
+        self._entries = {}
+        self._user_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def blob_name(user_id):
+        return f"{user_id}_use_cases_df.pkl"
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def _entry(self, user_id):
+        """Returns the current entry of a user, revalidating it with the blob store if it is stale."""
+        with self._user_lock(user_id):
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry.checked_at < self.revalidate_seconds:
+                return entry
+
+            try:
+                if entry is not None and entry.etag is not None:
+                    data, etag = self.store.read_if_changed(self.blob_name(user_id), entry.etag)
+                else:
+                    data, etag = self.store.read_with_etag(self.blob_name(user_id))
+            except ResourceNotFoundError:
+                data, etag = None, None
+                entry = None
+
+            if data is not None:
+                entry = _CatalogEntry(pd.read_pickle(io.BytesIO(data)), etag)
+            elif entry is None:
+                entry = _CatalogEntry(empty_use_case_dataframe(), None)
+            else:
+                entry.checked_at = time.monotonic()
+            self._entries[user_id] = entry
+            return entry
+
+    def get_dataframe(self, user_id):
+        """Returns a copy of a user's use case DataFrame."""
+        return self._entry(user_id).df.copy()
+
+    def get_documents(self, user_id, use_case_name):
+        """Returns the document names of a use case, or an empty list if it does not exist."""
+        return list(self._entry(user_id).documents.get(use_case_name, []))
+
+    def update(self, user_id, update):
+        """
+        Applies an update to a user's use case DataFrame and uploads it to the blob store.
+
+        The upload only succeeds if the blob was not changed by another session since it was
+        read; otherwise the DataFrame is read again and the update re-applied.
+
+        Args:
+            user_id (str): The ID of the user whose use case DataFrame is to be updated.
+            update (callable): Function taking the current DataFrame and returning the updated one.
+        """
+        while True:
+            self.invalidate(user_id)
+            entry = self._entry(user_id)
+            temp_df = update(entry.df.copy())
+            buffer = io.BytesIO()
+            temp_df.to_pickle(buffer)
+            try:
+                etag = self.store.write(self.blob_name(user_id), buffer.getvalue(),
+                                        if_match=entry.etag, create_only=entry.etag is None)
+            except (ResourceModifiedError, ResourceExistsError):
+                continue
+            with self._user_lock(user_id):
+                self._entries[user_id] = _CatalogEntry(temp_df, etag)
+            return
+
+    def invalidate(self, user_id):
+        """Forces the next access to a user's DataFrame to revalidate it with the blob store."""
+        with self._user_lock(user_id):
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry.checked_at = float("-inf")
+
+
+_use_case_catalog = None
+_use_case_catalog_lock = threading.Lock()
+
+
+def get_use_case_catalog():
+    """Returns the process-wide use case catalog."""
+    global _use_case_catalog
+    with _use_case_catalog_lock:
+        if _use_case_catalog is None:
+            _use_case_catalog = UseCaseCatalog(get_blob_store())
+        return _use_case_catalog
@@ -1,17 +1,28 @@
-from qdrant_client import QdrantClient
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Qdrant
 import re
 import os
 import pickle
 from base_agent import BaseAgent
+from embedding_scheduler import EmbeddingUpsertEngine
+from vector_backends import get_vector_backend
 from langchain.prompts import PromptTemplate
 import pandas as pd
 from docx import Document
-from azure.storage.blob import BlobServiceClient
+from extraction_backends import get_pdf_extractor
+from langchain_core.documents import Document as LangchainDocument
 from azure.core.exceptions import ResourceNotFoundError
+from blob_storage import get_blob_store
+from chat_history import get_chat_history_writer
+from use_case_catalog import get_use_case_catalog, empty_use_case_dataframe
+from document_library import get_document_library
+from answer_cache import get_answer_cache
+from telemetry import traced, start_exporters
+from resources import registry
 
 
+# Serve the metrics to Prometheus and export traces to OpenTelemetry, if configured
+start_exporters()
+
 # Define our text splitter
 text_splitter = RecursiveCharacterTextSplitter(
 chunk_size=1000,
@@ -20,15 +31,23 @@ length_function=len,
 is_separator_regex=False)
 
 
-# Initialise our Qdrant client to store vectors
-qdrant_client = QdrantClient(
-    url=os.environ["QDRANT_URL"], 
-    api_key=os.environ["QDRANT_KEY"],
-)
-
-# Initialise Base agent for embeddings
+# Base agent for embeddings; its clients are only created when first used
 agent = BaseAgent()
-embeddings = agent.embeddings
+
+# The vector backend (Qdrant by default), the blob store holding use cases and chat histories,
+# and the use case catalog are process-wide resources created on first use, not on import
+_LAZY_ATTRIBUTES = {
+    "vector_backend": get_vector_backend,
+    "blob_store": get_blob_store,
+    "use_case_catalog": get_use_case_catalog,
+    "embeddings": lambda: agent.embeddings,
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 template_summarization = """
@@ -79,10 +98,61 @@ def clean_texts(input_text):
 
 
 def extract_source_names(source_documents):
-    return set([doc.metadata.get("source", "Unknown Source") for doc in source_documents])
+    source_names = set([doc.metadata.get("source", "Unknown Source") for doc in source_documents])
+    # Near-duplicate chunks collapsed at ingestion keep the sources they also appeared in
+    for doc in source_documents:
+        source_names.update(duplicate["source"] for duplicate in doc.metadata.get("duplicate_sources", []))
+    return source_names
+
+
+# Any run of characters other than letters, digits, commas, periods and percentage signs
+_PDF_NON_TEXT_PATTERN = re.compile(r"[^a-zA-Z0-9,.%]+")
+
+
+def clean_pdf_page_text(page_text):
+    """
+    Cleans the text extracted from a single PDF page.
+
+    Replaces newlines with spaces, removes non-alphanumeric characters (excluding spaces, 
+    commas, periods, and percentage signs), and condenses multiple spaces into a single space. 
+    This is done in a single pass of a precompiled pattern, and gives the same text whatever 
+    extractor the page was read with.
+
+    Args:
+        page_text (str): The raw text of the page.
+
+    Returns:
+        str: The cleaned page text.
+    """
+    return _PDF_NON_TEXT_PATTERN.sub(" ", page_text)
+
+
+def iter_pdf_pages(pdf_doc, start_page=0, end_page=None, extractor=None):
+    """
+    Yields the cleaned text of each page of a PDF document, one page at a time.
+
+    Pages without text are skipped, so only one page of text is held in memory at once.
+
+    Args:
+        pdf_doc (PdfDocument): A PDF document opened with the extractor.
+        start_page (int): Index of the first page to extract. Defaults to the first page.
+        end_page (int, optional): Index after the last page to extract. Defaults to the
+                                  end of the document.
+        extractor (PdfplumberExtractor or PdfiumExtractor, optional): The extractor that 
+                                  opened pdf_doc. Defaults to pdfplumber.
+
+    Yields:
+        tuple: The 1-based page number and the cleaned text of the page followed by a space.
+    """
+    extractor = extractor or get_pdf_extractor("pdfplumber")
+    for page_number, raw_text in extractor.iter_page_texts(pdf_doc, start_page, end_page):
+        # Extract text from the page
+        page_text = clean_pdf_page_text(raw_text)
+        if page_text:  # Check if there's text on the page
+            yield page_number, page_text + ' '
 
 
-def extract_text_from_pdf(pdf_doc):
+def extract_text_from_pdf(pdf_doc, start_page=0, end_page=None):
     """
     Extracts and cleans text from a PDF document.
 
@@ -94,20 +164,14 @@ def extract_text_from_pdf(pdf_doc):
 
     Args:
         pdf_doc (PdfDocument): A PDF document object containing pages to be processed.
+        start_page (int): Index of the first page to extract. Defaults to the first page.
+        end_page (int, optional): Index after the last page to extract. Defaults to the
+                                  end of the document.
 
     Returns:
         str: The concatenated and cleaned text extracted from the PDF document.
     """
-    all_text = ''
-    for page in pdf_doc.pages:
-        # Extract text from the page
-        page_text = page.extract_text()
-        page_text = page_text.replace("\n", " ")
-        page_text = re.sub(r"[^a-zA-Z0-9 ,.%]", " ", page_text)
-        page_text = re.sub("\s+", " ", page_text)
-        if page_text:  # Check if there's text on the page
-            all_text += page_text + ' '  # Append text with a newline
-    return all_text
+    return "".join(page_text for _, page_text in iter_pdf_pages(pdf_doc, start_page, end_page))
 
 
 def text_to_docs(input_text):
@@ -128,18 +192,105 @@ def text_to_docs(input_text):
     return docs
 
 
-def extract_text_from_docx(file):
-    """Extract text from a DOCX file."""
+def iter_docx_blocks(file):
+    """
+    Yields the text of a DOCX file one paragraph or table row at a time.
+
+    Paragraphs are yielded first, followed by the rows of every table, matching the 
+    order used by extract_text_from_docx.
+
+    Args:
+        file (str or file-like): The DOCX file to read.
+
+    Yields:
+        tuple: The 1-based block number and the text of the paragraph or table row.
+    """
     doc = Document(file)
-    text = ""
+    block_number = 0
     for para in doc.paragraphs:
-        text += para.text + "\n"
+        block_number += 1
+        yield block_number, para.text + "\n"
     for table in doc.tables:
         for row in table.rows:
-            for cell in row.cells:
-                text += cell.text + "\t"
-            text += "\n"
-    return text
+            block_number += 1
+            yield block_number, "".join(cell.text + "\t" for cell in row.cells) + "\n"
+
+
+def extract_text_from_docx(file):
+    """Extract text from a DOCX file."""
+    return "".join(block_text for _, block_text in iter_docx_blocks(file))
+
+
+def stream_text_to_documents(text_blocks, source, location_key="page", buffer_size=None):
+    """
+    Splits a stream of text blocks into chunks without holding the whole document in memory.
+
+    Blocks are appended to a bounded buffer. Whenever the buffer exceeds buffer_size it is 
+    split, every chunk except the last is yielded, and the last (possibly incomplete) chunk 
+    is carried over to be continued by the following blocks. Each chunk is tagged with its 
+    source and the location (page or paragraph number) of the block it starts in.
+
+    The chunks are those of splitting the whole text at once, as long as no paragraph is 
+    longer than a chunk; the last piece of a longer paragraph may be merged with the text 
+    that follows it. A buffer holding only whitespace is dropped.
+
+    Args:
+        text_blocks (iterable of tuple): (location, text) pairs, e.g. from iter_pdf_pages.
+        source (str): The file name recorded as the 'source' metadata of every chunk.
+        location_key (str): The metadata key used for the block location. Defaults to 'page'.
+        buffer_size (int, optional): Buffer length that triggers a split. Defaults to four 
+                                     times the splitter chunk size.
+
+    Yields:
+        Document: The chunks of the document, in order.
+    """
+    buffer_size = buffer_size or 4 * text_splitter._chunk_size
+    buffer = ""
+    boundaries = []  # (offset in buffer, location) of every block start in the buffer
+
+    def located_chunks(text):
+        # Find the start offset of each chunk, the same way the splitter's add_start_index does
+        index, previous_chunk_len = 0, 0
+        for chunk in text_splitter.split_text(text):
+            offset = index + previous_chunk_len - text_splitter._chunk_overlap
+            index = text.find(chunk, max(0, offset))
+            previous_chunk_len = len(chunk)
+            yield chunk, index
+
+    def location_at(offset):
+        location = boundaries[0][1]
+        for block_offset, block_location in boundaries:
+            if block_offset > offset:
+                break
+            location = block_location
+        return location
+
+    def to_document(chunk, offset):
+        return LangchainDocument(page_content=chunk, metadata={'source': f"{source}", location_key: location_at(offset)})
+
+    for location, text in text_blocks:
+        boundaries.append((len(buffer), location))
+        buffer += text
+        if len(buffer) < buffer_size:
+            continue
+        chunks = list(located_chunks(buffer))
+        if not chunks:
+            # Only whitespace so far, e.g. empty paragraphs, which no chunk continues
+            buffer, boundaries = "", []
+            continue
+        for chunk, offset in chunks[:-1]:
+            yield to_document(chunk, offset)
+        # Carry the last chunk over so it can be continued by the next blocks, from the whitespace
+        # before it, which the splitter counted in the chunk's length before stripping it
+        carry_offset = len(buffer[:chunks[-1][1]].rstrip())
+        boundaries = [(0, location_at(carry_offset))] + [(block_offset - carry_offset, block_location)
+                                                          for block_offset, block_location in boundaries
+                                                          if block_offset > carry_offset]
+        buffer = buffer[carry_offset:]
+
+    if buffer.strip():
+        for chunk, offset in located_chunks(buffer):
+            yield to_document(chunk, offset)
 
 
 def remove_duplicate_documents(documents):
@@ -169,53 +320,52 @@ def remove_duplicate_documents(documents):
     return unique_docs
 
 
-def docs_to_vectordb(docs, collection_name):
+@traced("index_documents")
+def docs_to_vectordb(docs, collection_name, progress_callback=None):
     """
-    Uploads documents to a Qdrant vector database collection specific to the user.
+    Uploads documents to a vector database collection specific to the user.
 
-    This function takes a list of document objects and a username, and uploads the documents 
-    to a Qdrant vector database collection named after the username. It uses the Qdrant API 
-    and handles any exceptions that occur during the process.
+    This function takes a list of document objects and a collection name, and uploads the 
+    documents to a collection of the vector backend, replacing any existing collection of 
+    that name. Embedding requests run concurrently and are pipelined with the vector store upserts 
+    by the EmbeddingUpsertEngine, which also retries throttled requests. It handles any 
+    exceptions that occur during the process. Cached answers of the collection are invalidated.
 
     Args:
         docs (list of Document): A list of document objects to be uploaded.
         collection_name (str): The collection name to create a specific collection for the documents.
+        progress_callback (callable, optional): Called with the (embedded, upserted) chunk counts 
+                                                whenever a batch completes.
 
     Returns:
-        Qdrant or bool: Returns the Qdrant instance if successful, otherwise returns False.
+        VectorStore or bool: Returns the vector store if successful, otherwise returns False.
     """
     try:
-        qdrant = Qdrant.from_documents(
-            documents=docs,
-            embedding=agent.embeddings,
-            url=os.environ["QDRANT_URL"],
-            api_key=os.environ["QDRANT_KEY"],
-            collection_name=f"{collection_name}_documents",
-            force_recreate=True
-        )
+        vector_backend = get_vector_backend()
+        engine = EmbeddingUpsertEngine(vector_backend, agent.embeddings)
+        engine.run(docs, f"{collection_name}_documents", progress_callback=progress_callback)
+        get_answer_cache().invalidate(f"{collection_name}_documents")
+        vectordb = vector_backend.as_vectorstore(f"{collection_name}_documents", agent.embeddings)
     except Exception as e:
         print(f"Something went wrong: {e}")
-        qdrant = False
+        vectordb = False
 
-    return qdrant
+    return vectordb
 
 
 def upload_to_azure_blob(file_path):
     """
     Uploads a file to an Azure Blob Storage container.
 
-    This function uploads a specified file to a designated Azure Blob Storage container using 
-    the connection string and container name provided in environment variables. It handles any 
-    exceptions that occur during the upload process.
+    This function uploads a specified file to the blob store under the same name. It handles 
+    any exceptions that occur during the upload process.
 
     Args:
         file_path (str): The local path to the file that needs to be uploaded.
     """
-    blob_service_client = BlobServiceClient.from_connection_string(os.environ["AZURE_BLOB_CONNECTION_STRING"])
-    blob_client = blob_service_client.get_blob_client(container=os.environ["AZURE_BLOB_CONTAINER_NAME"], blob=file_path)
     try:
         with open(file_path, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
+            get_blob_store().write(file_path, data.read())
     except Exception as e:
         print(f"Exception occurred: {e}")
 
@@ -224,11 +374,9 @@ def get_azure_blob(azure_blob_path):
     """
     Downloads a blob from Azure Blob Storage, deserializes it using pickle, and returns the object.
 
-    This function downloads a specified blob from an Azure Blob Storage container using the 
-    connection string and container name provided in environment variables. It saves the blob 
-    locally, deserializes it using pickle, and returns the deserialized object. The local file 
-    is removed after deserialization. If an error occurs, the local file is removed and an empty 
-    list is returned.
+    This function downloads a specified blob from the blob store straight into memory, 
+    deserializes it using pickle, and returns the deserialized object. If an error occurs, 
+    an empty list is returned.
 
     Args:
         azure_blob_path (str): The path (name) of the blob in Azure Blob Storage to be downloaded.
@@ -237,19 +385,9 @@ def get_azure_blob(azure_blob_path):
         object: The deserialized object from the blob. If an error occurs, returns an empty list.
 
     """
-    blob_service_client = BlobServiceClient.from_connection_string(os.environ["AZURE_BLOB_CONNECTION_STRING"])
-    blob_client = blob_service_client.get_blob_client(container=os.environ["AZURE_BLOB_CONTAINER_NAME"], blob=azure_blob_path)
     try:
-        with open(azure_blob_path, "wb") as download_file:
-            download_file.write(blob_client.download_blob().readall())
-        
-        with open(azure_blob_path, 'rb') as file:
-            # Load the object from the file
-            azure_blob = pickle.load(file)
-
-        os.remove(azure_blob_path)
+        azure_blob = pickle.loads(get_blob_store().read(azure_blob_path))
     except Exception as e:
-        os.remove(azure_blob_path)
         azure_blob = []
     return azure_blob
     
@@ -258,28 +396,24 @@ def delete_azure_blob(azure_blob_path):
     """
     Deletes a specified blob from an Azure Blob Storage container.
 
-    This function deletes a specified blob from an Azure Blob Storage container using the 
-    connection string and container name provided in environment variables. If the blob 
-    does not exist, the function will pass silently.
+    This function deletes a specified blob from the blob store. If the blob does not exist, 
+    the function will pass silently.
 
     Args:
         azure_blob_path (str): The path (name) of the blob in Azure Blob Storage to be deleted.
     """
-    blob_service_client = BlobServiceClient.from_connection_string(os.environ["AZURE_BLOB_CONNECTION_STRING"])
-    blob_client = blob_service_client.get_blob_client(container=os.environ["AZURE_BLOB_CONTAINER_NAME"], blob=azure_blob_path)
-    try:
-        blob_client.delete_blob()
-    except ResourceNotFoundError as e:
-        pass
+    get_blob_store().delete(azure_blob_path)
 
 
+@traced("catalog_load")
 def get_use_case_dataframe(user_id):
     """
-    Downloads and loads a user's use case dataframe from Azure Blob Storage.
+    Loads a user's use case dataframe from the use case catalog.
 
-    This function retrieves a pickled pandas DataFrame from an Azure Blob Storage container 
-    based on the provided user ID. If the DataFrame cannot be retrieved, it returns an empty 
-    DataFrame with specified columns.
+    The catalog keeps the DataFrame in memory, shared by all sessions, and only revalidates 
+    it against the blob in Azure Blob Storage with a conditional request once it is older 
+    than CATALOG_REVALIDATE_SECONDS. If the DataFrame cannot be retrieved, it returns an 
+    empty DataFrame with specified columns.
 
     Args:
         user_id (str): The ID of the user whose use case DataFrame is to be retrieved.
@@ -288,34 +422,23 @@ def get_use_case_dataframe(user_id):
         pd.DataFrame: A pandas DataFrame containing the user's use cases. If retrieval fails, 
                       returns an empty DataFrame with columns 'Use Case Name' and 'Use Case Documents'.
     """
-    user_use_cases_df_file_path = f"{user_id}_use_cases_df.pkl"
-    blob_service_client = BlobServiceClient.from_connection_string(os.environ["AZURE_BLOB_CONNECTION_STRING"])
-    blob_client = blob_service_client.get_blob_client(container=os.environ["AZURE_BLOB_CONTAINER_NAME"], blob=user_use_cases_df_file_path)
-    
     try:
-        # Download the blob to a file
-        with open(user_use_cases_df_file_path, "wb") as download_file:
-            download_file.write(blob_client.download_blob().readall())
-        uc_df = pd.read_pickle(user_use_cases_df_file_path)
-        os.remove(user_use_cases_df_file_path)
-    
+        uc_df = get_use_case_catalog().get_dataframe(user_id)
     except Exception as e:
-        try:
-            os.remove(user_use_cases_df_file_path)
-        except Exception as _e:
-            pass
-        uc_df = pd.DataFrame(columns=['Use Case Name', 'Use Case Documents'])
+        print(f"Exception occurred: {e}")
+        uc_df = empty_use_case_dataframe()
     
     return uc_df
 
 
+@traced("catalog_update")
 def add_use_case(user_id, new_use_case_name, document_names):
     """
     Adds a new use case to the user's use case DataFrame and uploads it to Azure Blob Storage.
 
-    This function retrieves the user's use case DataFrame from Azure Blob Storage, adds a new 
+    This function retrieves the user's use case DataFrame from the blob store, adds a new 
     use case with the specified name and associated documents, and then uploads the updated 
-    DataFrame back to Azure Blob Storage.
+    DataFrame back to the blob store.
 
     Args:
         user_id (str): The ID of the user whose use case DataFrame is to be updated.
@@ -326,20 +449,46 @@ def add_use_case(user_id, new_use_case_name, document_names):
         None
     """
     new_row = {"Use Case Name": new_use_case_name, "Use Case Documents": ", ".join(document_names)}
-    temp_df = get_use_case_dataframe(user_id)
-    temp_df.loc[len(temp_df)] = new_row
-    temp_df.to_pickle(f"{user_id}_use_cases_df.pkl")
-    upload_to_azure_blob(f"{user_id}_use_cases_df.pkl")
-    os.remove(f"{user_id}_use_cases_df.pkl")
 
+    def update(temp_df):
+        temp_df.loc[len(temp_df)] = new_row
+        return temp_df
+
+    get_use_case_catalog().update(user_id, update)
+
+
+@traced("catalog_update")
+def set_use_case_documents(user_id, use_case_name, document_names):
+    """
+    Replaces the document names recorded for an existing use case and uploads the DataFrame.
+
+    This function keeps the use case DataFrame in sync when documents are added to or removed 
+    from a use case's collection without recreating it.
+
+    Args:
+        user_id (str): The ID of the user whose use case DataFrame is to be updated.
+        use_case_name (str): The name of the use case to be updated.
+        document_names (list of str): The names of all documents now in the use case.
+
+    Returns:
+        None
+    """
+    def update(temp_df):
+        temp_df.loc[temp_df["Use Case Name"] == use_case_name, "Use Case Documents"] = ", ".join(document_names)
+        return temp_df
+
+    get_use_case_catalog().update(user_id, update)
 
+
+@traced("use_case_delete")
 def delete_use_case(user_id, deletion_use_case_name):
     """
     Deletes a specified use case from the user's use case DataFrame and updates Azure Blob Storage.
 
-    This function retrieves the user's use case DataFrame from Azure Blob Storage, removes the 
-    specified use case, updates the DataFrame, and uploads it back to Azure Blob Storage. Additionally, 
-    it deletes the associated collection in Qdrant and removes the corresponding chat history from Azure Blob Storage.
+    This function retrieves the user's use case DataFrame from the blob store, removes the 
+    specified use case, updates the DataFrame, and uploads it back to the blob store. Additionally, 
+    it deletes the associated vector collection, its cached answers and the corresponding chat history, 
+    and releases its documents in the document library, deleting those no other use case references.
 
     Args:
         user_id (str): The ID of the user whose use case is to be deleted.
@@ -348,41 +497,49 @@ def delete_use_case(user_id, deletion_use_case_name):
     Returns:
         None
     """
-    temp_df = get_use_case_dataframe(user_id)
-    temp_df = temp_df[temp_df["Use Case Name"] != deletion_use_case_name]
-    temp_df.reset_index(drop=True, inplace=True)
-    temp_df.to_pickle(f"{user_id}_use_cases_df.pkl")
-    upload_to_azure_blob(f"{user_id}_use_cases_df.pkl")
-    os.remove(f"{user_id}_use_cases_df.pkl")
-    qdrant_client.delete_collection(f"{user_id}_{deletion_use_case_name}_documents")
-    delete_azure_blob(f"{user_id}_{deletion_use_case_name}_chat_history.pkl")
+    def update(temp_df):
+        temp_df = temp_df[temp_df["Use Case Name"] != deletion_use_case_name]
+        return temp_df.reset_index(drop=True)
+
+    get_use_case_catalog().update(user_id, update)
+    get_vector_backend().delete_collection(f"{user_id}_{deletion_use_case_name}_documents")
+    get_document_library().release(user_id, deletion_use_case_name)
+    get_answer_cache().invalidate(f"{user_id}_{deletion_use_case_name}_documents")
+    # Cleared after the history's pending writes, which would otherwise bring it back
+    get_chat_history_writer().clear(user_id, deletion_use_case_name)
     
 
 def get_chat_history(user_id, use_case_id):
     """
     Retrieves the chat history for a specific use case from Azure Blob Storage.
 
-    This function downloads and deserializes the chat history for a given user and use case 
-    from Azure Blob Storage. The chat history is stored in a pickle file with a naming 
-    convention based on the user ID and use case ID.
+    This function loads the most recent messages of the chat history for a given user and 
+    use case from its append log in the blob store, including its pending writes. Older messages can be paginated with 
+    chat_history.load_older_chat_history.
 
     Args:
         user_id (str): The ID of the user whose chat history is to be retrieved.
         use_case_id (str): The ID of the use case for which the chat history is to be retrieved.
 
     Returns:
-        object: The deserialized chat history object. If retrieval fails, an empty list is returned.
+        list: The most recent chat messages. If retrieval fails, an empty list is returned.
     """
-    user_chat_history = get_azure_blob(f"{user_id}_{use_case_id}_chat_history.pkl")
+    try:
+        user_chat_history, _ = get_chat_history_writer().load(user_id, use_case_id)
+    except Exception as e:
+        print(f"Exception occurred: {e}")
+        user_chat_history = []
     return user_chat_history
 
 
 def update_chat_history(chat_messages, user_id, use_case_id):
     """
-    Updates the chat history for a specific use case and uploads it to Azure Blob Storage.
+    Replaces the chat history for a specific use case in Azure Blob Storage.
 
-    This function serializes the given chat messages and saves them to a local pickle file. 
-    It then uploads the pickle file to Azure Blob Storage and removes the local file.
+    This function deletes the stored chat history and writes the given messages in its place, 
+    both after the pending writes of the chat history (see chat_history.ChatHistoryWriter). 
+    Use ChatHistoryWriter.append to add the messages of a new turn, which only uploads those 
+    messages.
 
     Args:
         chat_messages (list): A list of chat messages to be saved.
@@ -392,11 +549,13 @@ def update_chat_history(chat_messages, user_id, use_case_id):
     Returns:
         None
     """
-    chat_history_path = f"{user_id}_{use_case_id}_chat_history.pkl"
-    with open(chat_history_path, 'wb') as file:
-        pickle.dump(chat_messages, file)
-    upload_to_azure_blob(chat_history_path)
-    os.remove(chat_history_path)
+    try:
+        history_writer = get_chat_history_writer()
+        history_writer.clear(user_id, use_case_id)
+        if chat_messages:
+            history_writer.append(user_id, use_case_id, chat_messages)
+    except Exception as e:
+        print(f"Exception occurred: {e}")
 
 
 def get_document_names(use_cases_main_df, use_case_name):
@@ -417,6 +576,28 @@ def get_document_names(use_cases_main_df, use_case_name):
     return use_cases_main_df[use_cases_main_df['Use Case Name']==use_case_name]['Use Case Documents'].tolist()[0].split(', ')
 
 
+@traced("catalog_documents")
+def get_use_case_documents(user_id, use_case_name):
+    """
+    Retrieves the document names of a use case from the use case catalog.
+
+    Unlike get_document_names, this looks the use case up in the catalog's index, so 
+    repeated calls do not scan the DataFrame or split its document strings again.
+
+    Args:
+        user_id (str): The ID of the user owning the use case.
+        use_case_name (str): The name of the use case for which to retrieve document names.
+
+    Returns:
+        list of str: The document names of the use case, or an empty list if it does not exist.
+    """
+    try:
+        return get_use_case_catalog().get_documents(user_id, use_case_name)
+    except Exception as e:
+        print(f"Exception occurred: {e}")
+        return []
+
+
 def convert_chat_history(role_user_chat):
     """
     Converts a list of chat messages into a list of tuples pairing user and response messages.
@@ -442,3 +623,6 @@ def convert_chat_history(role_user_chat):
             # In case there's an odd number of messages, pair the last user message with an empty string
             converted_history.append((role_user_chat[i]["content"], ""))
     return converted_history[-5:]
+
+
+registry.mark("utils_imported")
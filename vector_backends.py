@@ -0,0 +1,751 @@
+import io
+import json
+import os
+import threading
+import uuid
+import zlib
+from urllib.parse import quote
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_community.vectorstores import Qdrant
+from resources import register_resource, get_resource
+
+
+# Vector store used for use case collections: "qdrant" (remote server) or "local" (in-process)
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "qdrant")
+# Directory where the local backend persists its collections
+LOCAL_VECTOR_STORE_PATH = os.environ.get("LOCAL_VECTOR_STORE_PATH", os.path.join(".cache", "vector_store"))
+# Collections of the local backend with at least this many vectors are searched with an approximate index
+LOCAL_VECTOR_ANN_THRESHOLD = int(os.environ.get("LOCAL_VECTOR_ANN_THRESHOLD", 20000))
+# Layout of use cases on Qdrant: "per_use_case" (one collection each) or "shared" (every use case
+# in VECTOR_SHARED_SHARDS collections, told apart by an indexed tenant payload field)
+VECTOR_COLLECTION_LAYOUT = os.environ.get("VECTOR_COLLECTION_LAYOUT", "per_use_case")
+# Name and number of the shared collections of the "shared" layout
+VECTOR_SHARED_COLLECTION = os.environ.get("VECTOR_SHARED_COLLECTION", "biorag_documents")
+VECTOR_SHARED_SHARDS = int(os.environ.get("VECTOR_SHARED_SHARDS", 1))
+# Storage profile of new Qdrant collections, one of VECTOR_STORAGE_PROFILES
+VECTOR_STORAGE_PROFILE = os.environ.get("VECTOR_STORAGE_PROFILE", "default")
+
+# Storage and search settings of Qdrant collections. Quantized vectors are kept in RAM and their
+# candidates rescored with the original vectors, fetched from disk when those are stored on disk.
+VECTOR_STORAGE_PROFILES = {
+    # Full-precision vectors in RAM and Qdrant's default HNSW parameters
+    "default": {},
+    # Original vectors and graph on disk, int8 vectors in RAM: about a quarter of the RAM of "default"
+    "low-memory": {"on_disk": True, "quantization": "scalar", "hnsw_m": 16, "hnsw_ef_construct": 100,
+                   "hnsw_on_disk": True, "hnsw_ef": 128, "oversampling": 2.0},
+    # Everything in RAM, searched on int8 vectors through a denser graph with a small 'ef'
+    "low-latency": {"quantization": "scalar", "hnsw_m": 32, "hnsw_ef_construct": 200, "hnsw_ef": 64, "oversampling": 1.5},
+    # Original vectors on disk, 1-bit vectors in RAM: about a thirtieth of the RAM of "default"
+    "binary": {"on_disk": True, "quantization": "binary", "hnsw_ef": 128, "oversampling": 3.0},
+    # Full-precision vectors through a denser graph with a large 'ef'
+    "high-recall": {"hnsw_m": 32, "hnsw_ef_construct": 256, "hnsw_ef": 256},
+}
+
+# Payload fields of the "shared" layout: the use case collection name and the chunk's own point ID
+TENANT_FIELD = "tenant"
+TENANT_POINT_ID_FIELD = "point_id"
+# Namespace of the point IDs of the "shared" layout, derived from the tenant and the chunk's point ID
+TENANT_POINT_NAMESPACE = uuid.UUID("0e8b9a52-3f4c-4d7b-8c36-2a9d51f7e4c1")
+
+# Points an upsert to a local collection logs, at least, before they are folded into its JSON file
+_MIN_LOGGED_POINTS = 1000
+
+
+class QdrantBackend:
+    """
+    Vector backend storing collections on a Qdrant server.
+
+    Points use the payload layout of LangChain's Qdrant vector store ('page_content' and
+    'metadata'), so collections can be queried through as_vectorstore().
+
+    Collections are created with the vector storage, quantization and HNSW parameters of a
+    storage profile, and searched with its search parameters. Collections created before a
+    change of profile keep their storage settings.
+
+    Args:
+        client (QdrantClient): The Qdrant client to use.
+        profile (str): The name of the storage profile, one of VECTOR_STORAGE_PROFILES.
+    """
+
+    def __init__(self, client, profile=VECTOR_STORAGE_PROFILE) -> None:
+        # Imported with the first Qdrant backend rather than with this module, as it takes about a second
+        from qdrant_client import models
+        if profile not in VECTOR_STORAGE_PROFILES:
+            raise ValueError(f"Unknown vector storage profile: {profile}")
+        self.client = client
+        self.models = models
+        self.profile = VECTOR_STORAGE_PROFILES[profile]
+
+    def _hnsw_settings(self):
+        return {key: self.profile[f"hnsw_{key}"] for key in ("m", "ef_construct", "on_disk") if f"hnsw_{key}" in self.profile}
+
+    def collection_config(self, vector_size):
+        """Returns the create_collection arguments of the storage profile, for cosine vectors of the given size."""
+        config = {"vectors_config": self.models.VectorParams(size=vector_size, distance=self.models.Distance.COSINE,
+                                                             on_disk=self.profile.get("on_disk"))}
+        hnsw = self._hnsw_settings()
+        if hnsw:
+            config["hnsw_config"] = self.models.HnswConfigDiff(**hnsw)
+        if self.profile.get("quantization") == "scalar":
+            config["quantization_config"] = self.models.ScalarQuantization(scalar=self.models.ScalarQuantizationConfig(
+                type=self.models.ScalarType.INT8, quantile=0.99, always_ram=True))
+        elif self.profile.get("quantization") == "binary":
+            config["quantization_config"] = self.models.BinaryQuantization(
+                binary=self.models.BinaryQuantizationConfig(always_ram=True))
+        return config
+
+    def search_params(self):
+        """Returns the search parameters of the storage profile, or None for Qdrant's defaults."""
+        if "hnsw_ef" not in self.profile and "quantization" not in self.profile:
+            return None
+        quantization = None
+        if "quantization" in self.profile:
+            quantization = self.models.QuantizationSearchParams(rescore=True, oversampling=self.profile.get("oversampling"))
+        return self.models.SearchParams(hnsw_ef=self.profile.get("hnsw_ef"), quantization=quantization)
+
+    def collection_exists(self, collection_name):
+        return self.client.collection_exists(collection_name)
+
+    def create_collection(self, collection_name, vector_size):
+        """Creates an empty cosine collection, replacing any existing one."""
+        if self.client.collection_exists(collection_name):
+            self.client.delete_collection(collection_name)
+        self.client.create_collection(collection_name=collection_name, **self.collection_config(vector_size))
+        # Index the source file name and document ID so a document's points can be found without a full scan
+        self.client.create_payload_index(collection_name, "metadata.source", self.models.PayloadSchemaType.KEYWORD)
+        self.client.create_payload_index(collection_name, "metadata.document_id", self.models.PayloadSchemaType.KEYWORD)
+
+    def delete_collection(self, collection_name):
+        self.client.delete_collection(collection_name)
+
+    def upsert(self, collection_name, ids, vectors, payloads):
+        points = [self.models.PointStruct(id=point_id, vector=vector, payload=payload)
+                  for point_id, vector, payload in zip(ids, vectors, payloads)]
+        self.client.upsert(collection_name=collection_name, points=points)
+
+    def delete(self, collection_name, ids):
+        self.client.delete(collection_name=collection_name, points_selector=self.models.PointIdsList(points=list(ids)))
+
+    def source_point_ids(self, collection_name, source):
+        """Returns the set of IDs of the points stored for a source file name."""
+        return self.point_ids_where(collection_name, "source", source)
+
+    def point_ids_where(self, collection_name, key, value):
+        """Returns the set of IDs of the points whose metadata key has the given value."""
+        metadata_filter = self.models.Filter(
+            must=[self.models.FieldCondition(key=f"metadata.{key}", match=self.models.MatchValue(value=value))]
+        )
+        point_ids = set()
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection_name,
+                scroll_filter=metadata_filter,
+                limit=1000,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False,
+            )
+            point_ids.update(str(point.id) for point in points)
+            if offset is None:
+                return point_ids
+
+    def points_where(self, collection_name, key, value):
+        """
+        Returns the payloads of the points whose metadata key has the given value, by point ID.
+
+        A key of the form 'list[].field' matches the points with an element of the metadata
+        list whose field has the value, e.g. 'duplicate_sources[].source'.
+        """
+        metadata_filter = self.models.Filter(
+            must=[self.models.FieldCondition(key=f"metadata.{key}", match=self.models.MatchValue(value=value))]
+        )
+        payloads = {}
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection_name,
+                scroll_filter=metadata_filter,
+                limit=1000,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            payloads.update((str(point.id), point.payload) for point in points)
+            if offset is None:
+                return payloads
+
+    def count(self, collection_name):
+        return self.client.count(collection_name).count
+
+    def metadata_filter(self, key, values):
+        """Returns a search filter matching the points whose metadata key has any of the values."""
+        return self.models.Filter(
+            must=[self.models.FieldCondition(key=f"metadata.{key}", match=self.models.MatchAny(any=list(values)))]
+        )
+
+    def as_vectorstore(self, collection_name, embeddings):
+        """Returns a LangChain vector store over the collection, searching with the profile's parameters."""
+        return TunedQdrant(self.client, collection_name, embeddings, self.search_params())
+
+
+class TunedQdrant(Qdrant):
+    """
+    LangChain Qdrant vector store searching with default search parameters, e.g. the HNSW
+    'ef' and the rescoring of quantized vectors of a storage profile.
+    """
+
+    def __init__(self, client, collection_name, embeddings, search_params=None) -> None:
+        super().__init__(client, collection_name, embeddings)
+        self.search_params = search_params
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, search_params=None, **kwargs):
+        return super().similarity_search_with_score_by_vector(embedding, k, filter=filter,
+                                                              search_params=search_params or self.search_params, **kwargs)
+
+
+class TenantQdrant(TunedQdrant):
+    """
+    LangChain Qdrant vector store restricted to the points of one tenant of a shared collection.
+
+    Every similarity search is filtered on the tenant, in addition to the filter it is given.
+    """
+
+    def __init__(self, client, collection_name, embeddings, tenant_filter, search_params=None) -> None:
+        super().__init__(client, collection_name, embeddings, search_params)
+        self.tenant_filter = tenant_filter
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        from qdrant_client import models
+        conditions = [self.tenant_filter]
+        if filter is not None:
+            conditions.append(filter if isinstance(filter, models.Filter) else self._qdrant_filter_from_dict(filter))
+        return super().similarity_search_with_score_by_vector(embedding, k, filter=models.Filter(must=conditions), **kwargs)
+
+
+class SharedQdrantBackend(QdrantBackend):
+    """
+    Vector backend storing every use case in a few shared Qdrant collections.
+
+    A use case keeps its usual collection name, e.g. '{user}_{use_case}_documents', as its
+    tenant: the name is stored in the keyword-indexed 'tenant' payload field of its points,
+    and every operation is filtered on it. The HNSW graph of the shared collections is
+    built per tenant rather than globally, so filtered searches stay fast. Creating or
+    deleting a use case only writes or deletes its points, and the server no longer holds
+    the segments and graph of thousands of small collections. Tenants are spread over the
+    shards by a hash of their name.
+
+    Point IDs are derived from the tenant and the chunk's point ID, so a chunk can be stored
+    for several use cases; the chunk's own ID is kept in the 'point_id' payload field.
+
+    Args:
+        client (QdrantClient): The Qdrant client to use.
+        collection (str): The name of the shared collection, suffixed by the shard number
+                          when there are several shards.
+        shards (int): The number of shared collections.
+        profile (str): The name of the storage profile, one of VECTOR_STORAGE_PROFILES.
+    """
+
+    def __init__(self, client, collection=VECTOR_SHARED_COLLECTION, shards=VECTOR_SHARED_SHARDS,
+                 profile=VECTOR_STORAGE_PROFILE) -> None:
+        super().__init__(client, profile)
+        self.collection = collection
+        self.shards = shards
+
+    def shard(self, tenant):
+        """Returns the shared collection holding the points of a tenant."""
+        if self.shards <= 1:
+            return self.collection
+        return f"{self.collection}_{zlib.crc32(tenant.encode('utf-8')) % self.shards}"
+
+    def shard_names(self):
+        if self.shards <= 1:
+            return [self.collection]
+        return [f"{self.collection}_{shard}" for shard in range(self.shards)]
+
+    def _filter(self, tenant, key=None, value=None):
+        conditions = [self.models.FieldCondition(key=TENANT_FIELD, match=self.models.MatchValue(value=tenant))]
+        if key is not None:
+            conditions.append(self.models.FieldCondition(key=f"metadata.{key}", match=self.models.MatchValue(value=value)))
+        return self.models.Filter(must=conditions)
+
+    @staticmethod
+    def point_id(tenant, point_id):
+        return str(uuid.uuid5(TENANT_POINT_NAMESPACE, f"{tenant}/{point_id}"))
+
+    def ensure_shard(self, shard, vector_size):
+        """Creates a shared collection and its payload indexes if it does not exist."""
+        if self.client.collection_exists(shard):
+            return
+        config = self.collection_config(vector_size)
+        # One HNSW graph per tenant, as every search is filtered on a single tenant
+        hnsw = self._hnsw_settings()
+        config["hnsw_config"] = self.models.HnswConfigDiff(**{**hnsw, "m": 0, "payload_m": hnsw.get("m", 16)})
+        self.client.create_collection(collection_name=shard, **config)
+        self.client.create_payload_index(shard, TENANT_FIELD, self.models.PayloadSchemaType.KEYWORD)
+        self.client.create_payload_index(shard, "metadata.source", self.models.PayloadSchemaType.KEYWORD)
+        self.client.create_payload_index(shard, "metadata.document_id", self.models.PayloadSchemaType.KEYWORD)
+
+    def collection_exists(self, collection_name):
+        return self.count(collection_name) > 0
+
+    def create_collection(self, collection_name, vector_size):
+        """Creates the shared collection of the tenant if needed, and deletes any point of the tenant."""
+        self.ensure_shard(self.shard(collection_name), vector_size)
+        self.delete_collection(collection_name)
+
+    def delete_collection(self, collection_name):
+        """Deletes the points of the tenant, with a filter rather than by dropping a collection."""
+        shard = self.shard(collection_name)
+        if self.client.collection_exists(shard):
+            self.client.delete(collection_name=shard, points_selector=self.models.FilterSelector(filter=self._filter(collection_name)))
+
+    def upsert(self, collection_name, ids, vectors, payloads):
+        points = [self.models.PointStruct(id=self.point_id(collection_name, point_id), vector=vector,
+                                          payload={**payload, TENANT_FIELD: collection_name, TENANT_POINT_ID_FIELD: str(point_id)})
+                  for point_id, vector, payload in zip(ids, vectors, payloads)]
+        self.client.upsert(collection_name=self.shard(collection_name), points=points)
+
+    def delete(self, collection_name, ids):
+        point_ids = [self.point_id(collection_name, point_id) for point_id in ids]
+        self.client.delete(collection_name=self.shard(collection_name), points_selector=self.models.PointIdsList(points=point_ids))
+
+    def point_ids_where(self, collection_name, key, value):
+        """Returns the set of chunk point IDs of the tenant whose metadata key has the given value."""
+        shard = self.shard(collection_name)
+        if not self.client.collection_exists(shard):
+            return set()
+        point_ids = set()
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=shard,
+                scroll_filter=self._filter(collection_name, key, value),
+                limit=1000,
+                offset=offset,
+                with_payload=[TENANT_POINT_ID_FIELD],
+                with_vectors=False,
+            )
+            point_ids.update(point.payload[TENANT_POINT_ID_FIELD] for point in points)
+            if offset is None:
+                return point_ids
+
+    def points_where(self, collection_name, key, value):
+        """Returns the payloads of the tenant's points whose metadata key has the given value, by chunk point ID."""
+        shard = self.shard(collection_name)
+        if not self.client.collection_exists(shard):
+            return {}
+        payloads = {}
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=shard,
+                scroll_filter=self._filter(collection_name, key, value),
+                limit=1000,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            payloads.update((point.payload[TENANT_POINT_ID_FIELD], point.payload) for point in points)
+            if offset is None:
+                return payloads
+
+    def count(self, collection_name):
+        shard = self.shard(collection_name)
+        if not self.client.collection_exists(shard):
+            return 0
+        return self.client.count(shard, count_filter=self._filter(collection_name), exact=True).count
+
+    def as_vectorstore(self, collection_name, embeddings):
+        """Returns a LangChain vector store over the points of the tenant."""
+        return TenantQdrant(self.client, self.shard(collection_name), embeddings, self._filter(collection_name),
+                            self.search_params())
+
+
+class _IvfIndex:
+    """
+    Inverted-file approximate index: vectors are clustered with spherical k-means and a
+    query only scores the vectors of the clusters whose centroids are closest to it.
+    """
+
+    def __init__(self, vectors, n_lists=None, n_iter=8, seed=0) -> None:
+        n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+        rng = np.random.default_rng(seed)
+        centroids = np.array(vectors[rng.choice(len(vectors), n_lists, replace=False)])
+        for _ in range(n_iter):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            for i in range(n_lists):
+                members = vectors[assignment == i]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[i] = centroid / (np.linalg.norm(centroid) or 1.0)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignment == i) for i in range(n_lists)]
+
+    def candidates(self, query, n_probe):
+        """Returns the row indexes of the vectors in the n_probe clusters closest to the query."""
+        closest = np.argsort(-(self.centroids @ query))[:n_probe]
+        return np.concatenate([self.lists[i] for i in closest])
+
+
+class LocalCollection:
+    """
+    A collection of the local backend: normalized float32 vectors in a memory-mapped .npy
+    file and the point IDs and payloads in a JSON file next to it.
+
+    Upserts write in place: the vectors of new points are appended to the .npy file, whose
+    header is rewritten with the new row count, updated vectors are overwritten in the
+    memory map, and their points are appended to a log replayed over the JSON file on load.
+    The log is folded into the JSON file once it holds as many points, so the cost of an
+    upsert does not grow with the size of the collection.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.lock = threading.RLock()
+        self._index = None
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        if os.path.exists(self._file("vectors.npy")):
+            with open(self._file("points.json"), "r") as points_file:
+                points = json.load(points_file)
+            self.ids, self.payloads = points["ids"], points["payloads"]
+            self._positions = {point_id: i for i, point_id in enumerate(self.ids)}
+            self._snapshot_size = len(self.ids)
+            self._logged = self._replay_log()
+            # Rows appended by an upsert interrupted before logging their points are ignored
+            self.vectors = np.load(self._file("vectors.npy"), mmap_mode="r")[:len(self.ids)]
+        else:
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+            self.ids, self.payloads = [], []
+            self._positions = {}
+            self._snapshot_size, self._logged = 0, 0
+
+    def _replay_log(self):
+        """Applies the points logged since the JSON file was written, dropping a line cut short by a crash."""
+        if not os.path.exists(self._file("points.log")):
+            return 0
+        logged, valid_bytes = 0, 0
+        with open(self._file("points.log"), "rb+") as log_file:
+            for line in log_file:
+                try:
+                    point_id, payload = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self._set_payload(point_id, payload)
+                logged, valid_bytes = logged + 1, valid_bytes + len(line)
+            log_file.truncate(valid_bytes)
+        return logged
+
+    def _set_payload(self, point_id, payload):
+        position = self._positions.get(point_id)
+        if position is None:
+            self._positions[point_id] = len(self.ids)
+            self.ids.append(point_id)
+            self.payloads.append(payload)
+        else:
+            self.payloads[position] = payload
+
+    def _save(self, vectors, ids, payloads):
+        """Atomically replaces the persisted vectors and points, then memory-maps them again."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file("vectors.tmp.npy"), "wb") as vectors_file:
+            np.save(vectors_file, np.ascontiguousarray(vectors, dtype=np.float32))
+        os.replace(self._file("vectors.tmp.npy"), self._file("vectors.npy"))
+        self._save_points(ids, payloads)
+        self._index = None
+        self._load()
+
+    def _save_points(self, ids, payloads):
+        """Atomically replaces the JSON file of the points, which then includes the logged ones."""
+        with open(self._file("points.tmp.json"), "w") as points_file:
+            json.dump({"ids": ids, "payloads": payloads}, points_file)
+        os.replace(self._file("points.tmp.json"), self._file("points.json"))
+        if os.path.exists(self._file("points.log")):
+            os.remove(self._file("points.log"))
+        self._snapshot_size, self._logged = len(ids), 0
+
+    def _append_rows(self, rows):
+        """
+        Appends rows after the vectors of the points, updating the shape in the .npy header.
+
+        Returns:
+            bool: False if the new header does not fit in the space of the old one.
+        """
+        with open(self._file("vectors.npy"), "r+b") as vectors_file:
+            version = np.lib.format.read_magic(vectors_file)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            write_header = np.lib.format.write_array_header_1_0 if version == (1, 0) else np.lib.format.write_array_header_2_0
+            shape, _, dtype = read_header(vectors_file)
+            offset = vectors_file.tell()
+            header = io.BytesIO()
+            write_header(header, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False,
+                                  "shape": (len(self.ids) + len(rows), rows.shape[1])})
+            if len(header.getvalue()) != offset or shape[1:] != rows.shape[1:]:
+                return False
+            vectors_file.seek(offset + len(self.ids) * dtype.itemsize * rows.shape[1])
+            vectors_file.write(rows.astype(dtype).tobytes())
+            vectors_file.truncate()
+            vectors_file.seek(0)
+            vectors_file.write(header.getvalue())
+        return True
+
+    def upsert(self, ids, vectors, payloads):
+        vectors = np.array(vectors, dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self.lock:
+            updated, added = {}, {}
+            for point_id, vector, payload in zip(ids, vectors, payloads):
+                if point_id in self._positions:
+                    updated[point_id] = (vector, payload)
+                else:
+                    added[point_id] = (vector, payload)
+            new_rows = np.stack([vector for vector, _ in added.values()]) if added else None
+            if not os.path.exists(self._file("vectors.npy")) or (added and not self._append_rows(new_rows)):
+                all_vectors = np.array(self.vectors) if len(self.ids) else np.zeros((0, vectors.shape[1]), np.float32)
+                all_payloads = list(self.payloads)
+                for point_id, (vector, payload) in updated.items():
+                    all_vectors[self._positions[point_id]] = vector
+                    all_payloads[self._positions[point_id]] = payload
+                if added:
+                    all_vectors = np.vstack([all_vectors, new_rows])
+                self._save(all_vectors, self.ids + list(added), all_payloads + [payload for _, payload in added.values()])
+                return
+            if updated:
+                rows = np.load(self._file("vectors.npy"), mmap_mode="r+")
+                for point_id, (vector, _) in updated.items():
+                    rows[self._positions[point_id]] = vector
+                rows.flush()
+                del rows
+            # The vectors are written before their points are logged, so a crash leaves no point without its vector
+            with open(self._file("points.log"), "ab") as log_file:
+                log_file.write(b"".join(json.dumps([point_id, payload]).encode("utf-8") + b"\n"
+                                        for point_id, (_, payload) in {**updated, **added}.items()))
+            for point_id, (_, payload) in {**updated, **added}.items():
+                self._set_payload(point_id, payload)
+            self._logged += len(updated) + len(added)
+            self.vectors = np.load(self._file("vectors.npy"), mmap_mode="r")[:len(self.ids)]
+            self._index = None
+            if self._logged > max(self._snapshot_size, _MIN_LOGGED_POINTS):
+                self._save_points(self.ids, self.payloads)
+
+    def delete(self, ids):
+        with self.lock:
+            removed = {self._positions[point_id] for point_id in ids if point_id in self._positions}
+            keep = [i for i in range(len(self.ids)) if i not in removed]
+            self._save(np.array(self.vectors)[keep], [self.ids[i] for i in keep], [self.payloads[i] for i in keep])
+
+    def _matches(self, payload, metadata_filter):
+        metadata = payload.get("metadata") or {}
+        for key, value in metadata_filter.items():
+            allowed = value if isinstance(value, (list, tuple, set)) else [value]
+            if metadata.get(key) not in allowed:
+                return False
+        return True
+
+    def search(self, query_vector, k, metadata_filter=None, score_threshold=None, n_probe=8):
+        """
+        Finds the k points most similar to a query vector by cosine similarity.
+
+        Args:
+            query_vector (list of float): The query embedding.
+            k (int): The number of points to return.
+            metadata_filter (dict, optional): Metadata values the points must have; a list
+                                              value matches any of its elements.
+            score_threshold (float, optional): Minimum cosine similarity of returned points.
+            n_probe (int): Number of clusters scanned when the approximate index is used.
+
+        Returns:
+            list of tuple: (payload, score) pairs in decreasing score order.
+        """
+        with self.lock:
+            if not len(self.ids):
+                return []
+            query = np.asarray(query_vector, dtype=np.float32)
+            query /= max(np.linalg.norm(query), 1e-12)
+
+            rows = None  # None means every row, scored without copying the matrix
+            if len(self.ids) >= LOCAL_VECTOR_ANN_THRESHOLD:
+                if self._index is None:
+                    self._index = _IvfIndex(np.array(self.vectors))
+                rows = self._index.candidates(query, n_probe)
+            if metadata_filter:
+                candidates = range(len(self.ids)) if rows is None else rows
+                rows = np.array([i for i in candidates if self._matches(self.payloads[i], metadata_filter)], dtype=np.int64)
+                if not len(rows):
+                    return []
+
+            scores = self.vectors @ query if rows is None else self.vectors[rows] @ query
+            rows = np.arange(len(self.ids)) if rows is None else rows
+            top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.payloads[rows[i]], float(scores[i])) for i in top
+                    if score_threshold is None or scores[i] >= score_threshold]
+
+    @staticmethod
+    def _metadata_values(payload, key):
+        """Returns the values of a metadata key, or of a field of the elements of a metadata list for 'list[].field'."""
+        metadata = payload.get("metadata") or {}
+        if "[]." in key:
+            list_key, field = key.split("[].", 1)
+            return [element.get(field) for element in metadata.get(list_key) or []]
+        return [metadata.get(key)]
+
+    def point_ids_where(self, key, value):
+        return set(self.points_where(key, value))
+
+    def points_where(self, key, value):
+        with self.lock:
+            return {point_id: payload for point_id, payload in zip(self.ids, self.payloads)
+                    if value in self._metadata_values(payload, key)}
+
+
+class LocalBackend:
+    """
+    In-process vector backend using exact NumPy matrix search over normalized float32
+    vectors, with an approximate index for large collections and persistence to
+    memory-mapped files. Collections are shared by all sessions of the process.
+
+    Args:
+        root (str): The directory where collections are persisted.
+    """
+
+    def __init__(self, root=LOCAL_VECTOR_STORE_PATH) -> None:
+        self.root = root
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _path(self, collection_name):
+        return os.path.join(self.root, quote(collection_name, safe=""))
+
+    def collection(self, collection_name):
+        with self._lock:
+            if collection_name not in self._collections:
+                self._collections[collection_name] = LocalCollection(self._path(collection_name))
+            return self._collections[collection_name]
+
+    def collection_exists(self, collection_name):
+        return os.path.exists(os.path.join(self._path(collection_name), "vectors.npy"))
+
+    def create_collection(self, collection_name, vector_size):
+        """Creates an empty collection, replacing any existing one."""
+        self.delete_collection(collection_name)
+        self.collection(collection_name)._save(np.zeros((0, vector_size), np.float32), [], [])
+
+    def delete_collection(self, collection_name):
+        with self._lock:
+            self._collections.pop(collection_name, None)
+            path = self._path(collection_name)
+            for file_name in ("vectors.npy", "points.json", "points.log"):
+                if os.path.exists(os.path.join(path, file_name)):
+                    os.remove(os.path.join(path, file_name))
+
+    def upsert(self, collection_name, ids, vectors, payloads):
+        self.collection(collection_name).upsert(ids, vectors, payloads)
+
+    def delete(self, collection_name, ids):
+        self.collection(collection_name).delete(ids)
+
+    def source_point_ids(self, collection_name, source):
+        return self.point_ids_where(collection_name, "source", source)
+
+    def point_ids_where(self, collection_name, key, value):
+        return self.collection(collection_name).point_ids_where(key, value)
+
+    def points_where(self, collection_name, key, value):
+        return self.collection(collection_name).points_where(key, value)
+
+    def count(self, collection_name):
+        return len(self.collection(collection_name).ids)
+
+    def metadata_filter(self, key, values):
+        """Returns a search filter matching the points whose metadata key has any of the values."""
+        return {key: list(values)}
+
+    def as_vectorstore(self, collection_name, embeddings):
+        """Returns a LangChain vector store over the collection."""
+        return LocalVectorStore(self, collection_name, embeddings)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    LangChain vector store over a collection of the LocalBackend.
+
+    Supports the same search_kwargs as the Qdrant vector store used by the Chatbot, i.e.
+    as_retriever(search_kwargs={"k": 20, "score_threshold": 0.6}), with 'filter' given as a
+    dict of metadata values.
+    """
+
+    def __init__(self, backend, collection_name, embeddings) -> None:
+        self.backend = backend
+        self.collection_name = collection_name
+        self._embeddings = embeddings
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        payloads = [{"page_content": text, "metadata": metadata} for text, metadata in zip(texts, metadatas)]
+        self.backend.upsert(self.collection_name, ids, self._embeddings.embed_documents(texts), payloads)
+        return ids
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, score_threshold=None, **kwargs):
+        results = self.backend.collection(self.collection_name).search(embedding, k, filter, score_threshold)
+        return [(Document(page_content=payload["page_content"], metadata=payload.get("metadata") or {}), score)
+                for payload, score in results]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, score_threshold=None, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embeddings.embed_query(query), k, filter, score_threshold)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, score_threshold=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter, score_threshold)]
+
+    def similarity_search(self, query, k=4, filter=None, score_threshold=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter, score_threshold)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, collection_name="documents", backend=None, **kwargs):
+        vectorstore = cls(backend or LocalBackend(), collection_name, embedding)
+        vectorstore.add_texts(texts, metadatas)
+        return vectorstore
+
+
+def _create_vector_backend():
+    if VECTOR_BACKEND == "local":
+        return LocalBackend()
+    from qdrant_client import QdrantClient
+    client = QdrantClient(url=os.environ["QDRANT_URL"], api_key=os.environ["QDRANT_KEY"])
+    if VECTOR_COLLECTION_LAYOUT == "shared":
+        return SharedQdrantBackend(client)
+    return QdrantBackend(client)
+
+
+register_resource("vector_backend", _create_vector_backend)
+
+
+def get_vector_backend():
+    """
+    Returns the process-wide vector backend selected by the VECTOR_BACKEND and
+    VECTOR_COLLECTION_LAYOUT environment variables.
+
+    Returns:
+        QdrantBackend, SharedQdrantBackend or LocalBackend: The backend storing use case collections.
+    """
+    return get_resource("vector_backend")